@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+"""
+Stands in for `youtube-dl`, without the network, for benchmarks and tests.
+Put it on `PATH` as `youtube-dl`.
+
+It understands as much of youtube-dl's command line as ytdl uses, and is
+configured through the environment:
+
+    FAKE_YOUTUBE_DL_PLAYLIST_SIZE  entries in every playlist (100)
+    FAKE_YOUTUBE_DL_FILE_SIZE      bytes written per video (1024)
+    FAKE_YOUTUBE_DL_SPEED          bytes per second per download, or 0 for
+                                   as fast as possible (0)
+    FAKE_YOUTUBE_DL_ERROR_RATE     fraction of videos that fail (0)
+    FAKE_YOUTUBE_DL_ERROR          `unavailable`, `rate-limited` or
+                                   `extractor` (unavailable)
+
+Which videos fail depends only on their IDs, so runs are repeatable.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import zlib
+
+
+VERSION = '2018.11.23'
+
+_PLAYLIST_URL = re.compile(r'[?&]list=([^&]+)')
+_PLAYLIST_ID = re.compile(r'^(?:PL|UU|LL|FL|OL)[\w-]{10,}$')
+_VIDEO_ID = re.compile(r'^[\w-]{11}$')
+
+_ERRORS = {
+    'unavailable': 'This video is unavailable.',
+    'rate-limited': (
+        'Unable to download webpage: HTTP Error 429: Too Many Requests'
+    ),
+    'extractor': (
+        'Unable to extract video data; please report this issue on'
+        ' https://yt-dl.org/bug'
+    ),
+}
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class FakeError(Exception):
+    pass
+
+
+def _setting(name, default, type=int):
+    return type(os.environ.get('FAKE_YOUTUBE_DL_' + name, default))
+
+
+def _video_id(playlist_id, index):
+    # Stable, valid looking, and unique across playlists.
+    checksum = zlib.crc32(playlist_id.encode())
+
+    return '{:05x}{:06d}'.format(checksum & 0xfffff, index)[:11]
+
+
+def _title(youtube_id):
+    return 'Fake video {}'.format(youtube_id)
+
+
+def _fails(youtube_id):
+    rate = _setting('ERROR_RATE', 0, float)
+
+    return zlib.crc32(youtube_id.encode()) / 2 ** 32 < rate
+
+
+def _check(youtube_id):
+    if not _VIDEO_ID.match(youtube_id):
+        raise FakeError('Incomplete YouTube ID {}.'.format(youtube_id))
+
+    if _fails(youtube_id):
+        kind = _setting('ERROR', 'unavailable', str)
+        raise FakeError('[youtube] {}: {}'.format(youtube_id, _ERRORS[kind]))
+
+
+def _info(youtube_id):
+    size = _setting('FILE_SIZE', 1024)
+
+    return {
+        'id': youtube_id,
+        'title': _title(youtube_id),
+        'duration': 60 + zlib.crc32(youtube_id.encode()) % 3600,
+        'upload_date': '20180101',
+        'ext': 'mp4',
+        'filesize': size,
+        'formats': [
+            {'format_id': '18', 'ext': 'mp4', 'filesize': size},
+        ],
+    }
+
+
+def _playlist_info(url, start, end):
+    match = _PLAYLIST_URL.search(url)
+    if match is None or not _PLAYLIST_ID.match(match.group(1)):
+        raise FakeError('The playlist does not exist.')
+
+    playlist_id = match.group(1)
+    size = _setting('PLAYLIST_SIZE', 100)
+    first = 0 if start is None else start - 1
+    last = size if end is None else min(size, end)
+
+    for index in range(first, last):
+        youtube_id = _video_id(playlist_id, index)
+        yield {
+            '_type': 'url',
+            'ie_key': 'Youtube',
+            'id': youtube_id,
+            'url': youtube_id,
+            'title': _title(youtube_id),
+        }
+
+
+def _read_archive(path):
+    if path is None or not os.path.exists(path):
+        return set()
+
+    with open(path) as archive:
+        return {line.split()[-1] for line in archive if line.strip()}
+
+
+def _filename(template, info):
+    return template % {
+        'id': info['id'],
+        'title': info['title'],
+        'ext': info['ext'],
+    }
+
+
+def _size(size):
+    for unit in ['B', 'KiB', 'MiB']:
+        if size < 1024:
+            break
+
+        size /= 1024
+
+    return '{:.2f}{}'.format(size, unit)
+
+
+def _report(written, total, elapsed, newline):
+    speed = written / elapsed if elapsed else None
+    if speed:
+        speed_eta = 'at {:>10}/s ETA {:02d}:{:02d}'.format(
+            _size(speed),
+            *divmod(int((total - written) / speed), 60)
+        )
+    else:
+        speed_eta = 'at Unknown speed ETA Unknown ETA'
+
+    sys.stdout.write('[download] {:>5.1f}% of {} {}{}'.format(
+        100 * written / total,
+        _size(total),
+        speed_eta,
+        '\n' if newline else '\r',
+    ))
+    sys.stdout.flush()
+
+
+def _download(youtube_id, template, rate_limit, archive, newline):
+    print('[youtube] {}: Downloading webpage'.format(youtube_id), flush=True)
+
+    info = _info(youtube_id)
+    filename = _filename(template, info)
+    print('[download] Destination: {}'.format(filename), flush=True)
+
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    speed = _setting('SPEED', 0)
+    if rate_limit:
+        speed = min(speed, rate_limit) if speed else rate_limit
+
+    started = time.monotonic()
+    written = 0
+    with open(filename + '.part', 'wb') as f:
+        while written < info['filesize']:
+            chunk = min(_CHUNK_SIZE, info['filesize'] - written)
+            f.write(b'\0' * chunk)
+            written += chunk
+            _report(
+                written,
+                info['filesize'],
+                time.monotonic() - started,
+                newline,
+            )
+
+            if speed:
+                ahead = written / speed - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    if not newline:
+        print()
+    os.rename(filename + '.part', filename)
+
+    if archive is not None:
+        with open(archive, 'a') as f:
+            f.write('youtube {}\n'.format(youtube_id))
+
+
+def _error(message):
+    sys.stderr.write('ERROR: {}\n'.format(message))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--version', action='store_true')
+    parser.add_argument('-j', '--dump-json', action='store_true')
+    parser.add_argument('--flat-playlist', action='store_true')
+    parser.add_argument('--playlist-start', type=int)
+    parser.add_argument('--playlist-end', type=int)
+    parser.add_argument('-i', '--ignore-errors', action='store_true')
+    parser.add_argument('-o', '--output', default='%(title)s-%(id)s.%(ext)s')
+    parser.add_argument('-r', '--limit-rate', type=int)
+    parser.add_argument('--download-archive')
+    parser.add_argument('--newline', action='store_true')
+    # Accepted, but every video comes in one format that needs no merging.
+    parser.add_argument('-f', '--format')
+    parser.add_argument('--merge-output-format')
+    parser.add_argument('--ffmpeg-location')
+    parser.add_argument('--fixup')
+    parser.add_argument('urls', nargs='*')
+    args = parser.parse_args()
+
+    if args.version:
+        print(VERSION)
+
+        return 0
+
+    if args.flat_playlist:
+        try:
+            for url in args.urls:
+                for entry in _playlist_info(
+                    url,
+                    args.playlist_start,
+                    args.playlist_end,
+                ):
+                    print(json.dumps(entry))
+        except FakeError as exc:
+            _error(exc)
+
+            return 1
+
+        return 0
+
+    archived = _read_archive(args.download_archive)
+
+    failed = False
+    for youtube_id in args.urls:
+        try:
+            _check(youtube_id)
+
+            if args.dump_json:
+                print(json.dumps(_info(youtube_id)), flush=True)
+            elif youtube_id not in archived:
+                _download(
+                    youtube_id,
+                    args.output,
+                    args.limit_rate,
+                    args.download_archive,
+                    args.newline,
+                )
+        except FakeError as exc:
+            _error(exc)
+            failed = True
+
+            if not args.ignore_errors:
+                return 1
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Times playlist parsing, syncing and downloading against
+`fake_youtube_dl.py`, without the network, and prints wall time, query
+counts and peak RSS for each.  Each case runs in its own process, so that
+peak RSS is its own.
+
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --sizes 10,1000 --downloads 50
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(_BENCHMARKS),
+    'src',
+    'ytdl',
+))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+
+_PLAYLIST_ID = 'PLbenchmark0000'
+
+
+def _peak_rss():
+    # In kilobytes on Linux.  youtube-dl runs in child processes.
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+def playlist_info(size):
+    from django.apps import apps
+
+    downloader = apps.get_app_config('downloader')
+    os.environ['FAKE_YOUTUBE_DL_PLAYLIST_SIZE'] = str(size)
+
+    def run():
+        count = sum(1 for _entry in downloader.get_playlist_info(_PLAYLIST_ID))
+        assert count == size
+
+    return run
+
+
+def sync(size):
+    from playlists.models import Playlist
+
+    os.environ['FAKE_YOUTUBE_DL_PLAYLIST_SIZE'] = str(size)
+    playlist = Playlist.objects.create(youtube_id=_PLAYLIST_ID)
+
+    def run():
+        result = playlist.create_and_update_videos()
+        assert result.created == size
+
+    return run
+
+
+def resync(size):
+    first_sync = sync(size)
+    first_sync()
+
+    from playlists.models import Playlist
+
+    playlist = Playlist.objects.get(youtube_id=_PLAYLIST_ID)
+
+    def run():
+        assert not playlist.create_and_update_videos().changed
+
+    return run
+
+
+def download(size):
+    from django.conf import settings
+    from django.core.management import call_command
+
+    from playlists.models import Playlist, Video
+
+    os.environ['FAKE_YOUTUBE_DL_PLAYLIST_SIZE'] = str(size)
+    Playlist.objects.create(youtube_id=_PLAYLIST_ID).create_and_update_videos()
+
+    library = os.path.dirname(settings.DATABASES['default']['NAME'])
+
+    def run():
+        call_command(
+            'download_pending',
+            directory=os.path.join(library, 'library'),
+            store_directory=os.path.join(library, 'store'),
+            stdout=io.StringIO(),
+            stderr=io.StringIO(),
+        )
+
+        if not float(os.environ['FAKE_YOUTUBE_DL_ERROR_RATE']):
+            assert not Video.objects.pending_download().exists()
+
+    return run
+
+
+CASES = {
+    'playlist_info': playlist_info,
+    'sync': sync,
+    'resync': resync,
+    'download': download,
+}
+
+
+def run_case(name, size):
+    # In a process of its own, with its own database.
+    with TemporaryDirectory() as temp_dir:
+        from django.conf import settings
+
+        settings.DATABASES['default']['NAME'] = os.path.join(
+            temp_dir,
+            'benchmark.sqlite3',
+        )
+        # So that the store isn't limited by whatever disk this is.
+        settings.STORAGE_MIN_FREE = 0
+
+        import django
+        from django.core.management import call_command
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        django.setup()
+        call_command('migrate', verbosity=0)
+
+        run = CASES[name](size)
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+
+    return {
+        'seconds': elapsed,
+        'queries': len(queries),
+        'peak_rss': _peak_rss(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10,1000,100000')
+    parser.add_argument('--downloads', type=int, default=100)
+    parser.add_argument(
+        '--file-size',
+        type=int,
+        default=1024 * 1024,
+        help='Bytes per fake video.',
+    )
+    parser.add_argument(
+        '--speed',
+        type=int,
+        default=0,
+        help='Bytes per second per fake download, or 0 for unlimited.',
+    )
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--case', choices=sorted(CASES))
+    parser.add_argument('--size', type=int)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        print(json.dumps(run_case(args.case, args.size)))
+
+        return
+
+    with TemporaryDirectory() as bin_dir:
+        os.symlink(
+            os.path.join(_BENCHMARKS, 'fake_youtube_dl.py'),
+            os.path.join(bin_dir, 'youtube-dl'),
+        )
+
+        env = dict(
+            os.environ,
+            PATH=bin_dir + os.pathsep + os.environ['PATH'],
+            FAKE_YOUTUBE_DL_FILE_SIZE=str(args.file_size),
+            FAKE_YOUTUBE_DL_SPEED=str(args.speed),
+            FAKE_YOUTUBE_DL_ERROR_RATE=str(args.error_rate),
+            # The in-process backend would go to the network.
+            YTDL_DOWNLOADER_BACKEND=(
+                'downloader.backends.process.SubprocessBackend'
+            ),
+        )
+
+        sizes = [int(size) for size in args.sizes.split(',')]
+        cases = [
+            (name, size)
+            for name in ['playlist_info', 'sync', 'resync']
+            for size in sizes
+        ] + [('download', args.downloads)]
+
+        print('{:24} {:>10} {:>10} {:>14}'.format(
+            'case',
+            'wall',
+            'queries',
+            'peak RSS',
+        ))
+        for name, size in cases:
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    '--case', name,
+                    '--size', str(size),
+                ],
+                env=env,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+            result = json.loads(output.decode().splitlines()[-1])
+
+            print('{:24} {:>9.3f}s {:>10} {:>11.1f} MB'.format(
+                '{}[{}]'.format(name, size),
+                result['seconds'],
+                result['queries'],
+                result['peak_rss'] / 1024,
+            ))
+
+
+if __name__ == '__main__':
+    main()
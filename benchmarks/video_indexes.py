@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+Times the queue and sync queries against a large `Video` table, before and
+after `playlists.0004_add_video_indexes`, and prints their query plans.
+
+    python benchmarks/video_indexes.py --rows 1000000
+"""
+import argparse
+import datetime
+import os
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'src',
+    'ytdl',
+))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+
+_BEFORE = '0003_add_playlist_last_full_sync'
+_AFTER = '0004_add_video_indexes'
+
+_PLAYLISTS = 1000
+_BATCH_SIZE = 10000
+
+
+def historical_models():
+    # As they were at `_BEFORE`; the current models have columns added by
+    # later migrations.  Only indexes change by `_AFTER`.
+    from django.db import connection
+    from django.db.migrations.executor import MigrationExecutor
+
+    state = MigrationExecutor(connection).loader.project_state(
+        ('playlists', _BEFORE),
+    )
+
+    return (
+        state.apps.get_model('playlists', 'Playlist'),
+        state.apps.get_model('playlists', 'Video'),
+    )
+
+
+def populate(rows):
+    from django.db import transaction
+    from django.utils import timezone
+
+    Playlist, Video = historical_models()
+
+    now = timezone.now()
+
+    Playlist.objects.bulk_create([
+        Playlist(youtube_id='playlist{}'.format(i)) for i in range(_PLAYLISTS)
+    ])
+    playlist_pks = list(Playlist.objects.values_list('pk', flat=True))
+
+    with transaction.atomic():
+        for start in range(0, rows, _BATCH_SIZE):
+            Video.objects.bulk_create([
+                Video(
+                    playlist_id=playlist_pks[i % _PLAYLISTS],
+                    # Each video is in two playlists.
+                    youtube_id='{:011d}'.format(i // 2),
+                    title='Title',
+                    added=now - datetime.timedelta(seconds=i),
+                    # One in a hundred still needs downloading.
+                    downloaded=None if i % 100 == 0 else now,
+                    removed=now if i % 1000 == 1 else None,
+                )
+                for i in range(start, min(start + _BATCH_SIZE, rows))
+            ])
+
+    return playlist_pks[_PLAYLISTS // 2], '{:011d}'.format(rows // 4)
+
+
+def queries(playlist_pk, youtube_id):
+    _Playlist, Video = historical_models()
+
+    # `VideoQuerySet.pending_download()`, which historical models lack.
+    pending_download = Video.objects.filter(
+        downloaded__isnull=True,
+        do_not_download=False,
+        removed__isnull=True,
+        deleted=False,
+        privated=False,
+    )
+
+    return [
+        (
+            'pending download, first page',
+            pending_download.order_by('added')[:100],
+        ),
+        (
+            'pending download, count',
+            pending_download.values('pk'),
+        ),
+        (
+            'youtube ID across playlists',
+            Video.objects.filter(youtube_id=youtube_id),
+        ),
+        (
+            'playlist reconciliation',
+            Video.objects.filter(playlist_id=playlist_pk).values_list(
+                'pk',
+                'youtube_id',
+                'title',
+            ),
+        ),
+        (
+            'playlist and youtube ID',
+            Video.objects.filter(
+                playlist_id=playlist_pk,
+                youtube_id=youtube_id,
+            ),
+        ),
+    ]
+
+
+def measure(label, playlist_pk, youtube_id, repeat):
+    from django.db import connection
+
+    print('== {}'.format(label))
+    for name, queryset in queries(playlist_pk, youtube_id):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = '; '.join(row[-1] for row in cursor.fetchall())
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            list(queryset.all())
+        elapsed = (time.perf_counter() - start) / repeat
+
+        print('{:32} {:10.2f}ms  {}'.format(name, elapsed * 1000, plan))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as temp_dir:
+        from django.conf import settings
+
+        settings.DATABASES['default']['NAME'] = os.path.join(
+            temp_dir,
+            'benchmark.sqlite3',
+        )
+
+        import django
+        from django.core.management import call_command
+
+        django.setup()
+
+        call_command('migrate', 'playlists', _BEFORE, verbosity=0)
+
+        start = time.perf_counter()
+        playlist_pk, youtube_id = populate(args.rows)
+        print('Inserted {} videos in {:.1f}s'.format(
+            args.rows,
+            time.perf_counter() - start,
+        ))
+
+        measure('Before', playlist_pk, youtube_id, args.repeat)
+
+        start = time.perf_counter()
+        call_command('migrate', 'playlists', _AFTER, verbosity=0)
+        print('Migrated in {:.1f}s'.format(time.perf_counter() - start))
+
+        measure('After', playlist_pk, youtube_id, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
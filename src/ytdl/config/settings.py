@@ -10,7 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
+import datetime
 import os
+import shutil
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -102,3 +105,220 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Downloads
+
+# `downloader.backends.process.SubprocessBackend` runs the `youtube-dl`
+# executable for everything.  `downloader.backends.inprocess.InProcessBackend`
+# drives the `youtube_dl` library on warm worker threads instead, saving
+# interpreter startup on every call.
+DOWNLOADER_BACKEND = os.environ.get(
+    'YTDL_DOWNLOADER_BACKEND',
+    'downloader.backends.process.SubprocessBackend',
+)
+
+# Where the subprocess backend remembers which `youtube-dl` it found, and
+# its version, so that it isn't run on every `manage.py` invocation.
+YOUTUBE_DL_VERSION_CACHE = os.environ.get(
+    'YTDL_YOUTUBE_DL_VERSION_CACHE',
+    os.path.join(tempfile.gettempdir(), 'ytdl-youtube-dl-version.json'),
+)
+
+# Used by the in-process backend only.
+DOWNLOADER_THREADS = int(os.environ.get('YTDL_DOWNLOADER_THREADS', 4))
+DOWNLOADER_THREAD_QUEUE_SIZE = 1000
+
+DOWNLOAD_DIRECTORY = os.environ.get(
+    'YTDL_DOWNLOAD_DIRECTORY',
+    os.path.join(BASE_DIR, 'downloads'),
+)
+
+# Each video is downloaded once into here, and linked into the directory of
+# every playlist it's in.  Hardlinks need it on the same filesystem as
+# `DOWNLOAD_DIRECTORY`.
+DOWNLOAD_STORE_DIRECTORY = os.environ.get(
+    'YTDL_DOWNLOAD_STORE_DIRECTORY',
+    os.path.join(DOWNLOAD_DIRECTORY, '.store'),
+)
+
+# How videos are laid out in the store: `'sharded'` by the first two
+# characters of their youtube IDs, or `'flat'`.  Each video's path is
+# recorded, so changing this only affects new downloads until
+# `relocate_store` is run.
+DOWNLOAD_STORE_LAYOUT = os.environ.get(
+    'YTDL_DOWNLOAD_STORE_LAYOUT',
+    'sharded',
+)
+
+# Downloads are staged here, one directory per video, before being renamed
+# into place.  Unset, they're staged in a `.staging` directory inside the
+# destination, which keeps them on the same filesystem.
+DOWNLOAD_STAGING_DIRECTORY = os.environ.get('YTDL_DOWNLOAD_STAGING_DIRECTORY')
+
+# Staged downloads still waiting to be retried keep their partial files
+# for this long, so that youtube-dl can resume them.
+DOWNLOAD_STAGING_MAX_AGE = datetime.timedelta(
+    days=int(os.environ.get('YTDL_DOWNLOAD_STAGING_MAX_AGE_DAYS', 7)),
+)
+
+# Either `'thread'` or `'process'`.
+DOWNLOAD_POOL = os.environ.get('YTDL_DOWNLOAD_POOL', 'thread')
+
+DOWNLOAD_WORKERS = int(os.environ.get('YTDL_DOWNLOAD_WORKERS', 4))
+
+DOWNLOAD_WORKERS_PER_PLAYLIST = int(
+    os.environ.get('YTDL_DOWNLOAD_WORKERS_PER_PLAYLIST', 2)
+)
+
+# Downloads are merged in a process pool of their own, so that CPU bound
+# post-processing doesn't hold up the network; 0 has youtube-dl do it as
+# part of each download instead.  The pool runs `ffmpeg` itself, so is off
+# by default without it.
+DOWNLOAD_POSTPROCESS_WORKERS = int(os.environ.get(
+    'YTDL_DOWNLOAD_POSTPROCESS_WORKERS',
+    (os.cpu_count() or 1) if shutil.which('ffmpeg') else 0,
+))
+
+
+# Bytes stored in total, and bytes of each playlist's videos, or `None` for
+# no limit.  Least recently used videos, and those gone from their
+# playlists, are evicted to make room for new downloads.
+STORAGE_QUOTA = (
+    int(os.environ['YTDL_STORAGE_QUOTA'])
+    if 'YTDL_STORAGE_QUOTA' in os.environ
+    else None
+)
+PLAYLIST_STORAGE_QUOTA = (
+    int(os.environ['YTDL_PLAYLIST_STORAGE_QUOTA'])
+    if 'YTDL_PLAYLIST_STORAGE_QUOTA' in os.environ
+    else None
+)
+
+# Bytes to always leave free on the store's volume.
+STORAGE_MIN_FREE = int(os.environ.get('YTDL_STORAGE_MIN_FREE', 2 ** 30))
+
+# Assumed size of videos with no metadata fetched.
+DOWNLOAD_SIZE_ESTIMATE = int(os.environ.get(
+    'YTDL_DOWNLOAD_SIZE_ESTIMATE',
+    500 * 2 ** 20,
+))
+
+
+# Bytes per second shared between all running downloads, or `None` for no
+# limit.
+DOWNLOAD_RATE_LIMIT = (
+    int(os.environ['YTDL_DOWNLOAD_RATE_LIMIT'])
+    if 'YTDL_DOWNLOAD_RATE_LIMIT' in os.environ
+    else None
+)
+
+# `(start, end, bytes per second)` overrides of `DOWNLOAD_RATE_LIMIT` for
+# times of day, in `TIME_ZONE`; the first to cover the current time applies.
+# For example, `[(datetime.time(9), datetime.time(17), 1000000)]`.
+DOWNLOAD_RATE_LIMIT_SCHEDULE = []
+
+# Videos downloaded per youtube-dl process; more saves process startup on
+# short videos.
+DOWNLOAD_BATCH_SIZE = int(os.environ.get('YTDL_DOWNLOAD_BATCH_SIZE', 1))
+
+# How long a worker may hold a download job before another may take it.
+# Running jobs' leases are renewed while they're downloading.
+DOWNLOAD_LEASE = datetime.timedelta(
+    seconds=int(os.environ.get('YTDL_DOWNLOAD_LEASE_SECONDS', 600)),
+)
+
+DOWNLOAD_MAX_ATTEMPTS = int(os.environ.get('YTDL_DOWNLOAD_MAX_ATTEMPTS', 3))
+
+# Backing off when youtube-dl is rate limited, in seconds.
+DOWNLOAD_BACKOFF_BASE = int(os.environ.get('YTDL_DOWNLOAD_BACKOFF_BASE', 30))
+DOWNLOAD_BACKOFF_MAX = int(os.environ.get('YTDL_DOWNLOAD_BACKOFF_MAX', 900))
+DOWNLOAD_CIRCUIT_BREAKER_THRESHOLD = int(os.environ.get(
+    'YTDL_DOWNLOAD_CIRCUIT_BREAKER_THRESHOLD',
+    5,
+))
+DOWNLOAD_CIRCUIT_BREAKER_COOLDOWN = int(os.environ.get(
+    'YTDL_DOWNLOAD_CIRCUIT_BREAKER_COOLDOWN',
+    3600,
+))
+
+# Running downloads' progress, written to `DOWNLOAD_PROGRESS_DIRECTORY` on
+# the host downloading them at most every `DOWNLOAD_PROGRESS_INTERVAL`
+# seconds per download, and copied to their jobs about as often.
+DOWNLOAD_PROGRESS_DIRECTORY = os.environ.get(
+    'YTDL_DOWNLOAD_PROGRESS_DIRECTORY',
+    os.path.join(tempfile.gettempdir(), 'ytdl-progress'),
+)
+DOWNLOAD_PROGRESS_INTERVAL = int(os.environ.get(
+    'YTDL_DOWNLOAD_PROGRESS_INTERVAL',
+    2,
+))
+
+# Downloads slower than `DOWNLOAD_STALL_SPEED` bytes per second for
+# `DOWNLOAD_STALL_TIMEOUT` seconds are killed, to free up their worker; a
+# timeout of 0 never kills them.  Time spent merging and post-processing
+# doesn't count.
+DOWNLOAD_STALL_SPEED = int(os.environ.get(
+    'YTDL_DOWNLOAD_STALL_SPEED',
+    10 * 2 ** 10,
+))
+DOWNLOAD_STALL_TIMEOUT = int(os.environ.get(
+    'YTDL_DOWNLOAD_STALL_TIMEOUT',
+    300,
+))
+
+
+# Metrics, served at `/metrics` and logged to `downloader.metrics` at
+# `INFO`.  Each process writes its own to `METRICS_DIRECTORY` every
+# `METRICS_FLUSH_INTERVAL` seconds, and on exit; those of processes that
+# have exited are added into one file as they're served.
+METRICS_DIRECTORY = os.environ.get(
+    'YTDL_METRICS_DIRECTORY',
+    os.path.join(tempfile.gettempdir(), 'ytdl-metrics'),
+)
+METRICS_FLUSH_INTERVAL = int(os.environ.get(
+    'YTDL_METRICS_FLUSH_INTERVAL',
+    10,
+))
+
+
+# Video metadata
+
+# Videos looked up per youtube-dl process.
+VIDEO_METADATA_BATCH_SIZE = int(os.environ.get(
+    'YTDL_VIDEO_METADATA_BATCH_SIZE',
+    50,
+))
+
+# How long fetched metadata is trusted before it's fetched again.
+VIDEO_METADATA_TTL = datetime.timedelta(
+    days=int(os.environ.get('YTDL_VIDEO_METADATA_TTL_DAYS', 7)),
+)
+
+# How long to wait before looking up a video youtube-dl failed on again.
+VIDEO_METADATA_RETRY_AFTER = datetime.timedelta(
+    hours=int(os.environ.get('YTDL_VIDEO_METADATA_RETRY_AFTER_HOURS', 24)),
+)
+
+
+# Playlist syncing
+
+SYNC_CONCURRENCY = int(os.environ.get('YTDL_SYNC_CONCURRENCY', 8))
+
+SYNC_PAGE_SIZE = int(os.environ.get('YTDL_SYNC_PAGE_SIZE', 100))
+
+# Incremental syncs can't see videos leaving a playlist, so fall back to a
+# full sync this often.
+FULL_SYNC_INTERVAL = datetime.timedelta(
+    hours=int(os.environ.get('YTDL_FULL_SYNC_INTERVAL_HOURS', 24)),
+)
+
+# Polling intervals for `schedule_syncs`, which adapts each playlist's
+# interval between these bounds to how often it changes.
+SYNC_DEFAULT_INTERVAL = datetime.timedelta(hours=1)
+SYNC_MIN_INTERVAL = datetime.timedelta(
+    minutes=int(os.environ.get('YTDL_SYNC_MIN_INTERVAL_MINUTES', 15)),
+)
+SYNC_MAX_INTERVAL = datetime.timedelta(
+    days=int(os.environ.get('YTDL_SYNC_MAX_INTERVAL_DAYS', 7)),
+)
@@ -0,0 +1,67 @@
+from django.contrib import admin
+
+from .models import DownloadJob, VideoMetadata
+
+
+@admin.register(DownloadJob)
+class DownloadJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'youtube_id',
+        'status',
+        'attempts',
+        'percent',
+        'speed',
+        'eta',
+        'lease_owner',
+        'lease_expires',
+    ]
+    list_filter = ['status']
+    list_select_related = ['video']
+    search_fields = ['video__youtube_id']
+    readonly_fields = [
+        'video',
+        'lease_owner',
+        'lease_expires',
+        'percent',
+        'speed',
+        'eta',
+    ]
+
+    def youtube_id(self, job):
+        return job.video.youtube_id
+
+    def _progress(self, job, field):
+        if job.status != DownloadJob.RUNNING:
+            return None
+
+        return getattr(job, field)
+
+    def percent(self, job):
+        percent = self._progress(job, 'progress_percent')
+
+        return None if percent is None else '{:.1f}%'.format(percent)
+
+    def speed(self, job):
+        speed = self._progress(job, 'progress_speed')
+
+        return None if speed is None else '{:.1f} KiB/s'.format(speed / 1024)
+
+    def eta(self, job):
+        eta = self._progress(job, 'progress_eta')
+
+        return None if eta is None else '{}:{:02}'.format(*divmod(eta, 60))
+
+
+@admin.register(VideoMetadata)
+class VideoMetadataAdmin(admin.ModelAdmin):
+    list_display = [
+        'youtube_id',
+        'duration',
+        'filesize',
+        'upload_date',
+        'fetched',
+        'failed',
+    ]
+    list_filter = ['failed']
+    search_fields = ['youtube_id']
+    readonly_fields = ['fetched']
@@ -1,16 +1,6 @@
-import json
-from tempfile import TemporaryDirectory
-import os
-import shutil
-import subprocess
-
 from django.apps import AppConfig
 
-from .exceptions import (
-    NoFilesCreatedError,
-    TooManyFilesCreatedError,
-    YoutubeDLError,
-)
+from .backends import get_backend
 
 
 class DownloaderAppConfig(AppConfig):
@@ -21,41 +11,49 @@ class DownloaderAppConfig(AppConfig):
         from . import checks  # noqa
 
     @staticmethod
-    def get_playlist_info(youtube_id):
-        try:
-            results = subprocess.check_output([
-                'youtube-dl',
-                '-j',
-                '--flat-playlist',
-                'https://www.youtube.com/playlist?list=' + youtube_id,
-            ])
-        except subprocess.CalledProcessError as exc:
-            raise YoutubeDLError(exc)
-
-        return (
-            json.loads(line) for line in results.decode().split('\n') if line
-        )
+    def get_version():
+        return get_backend().version()
 
     @staticmethod
-    def download_video(youtube_id, directory):
-        with TemporaryDirectory() as temp_dir:
-            try:
-                subprocess.run(
-                    ['youtube-dl', youtube_id],
-                    cwd=temp_dir,
-                )
-            except subprocess.CalledProcessError as exc:
-                raise YoutubeDLError(exc)
-
-            files = os.listdir(temp_dir)
+    def get_playlist_info(youtube_id, start=None, end=None):
+        return get_backend().get_playlist_info(youtube_id, start, end)
 
-            if len(files) > 1:
-                raise TooManyFilesCreatedError(files=files)
+    @staticmethod
+    def get_playlist_info_async(youtube_id, start=None, end=None):
+        return get_backend().get_playlist_info_async(youtube_id, start, end)
 
-            if len(files) == 0:
-                raise NoFilesCreatedError()
+    @staticmethod
+    def get_video_info(youtube_ids):
+        return get_backend().get_video_info(youtube_ids)
 
-            filename = files[0]
-            shutil.move(os.path.join(temp_dir, filename), directory)
+    @staticmethod
+    def download_video(
+        youtube_id,
+        directory,
+        rate_limit=None,
+        archive=None,
+        download_format=None,
+    ):
+        return get_backend().download_video(
+            youtube_id,
+            directory,
+            rate_limit=rate_limit,
+            archive=archive,
+            download_format=download_format,
+        )
 
-        return filename
+    @staticmethod
+    def download_videos(
+        youtube_ids,
+        directory,
+        rate_limit=None,
+        archive=None,
+        download_format=None,
+    ):
+        return get_backend().download_videos(
+            youtube_ids,
+            directory,
+            rate_limit=rate_limit,
+            archive=archive,
+            download_format=download_format,
+        )
@@ -0,0 +1,52 @@
+import os
+
+import attr
+
+
+def _line(youtube_id):
+    return 'youtube {}\n'.format(youtube_id)
+
+
+@attr.s
+class DownloadArchive(object):
+    # youtube-dl's `--download-archive` file, listing every video already
+    # downloaded.  youtube-dl skips those without resolving them, and adds
+    # to it itself as it finishes downloads, without any locking; so the
+    # file is only ever appended to, never rewritten, as downloads may be
+    # running on other hosts sharing it.  `StoredVideo` is the source of
+    # truth: entries for downloads that were never stored, or have since
+    # been evicted, are stale, and those videos are downloaded without the
+    # archive.
+
+    path = attr.ib()
+
+    def youtube_ids(self):
+        if not os.path.exists(self.path):
+            return set()
+
+        with open(self.path) as archive:
+            return {
+                line.split()[1]
+                for line in archive
+                if len(line.split()) == 2
+            }
+
+    def __contains__(self, youtube_id):
+        return youtube_id in self.youtube_ids()
+
+    def extend(self, youtube_ids):
+        # Re-read every time, so as not to repeat whatever youtube-dl has
+        # added since.
+        missing = set(youtube_ids) - self.youtube_ids()
+        if not missing:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as archive:
+            # In one write, like youtube-dl's own appends.
+            archive.write(''.join(
+                _line(youtube_id) for youtube_id in sorted(missing)
+            ))
+
+    def add(self, youtube_id):
+        self.extend([youtube_id])
@@ -0,0 +1,348 @@
+import asyncio
+import errno
+import os
+import re
+import shutil
+import time
+
+from django.conf import settings
+
+from .. import metrics, progress
+from ..archive import DownloadArchive
+from ..exceptions import (
+    AlreadyDownloadedError,
+    DownloadNotStartedError,
+    DownloadStalledError,
+    ExtractorBrokenError,
+    GeoBlockedError,
+    NoFilesCreatedError,
+    RateLimitedError,
+    TooManyFilesCreatedError,
+    VideoUnavailableError,
+    YoutubeDLError,
+)
+
+
+# Each video gets its own staging directory, so that whatever youtube-dl
+# leaves behind can be told apart without parsing titles.
+BATCH_OUTPUT_TEMPLATE = '%(id)s/%(title)s-%(id)s.%(ext)s'
+
+
+# Left behind by interrupted downloads, and picked up again on retry.
+_PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+
+
+def staging_directory(directory):
+    # Staging on the destination's filesystem makes the final move a rename
+    # rather than a copy.
+    return settings.DOWNLOAD_STAGING_DIRECTORY or os.path.join(
+        directory,
+        '.staging',
+    )
+
+
+def clean_staging(directory, keep):
+    root = staging_directory(directory)
+    if not os.path.isdir(root):
+        return []
+
+    oldest = time.time() - settings.DOWNLOAD_STAGING_MAX_AGE.total_seconds()
+
+    removed = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in keep and os.path.getmtime(path) >= oldest:
+            continue
+
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(name)
+
+    return removed
+
+
+def finished_files(path):
+    if not os.path.isdir(path):
+        return []
+
+    return [
+        filename
+        for filename in os.listdir(path)
+        if not filename.endswith(_PARTIAL_SUFFIXES)
+    ]
+
+
+def _max_files(download_format):
+    if download_format is None or download_format.postprocess:
+        return 1
+
+    # Separate video and audio, before they're merged, and the thumbnail
+    # that's to be embedded into them.
+    return 3 if download_format.embed_thumbnail else 2
+
+
+def _keep(staging, files, directory, download_format):
+    # Returns what the download came to, and the paths of its files.  That's
+    # its filename, once moved into `directory`; or its staging directory,
+    # if post-processing is still to come.
+    if download_format is not None and not download_format.postprocess:
+        return staging, [os.path.join(staging, name) for name in files]
+
+    filename = files[0]
+    move_file(os.path.join(staging, filename), directory)
+    shutil.rmtree(staging, ignore_errors=True)
+
+    return filename, [os.path.join(directory, filename)]
+
+
+def move_file(source, directory):
+    destination = os.path.join(directory, os.path.basename(source))
+
+    try:
+        os.rename(source, destination)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+
+        # The staging directory was configured onto another filesystem.
+        shutil.move(source, destination)
+
+
+# Checked in order, against youtube-dl's error output.
+_ERROR_PATTERNS = [
+    (DownloadNotStartedError, re.compile(r'not started', re.IGNORECASE)),
+    (DownloadStalledError, re.compile(r'download stalled', re.IGNORECASE)),
+    (RateLimitedError, re.compile(
+        r'HTTP Error 429|Too Many Requests',
+        re.IGNORECASE,
+    )),
+    (GeoBlockedError, re.compile(
+        r'not (?:made this video )?available in your country'
+        r'|geo.?restrict',
+        re.IGNORECASE,
+    )),
+    (VideoUnavailableError, re.compile(
+        r'video (?:is )?unavailable|private video|has been removed'
+        r'|has been terminated|no longer available',
+        re.IGNORECASE,
+    )),
+    (ExtractorBrokenError, re.compile(
+        r'unable to extract|please report this issue',
+        re.IGNORECASE,
+    )),
+]
+
+
+def classify_error(message):
+    message = message.strip()
+
+    for error_class, pattern in _ERROR_PATTERNS:
+        if pattern.search(message):
+            return error_class(message)
+
+    return YoutubeDLError(message)
+
+
+def stalled_message(youtube_id, stall):
+    return (
+        '[youtube] {}: Download stalled; slower than {} bytes per second for'
+        ' {} seconds.'.format(youtube_id, stall.speed, stall.timeout)
+    )
+
+
+def not_started_message(youtube_id):
+    return (
+        '[youtube] {}: Download not started; youtube-dl was stopped when an'
+        ' earlier download in its batch stalled.'.format(youtube_id)
+    )
+
+
+def error_messages(stderr, youtube_ids):
+    youtube_ids = set(youtube_ids)
+
+    messages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('ERROR:'):
+            continue
+
+        # Lines look like `ERROR: [youtube] <id>: <message>`.
+        for word in re.split(r'[\s:]+', line):
+            if word in youtube_ids:
+                messages.setdefault(word, line)
+
+    return messages
+
+
+def _observe_downloads(started, paths, failed):
+    elapsed = time.perf_counter() - started
+    sizes = [os.path.getsize(path) for path in paths]
+
+    metrics.observe('ytdl_download_seconds', elapsed)
+    for size in sizes:
+        metrics.observe('ytdl_download_bytes', size)
+    if sizes and elapsed:
+        metrics.observe('ytdl_download_bytes_per_second', sum(sizes) / elapsed)
+
+    metrics.increment('ytdl_downloads_total', len(sizes), outcome='success')
+    metrics.increment('ytdl_downloads_total', failed, outcome='failure')
+
+    # Downloads may run in pool processes, which never exit cleanly.
+    metrics.flush()
+
+
+class BaseBackend(object):
+
+    def version(self):
+        raise NotImplementedError()
+
+    def get_playlist_info(self, youtube_id, start=None, end=None):
+        raise NotImplementedError()
+
+    async def get_playlist_info_async(self, youtube_id, start=None, end=None):
+        loop = asyncio.get_event_loop()
+        results = await loop.run_in_executor(None, lambda: list(
+            self.get_playlist_info(youtube_id, start, end)
+        ))
+
+        for result in results:
+            yield result
+
+    def get_video_info(self, youtube_ids):
+        # Full info for each video youtube-dl could find, in one go.
+        raise NotImplementedError()
+
+    def _download(self, youtube_id, cwd, rate_limit, archive, download_format):
+        raise NotImplementedError()
+
+    def _download_batch(
+        self,
+        youtube_ids,
+        cwd,
+        rate_limit,
+        archive,
+        download_format,
+    ):
+        # Returns youtube-dl's error output.
+        raise NotImplementedError()
+
+    def download_video(
+        self,
+        youtube_id,
+        directory,
+        rate_limit=None,
+        archive=None,
+        download_format=None,
+    ):
+        started = time.perf_counter()
+        try:
+            result = self._download_video(
+                youtube_id,
+                directory,
+                rate_limit,
+                archive,
+                download_format,
+            )
+        except Exception:
+            _observe_downloads(started, [], failed=1)
+            raise
+        finally:
+            progress.store.clear(youtube_id)
+
+        filename, paths = result
+        _observe_downloads(started, paths, failed=0)
+
+        return filename
+
+    def _download_video(
+        self,
+        youtube_id,
+        directory,
+        rate_limit,
+        archive,
+        download_format,
+    ):
+        staging = os.path.join(staging_directory(directory), youtube_id)
+        os.makedirs(staging, exist_ok=True)
+
+        self._download(
+            youtube_id,
+            staging,
+            rate_limit,
+            archive,
+            download_format,
+        )
+
+        files = finished_files(staging)
+
+        if len(files) > _max_files(download_format):
+            shutil.rmtree(staging, ignore_errors=True)
+            raise TooManyFilesCreatedError(files=files)
+
+        if len(files) == 0:
+            if archive is not None and youtube_id in DownloadArchive(archive):
+                raise AlreadyDownloadedError()
+
+            raise NoFilesCreatedError()
+
+        return _keep(staging, files, directory, download_format)
+
+    def download_videos(
+        self,
+        youtube_ids,
+        directory,
+        rate_limit=None,
+        archive=None,
+        download_format=None,
+    ):
+        filenames = {}
+        errors = {}
+
+        staging = staging_directory(directory)
+        os.makedirs(staging, exist_ok=True)
+
+        started = time.perf_counter()
+        try:
+            stderr = self._download_batch(
+                youtube_ids,
+                staging,
+                rate_limit,
+                archive,
+                download_format,
+            )
+        except Exception:
+            _observe_downloads(started, [], len(youtube_ids))
+            raise
+        finally:
+            for youtube_id in youtube_ids:
+                progress.store.clear(youtube_id)
+
+        messages = error_messages(stderr, youtube_ids)
+        archived = set()
+        if archive is not None:
+            archived = DownloadArchive(archive).youtube_ids()
+
+        paths = []
+        for youtube_id in youtube_ids:
+            video_staging = os.path.join(staging, youtube_id)
+            files = finished_files(video_staging)
+
+            if len(files) > _max_files(download_format):
+                shutil.rmtree(video_staging, ignore_errors=True)
+                errors[youtube_id] = TooManyFilesCreatedError(files=files)
+            elif youtube_id in messages:
+                errors[youtube_id] = classify_error(messages[youtube_id])
+            elif len(files) == 0 and youtube_id in archived:
+                errors[youtube_id] = AlreadyDownloadedError()
+            elif len(files) == 0:
+                errors[youtube_id] = NoFilesCreatedError()
+            else:
+                filenames[youtube_id], video_paths = _keep(
+                    video_staging,
+                    files,
+                    directory,
+                    download_format,
+                )
+                paths += video_paths
+
+        _observe_downloads(started, paths, len(errors))
+
+        return filenames, errors
@@ -0,0 +1,273 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import os
+import queue
+import threading
+
+from django.conf import settings
+
+from .. import progress
+from ..exceptions import DownloadStalledError
+from ..formats import DownloadFormat
+from .base import (
+    BATCH_OUTPUT_TEMPLATE,
+    BaseBackend,
+    classify_error,
+    stalled_message,
+)
+
+
+_DONE = object()
+
+# youtube-dl's own default.
+_OUTPUT_TEMPLATE = '%(title)s-%(id)s.%(ext)s'
+
+
+class _Logger(object):
+
+    def __init__(self):
+        self.errors = []
+
+    def debug(self, message):
+        pass
+
+    def warning(self, message):
+        pass
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+class InProcessBackend(BaseBackend):
+    # Each worker thread keeps its own warm `YoutubeDL`, as they aren't
+    # safe to share between threads.
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(settings.DOWNLOADER_THREADS)
+        self._local = threading.local()
+
+    def _youtube_dl(self, **params):
+        # Every call starts from the same params, whatever the thread's
+        # previous call set.
+        from youtube_dl.postprocessor import get_postprocessor
+
+        youtube_dl = getattr(self._local, 'youtube_dl', None)
+        if youtube_dl is None:
+            import youtube_dl as youtube_dl_module
+
+            self._local.logger = _Logger()
+            youtube_dl = youtube_dl_module.YoutubeDL({
+                'logger': self._local.logger,
+                'quiet': True,
+                'no_warnings': True,
+                'noprogress': True,
+            })
+            youtube_dl.add_progress_hook(self._progress_hook)
+            self._local.youtube_dl = youtube_dl
+            self._local.params = dict(youtube_dl.params)
+
+        youtube_dl.params.clear()
+        youtube_dl.params.update(self._local.params, **params)
+        self._local.logger.errors = []
+
+        # youtube-dl only reads post-processors from its params as it's
+        # made.
+        del youtube_dl._pps[:]
+        for definition in youtube_dl.params.get('postprocessors', []):
+            definition = dict(definition)
+            postprocessor = get_postprocessor(definition.pop('key'))
+            youtube_dl.add_post_processor(
+                postprocessor(youtube_dl, **definition),
+            )
+
+        return youtube_dl
+
+    def _progress_hook(self, status):
+        if status.get('status') != 'downloading':
+            return
+
+        total = status.get('total_bytes') or status.get('total_bytes_estimate')
+        reported = progress.Progress(
+            percent=(
+                100 * status['downloaded_bytes'] / total
+                if total and 'downloaded_bytes' in status
+                else None
+            ),
+            speed=status.get('speed'),
+            eta=status.get('eta'),
+            total=total,
+        )
+
+        # youtube-dl only calls this as data arrives, so unlike with the
+        # subprocess backend, a download that has stopped altogether isn't
+        # noticed; one that has slowed to a trickle is.
+        youtube_id = self._local.youtube_id
+        stall = self._local.stall
+        stall.update(reported)
+        progress.store.update(youtube_id, reported)
+
+        if stall.stalled:
+            raise DownloadStalledError(stalled_message(youtube_id, stall))
+
+    def _call(self, function, *args):
+        return self._executor.submit(function, *args).result()
+
+    def version(self):
+        import youtube_dl.version
+
+        return youtube_dl.version.__version__
+
+    def _produce_playlist_info(self, url, start, end, results, cancelled):
+        from youtube_dl.utils import DownloadError
+
+        def put(item):
+            while not cancelled.is_set():
+                try:
+                    results.put(item, timeout=1)
+                except queue.Full:
+                    continue
+
+                return
+
+        try:
+            youtube_dl = self._youtube_dl()
+            info = youtube_dl.extract_info(url, download=False, process=False)
+            if info is None:
+                raise classify_error(
+                    '\n'.join(self._local.logger.errors)
+                    or 'No playlist info for {}'.format(url)
+                )
+
+            entries = info.get('entries') or []
+
+            first = 0 if start is None else start - 1
+            if hasattr(entries, 'getslice'):
+                entries = entries.getslice(first, end)
+            else:
+                entries = islice(entries, first, end)
+
+            for entry in entries:
+                if cancelled.is_set():
+                    return
+
+                put(entry)
+        except DownloadError as exc:
+            put(classify_error(str(exc)))
+        except Exception as exc:
+            put(exc)
+        else:
+            put(_DONE)
+
+    def _stream_playlist_info(self, item, results, cancelled):
+        try:
+            while item is not _DONE:
+                if isinstance(item, Exception):
+                    raise item
+
+                yield item
+                item = results.get()
+        finally:
+            # The consumer may stop early; let the worker go.
+            cancelled.set()
+
+    def get_playlist_info(self, youtube_id, start=None, end=None):
+        results = queue.Queue(maxsize=settings.DOWNLOADER_THREAD_QUEUE_SIZE)
+        cancelled = threading.Event()
+
+        self._executor.submit(
+            self._produce_playlist_info,
+            'https://www.youtube.com/playlist?list=' + youtube_id,
+            start,
+            end,
+            results,
+            cancelled,
+        )
+
+        # Block until the first entry arrives, so that a garbage playlist
+        # raises here rather than on first iteration.
+        first = results.get()
+        if isinstance(first, Exception):
+            cancelled.set()
+            raise first
+
+        return self._stream_playlist_info(first, results, cancelled)
+
+    def _extract_video_info(self, youtube_ids):
+        from youtube_dl.utils import DownloadError
+
+        youtube_dl = self._youtube_dl(ignoreerrors=True)
+
+        try:
+            results = [
+                youtube_dl.extract_info(youtube_id, download=False)
+                for youtube_id in youtube_ids
+            ]
+        except DownloadError as exc:
+            raise classify_error(str(exc))
+
+        results = [result for result in results if result]
+        if youtube_ids and not results and self._local.logger.errors:
+            raise classify_error('\n'.join(self._local.logger.errors))
+
+        return results
+
+    def get_video_info(self, youtube_ids):
+        return self._call(self._extract_video_info, list(youtube_ids))
+
+    def _run_download(
+        self,
+        youtube_ids,
+        output_template,
+        ignore_errors,
+        rate_limit,
+        archive,
+        download_format,
+    ):
+        from youtube_dl.utils import DownloadError
+
+        youtube_dl = self._youtube_dl(
+            outtmpl=output_template,
+            ignoreerrors=ignore_errors,
+            ratelimit=rate_limit,
+            download_archive=archive,
+            **(download_format or DownloadFormat()).params()
+        )
+
+        try:
+            for youtube_id in youtube_ids:
+                self._local.youtube_id = youtube_id
+                self._local.stall = progress.StallDetector()
+                youtube_dl.download([youtube_id])
+        except DownloadError as exc:
+            raise classify_error(str(exc))
+
+        return '\n'.join(self._local.logger.errors)
+
+    def _download(self, youtube_id, cwd, rate_limit, archive, download_format):
+        self._call(
+            self._run_download,
+            [youtube_id],
+            os.path.join(cwd, _OUTPUT_TEMPLATE),
+            False,
+            rate_limit,
+            archive,
+            download_format,
+        )
+
+    def _download_batch(
+        self,
+        youtube_ids,
+        cwd,
+        rate_limit,
+        archive,
+        download_format,
+    ):
+        return self._call(
+            self._run_download,
+            list(youtube_ids),
+            os.path.join(cwd, BATCH_OUTPUT_TEMPLATE),
+            True,
+            rate_limit,
+            archive,
+            download_format,
+        )
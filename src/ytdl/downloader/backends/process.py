@@ -0,0 +1,393 @@
+import asyncio
+import json
+import os
+import re
+import selectors
+import shutil
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+
+from .. import metrics, progress
+from .base import (
+    BATCH_OUTPUT_TEMPLATE,
+    BaseBackend,
+    classify_error,
+    not_started_message,
+    stalled_message,
+)
+
+
+# How often a silent youtube-dl is checked on for stalling, in seconds.
+_POLL_INTERVAL = 1
+
+
+def _playlist_info_args(youtube_id, start=None, end=None):
+    args = ['youtube-dl', '-j', '--flat-playlist']
+
+    if start is not None:
+        args += ['--playlist-start', str(start)]
+
+    if end is not None:
+        args += ['--playlist-end', str(end)]
+
+    return args + ['https://www.youtube.com/playlist?list=' + youtube_id]
+
+
+def _download_args(rate_limit, archive, download_format):
+    args = []
+
+    if download_format is not None:
+        args += download_format.args()
+
+    if rate_limit is not None:
+        args += ['--limit-rate', str(rate_limit)]
+
+    if archive is not None:
+        args += ['--download-archive', archive]
+
+    return args
+
+
+def _read_line(process):
+    for line in process.stdout:
+        if line.strip():
+            return line
+
+    return None
+
+
+def _error(returncode, args, stderr):
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode(errors='replace')
+
+    return classify_error(
+        stderr or str(subprocess.CalledProcessError(returncode, args))
+    )
+
+
+def _finish(process, stderr):
+    process.stdout.close()
+    returncode = process.wait()
+
+    if returncode:
+        stderr.seek(0)
+        raise _error(returncode, process.args, stderr.read())
+
+
+def _observe_run(command, started, parsing):
+    metrics.observe('ytdl_youtube_dl_parse_seconds', parsing, command=command)
+    metrics.observe(
+        'ytdl_youtube_dl_seconds',
+        time.perf_counter() - started,
+        command=command,
+    )
+
+
+def _stream_playlist_info(process, first_line, stderr, started):
+    parsing = 0
+
+    try:
+        line = first_line
+        while line is not None:
+            parse_started = time.perf_counter()
+            entry = json.loads(line)
+            parsing += time.perf_counter() - parse_started
+
+            yield entry
+            line = _read_line(process)
+
+        _finish(process, stderr)
+    finally:
+        # The consumer may stop early; don't leave youtube-dl running.
+        if process.poll() is None:
+            process.kill()
+            process.stdout.close()
+            process.wait()
+
+        stderr.close()
+        _observe_run('playlist_info', started, parsing)
+
+
+def _lines(process, timeout):
+    # youtube-dl's output, line by line, and `None` whenever it has been
+    # quiet for `timeout` seconds.  Read straight from the pipe, as a
+    # buffered read could wait on output that isn't coming.
+    fd = process.stdout.fileno()
+    buffered = b''
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+
+        while True:
+            if not selector.select(timeout):
+                yield None
+
+                continue
+
+            chunk = os.read(fd, 64 * 1024)
+            if not chunk:
+                break
+
+            # Without `--newline`, progress lines end in carriage returns.
+            lines = re.split(br'[\r\n]', buffered + chunk)
+            buffered = lines.pop()
+            for line in lines:
+                yield line.decode(errors='replace')
+
+    if buffered:
+        yield buffered.decode(errors='replace')
+
+
+def _run_download(args, cwd, youtube_ids):
+    # Records each video's progress as youtube-dl reports it, and kills
+    # youtube-dl if the download stalls.  Returns its exit status and error
+    # output.
+    youtube_ids = list(youtube_ids)
+    current = youtube_ids[0]
+    stall = progress.StallDetector()
+    stalled = False
+
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        args,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+    )
+
+    try:
+        for line in _lines(process, _POLL_INTERVAL):
+            if line is not None:
+                youtube_id = progress.parse_video(line)
+                if youtube_id in youtube_ids:
+                    current = youtube_id
+
+                reported = progress.parse_line(line)
+                if reported is not None:
+                    stall.update(reported)
+                    progress.store.update(current, reported)
+                elif progress.is_postprocessing(line):
+                    stall.pause()
+
+            if stall.stalled:
+                stalled = True
+
+                break
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+        process.stdout.close()
+        returncode = process.wait()
+
+        stderr.seek(0)
+        output = stderr.read().decode(errors='replace')
+        stderr.close()
+
+    if stalled:
+        output += 'ERROR: {}\n'.format(stalled_message(current, stall))
+        # Those youtube-dl hadn't got to yet weren't tried at all.
+        for youtube_id in youtube_ids[youtube_ids.index(current) + 1:]:
+            output += 'ERROR: {}\n'.format(not_started_message(youtube_id))
+        returncode = returncode or 1
+
+    return returncode, output
+
+
+def _read_version_cache():
+    try:
+        with open(settings.YOUTUBE_DL_VERSION_CACHE) as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_version_cache(cached):
+    path = settings.YOUTUBE_DL_VERSION_CACHE
+    temp_path = '{}.{}'.format(path, os.getpid())
+
+    # Best effort; an unwritable cache only costs a subprocess next time.
+    try:
+        with open(temp_path, 'w') as cache:
+            json.dump(cached, cache)
+
+        os.replace(temp_path, path)
+    except OSError:
+        pass
+
+
+class SubprocessBackend(BaseBackend):
+
+    def __init__(self):
+        self._cached = {}
+
+    def version(self):
+        # Running `youtube-dl --version` costs an interpreter startup, so
+        # only do it when the executable on the `PATH` has changed.
+        path = shutil.which('youtube-dl')
+        if path is None:
+            raise FileNotFoundError('`youtube-dl` is not on the `PATH`.')
+
+        key = {'path': path, 'mtime': os.stat(path).st_mtime}
+        if self._cached.get('key') != key:
+            self._cached = _read_version_cache()
+
+        if self._cached.get('key') != key:
+            version = subprocess.check_output(
+                [path, '--version'],
+                universal_newlines=True,
+            ).strip()
+
+            self._cached = {'key': key, 'version': version}
+            _write_version_cache(self._cached)
+
+        return self._cached['version']
+
+    def get_playlist_info(self, youtube_id, start=None, end=None):
+        # Spooled to a file rather than a pipe, which could fill up and
+        # stall youtube-dl while only stdout is being read.
+        stderr = tempfile.TemporaryFile()
+        started = time.perf_counter()
+        with metrics.timer(
+            'ytdl_youtube_dl_spawn_seconds',
+            command='playlist_info',
+        ):
+            process = subprocess.Popen(
+                _playlist_info_args(youtube_id, start, end),
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+            )
+
+        # Block until the first entry arrives, so that a garbage playlist
+        # raises here rather than on first iteration.
+        first_line = _read_line(process)
+        metrics.observe(
+            'ytdl_youtube_dl_first_line_seconds',
+            time.perf_counter() - started,
+            command='playlist_info',
+        )
+        if first_line is None:
+            try:
+                _finish(process, stderr)
+            except Exception:
+                stderr.close()
+                _observe_run('playlist_info', started, 0)
+                raise
+
+        return _stream_playlist_info(process, first_line, stderr, started)
+
+    async def get_playlist_info_async(self, youtube_id, start=None, end=None):
+        args = _playlist_info_args(youtube_id, start, end)
+        started = time.perf_counter()
+        with metrics.timer(
+            'ytdl_youtube_dl_spawn_seconds',
+            command='playlist_info',
+        ):
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        # Drained alongside stdout, so that neither pipe fills and stalls
+        # youtube-dl.
+        stderr = asyncio.ensure_future(process.stderr.read())
+
+        parsing = 0
+        first = True
+        try:
+            async for line in process.stdout:
+                if not line.strip():
+                    continue
+
+                if first:
+                    first = False
+                    metrics.observe(
+                        'ytdl_youtube_dl_first_line_seconds',
+                        time.perf_counter() - started,
+                        command='playlist_info',
+                    )
+
+                parse_started = time.perf_counter()
+                entry = json.loads(line)
+                parsing += time.perf_counter() - parse_started
+
+                yield entry
+
+            returncode = await process.wait()
+        finally:
+            # The consumer may stop early; don't leave youtube-dl running.
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+            stderr_output = await stderr
+            _observe_run('playlist_info', started, parsing)
+
+        if returncode:
+            raise _error(returncode, args, stderr_output)
+
+    def get_video_info(self, youtube_ids):
+        args = ['youtube-dl', '-j', '--ignore-errors', '--'] + list(
+            youtube_ids,
+        )
+        started = time.perf_counter()
+        process = subprocess.run(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+        parse_started = time.perf_counter()
+        results = [
+            json.loads(line)
+            for line in process.stdout.splitlines()
+            if line.strip()
+        ]
+        _observe_run(
+            'video_info',
+            started,
+            time.perf_counter() - parse_started,
+        )
+        if process.returncode and not results:
+            raise _error(process.returncode, args, process.stderr)
+
+        return results
+
+    def _download(self, youtube_id, cwd, rate_limit, archive, download_format):
+        args = (
+            ['youtube-dl', '--newline']
+            + _download_args(rate_limit, archive, download_format)
+            + ['--', youtube_id]
+        )
+
+        returncode, stderr = _run_download(args, cwd, [youtube_id])
+        if returncode:
+            raise _error(returncode, args, stderr)
+
+    def _download_batch(
+        self,
+        youtube_ids,
+        cwd,
+        rate_limit,
+        archive,
+        download_format,
+    ):
+        _returncode, stderr = _run_download(
+            [
+                'youtube-dl',
+                '--newline',
+                '--ignore-errors',
+                '-o', BATCH_OUTPUT_TEMPLATE,
+            ]
+            + _download_args(rate_limit, archive, download_format)
+            + ['--']
+            + list(youtube_ids),
+            cwd,
+            youtube_ids,
+        )
+
+        return stderr
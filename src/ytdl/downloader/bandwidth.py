@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.utils import timezone
+
+import attr
+
+
+def current_rate_limit():
+    now = timezone.localtime().time()
+
+    for start, end, rate_limit in settings.DOWNLOAD_RATE_LIMIT_SCHEDULE:
+        if start <= end:
+            applies = start <= now < end
+        else:
+            # Spans midnight.
+            applies = now >= start or now < end
+
+        if applies:
+            return rate_limit
+
+    return settings.DOWNLOAD_RATE_LIMIT
+
+
+@attr.s
+class BandwidthScheduler(object):
+    # Splits the current rate limit between running downloads.  youtube-dl
+    # can't change its `--limit-rate` once started, so shares are worked
+    # out as each download starts, from whatever the others aren't using.
+
+    rate_limit = attr.ib(default=attr.Factory(lambda: current_rate_limit))
+
+    _allocated = attr.ib(default=0, init=False)
+
+    def has_room(self, slots):
+        # Whether a download started now would get at least an even split
+        # across every slot, without going over the budget.
+        budget = self.rate_limit()
+        if budget is None:
+            return True
+
+        return budget - self._allocated >= budget / slots
+
+    def acquire(self, expected, slots):
+        budget = self.rate_limit()
+        if budget is None:
+            return None
+
+        fair_share = budget / max(1, expected)
+        # Never less than an even split across every slot, so that a
+        # download started while others are running still moves, but never
+        # more than what's left of the budget either.
+        remaining = max(0, budget - self._allocated)
+        rate = int(min(max(fair_share, budget / slots), remaining))
+
+        self._allocated += rate
+
+        return rate
+
+    def release(self, rate):
+        if rate is not None:
+            self._allocated = max(0, self._allocated - rate)
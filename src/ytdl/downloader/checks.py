@@ -1,8 +1,11 @@
-import os
+import shutil
 import subprocess
 
+from django.conf import settings
 from django.core.checks import Critical, register
 
+from .backends import get_backend
+
 
 @register()
 def check_youtube_dl_is_installed(app_configs, **kwargs):
@@ -12,10 +15,27 @@ def check_youtube_dl_is_installed(app_configs, **kwargs):
         id='downloader.E_YOUTUBE_DL_NOT_INSTALLED',
     )
 
-    with open(os.devnull, 'w') as devnull:
-        try:
-            subprocess.check_call(['youtube-dl', '--version'], stdout=devnull)
-        except subprocess.SubprocessError:
-            return [error]
+    try:
+        get_backend().version()
+    except (ImportError, OSError, subprocess.SubprocessError):
+        return [error]
 
     return []
+
+
+@register()
+def check_ffmpeg_is_installed(app_configs, **kwargs):
+    if not settings.DOWNLOAD_POSTPROCESS_WORKERS:
+        return []
+
+    if shutil.which('ffmpeg') is not None:
+        return []
+
+    return [Critical(
+        '`ffmpeg` is not installed, but downloads are to be post-processed.',
+        hint=(
+            'Install `ffmpeg`, or set `YTDL_DOWNLOAD_POSTPROCESS_WORKERS` to '
+            '0.'
+        ),
+        id='downloader.E_FFMPEG_NOT_INSTALLED',
+    )]
@@ -12,3 +12,38 @@ class TooManyFilesCreatedError(YoutubeDLError):
 
 class NoFilesCreatedError(YoutubeDLError):
     pass
+
+
+class AlreadyDownloadedError(YoutubeDLError):
+    # youtube-dl skipped the video, as its download archive lists it.
+    pass
+
+
+class RateLimitedError(YoutubeDLError):
+    pass
+
+
+class VideoUnavailableError(YoutubeDLError):
+    pass
+
+
+class GeoBlockedError(VideoUnavailableError):
+    pass
+
+
+class ExtractorBrokenError(YoutubeDLError):
+    pass
+
+
+class DownloadStalledError(YoutubeDLError):
+    pass
+
+
+class DownloadNotStartedError(YoutubeDLError):
+    # youtube-dl was stopped before it got to the video, as another in its
+    # batch stalled.
+    pass
+
+
+class PostProcessingError(Exception):
+    pass
@@ -0,0 +1,78 @@
+import os
+
+import attr
+
+
+# What youtube-dl picks by default, when it's able to merge.
+_DEFAULT_SELECTOR = 'bestvideo+bestaudio/best'
+
+
+@attr.s(frozen=True)
+class DownloadFormat(object):
+    # youtube-dl's `--format` selector, and the container to merge separate
+    # video and audio into; `None` leaves either to youtube-dl.
+    selector = attr.ib(default=None)
+    merge_output_format = attr.ib(default=None)
+    # When false, youtube-dl only fetches the raw streams, and leaves them
+    # unmerged and unfixed for `postprocess.postprocess` to deal with.
+    postprocess = attr.ib(default=True)
+    # Keep only the audio, whatever youtube-dl had to settle for.
+    extract_audio = attr.ib(default=False)
+    # Only done by `postprocess.postprocess`; youtube-dl itself fails the
+    # download when it can't embed into the container it ends up with.
+    embed_thumbnail = attr.ib(default=False)
+
+    def _selector(self):
+        if self.selector is None and not self.postprocess:
+            # youtube-dl settles for `best` when it can't merge.
+            return _DEFAULT_SELECTOR
+
+        return self.selector
+
+    def args(self):
+        args = []
+
+        selector = self._selector()
+        if selector is not None:
+            args += ['--format', selector]
+
+        if self.postprocess:
+            if self.merge_output_format is not None:
+                args += ['--merge-output-format', self.merge_output_format]
+
+            if self.extract_audio:
+                args.append('--extract-audio')
+        else:
+            # youtube-dl has no switch for not merging, but leaves the
+            # streams as they are when it can't find ffmpeg.
+            args += ['--ffmpeg-location', os.devnull]
+
+            if self.embed_thumbnail:
+                args.append('--write-thumbnail')
+
+        return args
+
+    def params(self):
+        if not self.postprocess:
+            return {
+                'format': self._selector(),
+                'merge_output_format': None,
+                'ffmpeg_location': os.devnull,
+                'writethumbnail': self.embed_thumbnail,
+                'postprocessors': [],
+            }
+
+        postprocessors = []
+        if self.extract_audio:
+            postprocessors.append({
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'best',
+            })
+
+        return {
+            'format': self.selector,
+            'merge_output_format': self.merge_output_format,
+            'ffmpeg_location': None,
+            'writethumbnail': False,
+            'postprocessors': postprocessors,
+        }
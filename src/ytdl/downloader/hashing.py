@@ -0,0 +1,24 @@
+import hashlib
+
+
+_CHUNK_SIZE = 2 ** 20
+
+
+def file_digest(path):
+    # Read through one reused buffer, so that hashing a video takes a
+    # megabyte of memory however big it is.
+    digest = hashlib.sha256()
+    size = 0
+
+    buffer = bytearray(_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+
+            digest.update(view[:read])
+            size += read
+
+    return size, digest.hexdigest()
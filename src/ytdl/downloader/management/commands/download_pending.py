@@ -0,0 +1,350 @@
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    wait as wait_for,
+)
+import os
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+import attr
+
+from downloader import progress
+from downloader.backends.base import clean_staging
+from downloader.bandwidth import BandwidthScheduler
+from downloader.exceptions import (
+    AlreadyDownloadedError,
+    DownloadNotStartedError,
+    RateLimitedError,
+    VideoUnavailableError,
+)
+from downloader.formats import DownloadFormat
+from downloader.models import DownloadJob, StoredVideo
+from downloader.models.download_job import make_lease_owner
+from downloader.pool import EXECUTORS, DownloadPool, Task
+from downloader.postprocess import postprocess
+from downloader.quota import Quota
+from downloader.storage import Store
+from downloader.throttle import Throttle
+from playlists.models import Video
+
+
+class Command(BaseCommand):
+    help = (
+        'Queue every video waiting to be downloaded, then work through the'
+        ' queue alongside any other workers sharing the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            default=settings.DOWNLOAD_DIRECTORY,
+        )
+        parser.add_argument(
+            '--store-directory',
+            default=settings.DOWNLOAD_STORE_DIRECTORY,
+        )
+        parser.add_argument(
+            '--pool',
+            choices=sorted(EXECUTORS),
+            default=settings.DOWNLOAD_POOL,
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.DOWNLOAD_WORKERS,
+        )
+        parser.add_argument(
+            '--workers-per-playlist',
+            type=int,
+            default=settings.DOWNLOAD_WORKERS_PER_PLAYLIST,
+        )
+        parser.add_argument(
+            '--postprocess-workers',
+            type=int,
+            default=settings.DOWNLOAD_POSTPROCESS_WORKERS,
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.DOWNLOAD_BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        self.store = Store(
+            root=options['store_directory'],
+            library=options['directory'],
+        )
+        os.makedirs(self.store.incoming, exist_ok=True)
+
+        cleaned = clean_staging(self.store.incoming, keep=set(
+            Video.objects.pending_download().values_list(
+                'youtube_id',
+                flat=True,
+            ),
+        ))
+        if cleaned:
+            self.stdout.write('Cleaned up {} staged downloads.'.format(
+                len(cleaned),
+            ))
+
+        self.quota = Quota(self.store)
+        self.pool = pool = DownloadPool(
+            directory=self.store.incoming,
+            max_workers=options['workers'],
+            max_workers_per_key=options['workers_per_playlist'],
+            executor=options['pool'],
+            # Often enough to pass on progress, as well as to keep leases.
+            heartbeat_interval=min(
+                settings.DOWNLOAD_LEASE.total_seconds() / 3,
+                settings.DOWNLOAD_PROGRESS_INTERVAL,
+            ),
+            batch_size=options['batch_size'],
+            bandwidth=BandwidthScheduler(),
+            throttle=Throttle(),
+            archive=self.store.archive.path,
+        )
+
+        def stop(signum, frame):
+            self.stderr.write(
+                'Stopping, waiting for running downloads to finish...'
+            )
+            pool.stop()
+
+        self.owner = make_lease_owner()
+        self.reported = {}
+        self.store.archive.extend(
+            StoredVideo.objects.values_list('youtube_id', flat=True),
+        )
+        linked = self.store.link_stored(Video.objects.pending_download())
+        if linked:
+            self.stdout.write('Linked {} already stored videos.'.format(
+                linked,
+            ))
+
+        DownloadJob.objects.enqueue(Video.objects.pending_download())
+
+        # Downloads hand their raw streams over to be merged in a pool of
+        # their own, and are only marked as downloaded once that's done.
+        self.postprocess_pool = None
+        self.postprocessing = {}
+        if options['postprocess_workers']:
+            self.postprocess_pool = ProcessPoolExecutor(
+                options['postprocess_workers'],
+            )
+
+        previous_handler = signal.signal(signal.SIGTERM, stop)
+        try:
+            unstarted = pool.run(
+                [],
+                self.on_success
+                if self.postprocess_pool is None
+                else self.on_downloaded,
+                self.on_failure,
+                refill=self.claim,
+                heartbeat=self.renew,
+            )
+
+            self.finish_postprocessing(wait=True)
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+
+            if self.postprocess_pool is not None:
+                self.postprocess_pool.shutdown()
+
+        if unstarted:
+            DownloadJob.objects.filter(
+                pk__in=[task.payload.pk for task in unstarted],
+            ).release(self.owner)
+
+            self.stderr.write('{} downloads not started.'.format(
+                len(unstarted),
+            ))
+
+    def claim(self, limit):
+        self.finish_postprocessing()
+
+        jobs = DownloadJob.objects.claim(self.owner, limit)
+
+        # Whatever the archive lists but isn't stored would only be skipped.
+        stale = {job.video.youtube_id for job in jobs} & (
+            self.store.archive.youtube_ids()
+        )
+        stale.difference_update(StoredVideo.objects.filter(
+            youtube_id__in=stale,
+        ).values_list('youtube_id', flat=True))
+
+        # A video in several playlists is only downloaded once, in the
+        # format of the playlist its job was queued for.
+        download_formats = {}
+
+        tasks = []
+        for i, job in enumerate(jobs):
+            video = job.video
+
+            # Checked before starting, rather than having the download run
+            # out of room after spending the bandwidth.
+            if not self.quota.reserve(video.youtube_id, video.playlist):
+                DownloadJob.objects.filter(
+                    pk__in=[job.pk for job in jobs[i:]],
+                ).release(self.owner)
+
+                self.stderr.write(
+                    'Out of space for {}, even after evicting old'
+                    ' videos; stopping.'.format(video.youtube_id)
+                )
+                self.pool.stop()
+
+                break
+
+            if video.playlist_id not in download_formats:
+                profile = video.playlist.get_download_profile()
+                download_formats[video.playlist_id] = (
+                    None if profile is None else profile.download_format()
+                )
+                if self.postprocess_pool is not None:
+                    download_formats[video.playlist_id] = attr.evolve(
+                        download_formats[video.playlist_id]
+                        or DownloadFormat(),
+                        postprocess=False,
+                    )
+
+            tasks.append(Task(
+                key=video.playlist_id,
+                youtube_id=video.youtube_id,
+                payload=job,
+                priority=(-video.playlist.download_priority, video.added),
+                download_format=download_formats[video.playlist_id],
+                use_archive=video.youtube_id not in stale,
+            ))
+
+        return tasks
+
+    def renew(self, tasks):
+        self.finish_postprocessing()
+
+        # Covers jobs being post-processed too, as they're still running.
+        DownloadJob.objects.renew(self.owner)
+
+        # Only this host can see what its downloads have reported.
+        reported = {}
+        for task in tasks:
+            latest = progress.store.get(task.youtube_id)
+            if latest is None:
+                continue
+
+            reported[task.youtube_id] = latest
+            if latest != self.reported.get(task.youtube_id):
+                DownloadJob.objects.filter(
+                    pk=task.payload.pk,
+                ).report_progress(self.owner, latest)
+
+        self.reported = reported
+
+    def on_downloaded(self, task, staging):
+        future = self.postprocess_pool.submit(
+            postprocess,
+            staging,
+            self.store.incoming,
+            task.download_format,
+        )
+        self.postprocessing[future] = task
+
+        self.finish_postprocessing()
+
+    def finish_postprocessing(self, wait=False):
+        if wait:
+            self.drain_postprocessing()
+
+        for future in list(self.postprocessing):
+            if not future.done():
+                continue
+
+            task = self.postprocessing.pop(future)
+            try:
+                filename = future.result()
+            except Exception as exc:
+                self.on_failure(task, exc)
+            else:
+                self.on_success(task, filename)
+
+    def drain_postprocessing(self):
+        # The download pool has stopped heartbeating by now, so leases are
+        # renewed here until everything has been post-processed.
+        interval = self.pool.heartbeat_interval
+        last_renewed = time.monotonic()
+        while self.postprocessing:
+            wait_for(
+                list(self.postprocessing),
+                timeout=max(0, last_renewed + interval - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+            self.finish_postprocessing()
+
+            if time.monotonic() - last_renewed >= interval:
+                DownloadJob.objects.renew(self.owner)
+                last_renewed = time.monotonic()
+
+    def on_success(self, task, filename):
+        self.complete(task, self.store.add(task.youtube_id, filename))
+
+        self.stdout.write('Downloaded {}: {}'.format(
+            task.youtube_id,
+            filename,
+        ))
+
+    def complete(self, task, stored):
+        self.quota.release(task.youtube_id)
+        with transaction.atomic():
+            # Not into playlists it's been removed from, or that don't want
+            # it downloaded.
+            self.store.link(
+                stored,
+                Video.objects.pending_download().filter(
+                    youtube_id=task.youtube_id,
+                ),
+            )
+            task.payload.complete(self.owner)
+
+    def on_failure(self, task, exc):
+        if isinstance(exc, AlreadyDownloadedError):
+            stored = StoredVideo.objects.filter(
+                youtube_id=task.youtube_id,
+            ).first()
+            if stored is not None:
+                # Stored by another worker since this one claimed it.
+                self.complete(task, stored)
+
+                self.stdout.write('Already downloaded {}'.format(
+                    task.youtube_id,
+                ))
+
+                return
+
+        self.quota.release(task.youtube_id)
+
+        if isinstance(exc, (
+            RateLimitedError,
+            AlreadyDownloadedError,
+            DownloadNotStartedError,
+        )):
+            # Not the video's fault, so it shouldn't use up an attempt.  A
+            # stale archive entry is left out of its next download.
+            DownloadJob.objects.filter(pk=task.payload.pk).release(
+                self.owner,
+            )
+        else:
+            task.payload.fail(
+                self.owner,
+                repr(exc),
+                retry=not isinstance(exc, VideoUnavailableError),
+            )
+
+        self.stderr.write('Failed to download {}: {!r}'.format(
+            task.youtube_id,
+            exc,
+        ))
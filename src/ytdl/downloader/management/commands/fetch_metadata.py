@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from downloader.models import VideoMetadata
+from playlists.models import Video
+
+
+class Command(BaseCommand):
+    help = (
+        'Fetch durations, sizes, upload dates and formats for videos'
+        ' waiting to be downloaded, where not already known.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Every video, not just those waiting to be downloaded.',
+        )
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        videos = Video.objects.all()
+        if not options['all']:
+            videos = videos.pending_download()
+
+        refreshed = VideoMetadata.objects.refresh(
+            videos.values_list('youtube_id', flat=True).distinct(),
+            batch_size=options['batch_size'],
+        )
+
+        self.stdout.write('Fetched metadata for {} videos.'.format(refreshed))
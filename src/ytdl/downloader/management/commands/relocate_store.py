@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from downloader.models import StoredVideo
+from downloader.storage import LAYOUTS, Store
+
+
+class Command(BaseCommand):
+    help = (
+        'Move stored videos into the configured layout, updating the paths'
+        ' recorded for them.  Safe to interrupt and run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            default=settings.DOWNLOAD_DIRECTORY,
+        )
+        parser.add_argument(
+            '--store-directory',
+            default=settings.DOWNLOAD_STORE_DIRECTORY,
+        )
+        parser.add_argument(
+            '--layout',
+            choices=sorted(LAYOUTS),
+            default=settings.DOWNLOAD_STORE_LAYOUT,
+        )
+
+    def handle(self, *args, **options):
+        store = Store(
+            root=options['store_directory'],
+            library=options['directory'],
+            layout=options['layout'],
+        )
+
+        relocated = 0
+        for stored in StoredVideo.objects.order_by('pk').iterator():
+            relocated += store.relocate(stored)
+
+        self.stdout.write('Relocated {} stored videos.'.format(relocated))
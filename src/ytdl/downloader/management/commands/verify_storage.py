@@ -0,0 +1,132 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from downloader.hashing import file_digest
+from downloader.models import StoredVideo
+from downloader.storage import Store
+from playlists.models import Video
+
+
+MISSING = 'missing'
+TRUNCATED = 'truncated'
+CORRUPT = 'corrupt'
+
+
+def _check(path, size, sha256, quick):
+    # Module level so that it can be pickled over to the worker processes.
+    try:
+        actual_size = os.path.getsize(path)
+    except FileNotFoundError:
+        return MISSING, None
+
+    if size is not None and actual_size < size:
+        return TRUNCATED, None
+
+    if size is not None and actual_size > size:
+        return CORRUPT, None
+
+    if quick:
+        return None, sha256
+
+    _size, digest = file_digest(path)
+    if sha256 is not None and digest != sha256:
+        return CORRUPT, digest
+
+    return None, digest
+
+
+class Command(BaseCommand):
+    help = (
+        'Check every stored video against its recorded size and hash,'
+        ' reporting missing, truncated, corrupt and duplicate files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            default=settings.DOWNLOAD_DIRECTORY,
+        )
+        parser.add_argument(
+            '--store-directory',
+            default=settings.DOWNLOAD_STORE_DIRECTORY,
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+        )
+        parser.add_argument(
+            '--quick',
+            action='store_true',
+            help='Only compare sizes, without reading the files.',
+        )
+
+    def handle(self, *args, **options):
+        store = Store(
+            root=options['store_directory'],
+            library=options['directory'],
+        )
+
+        stored_videos = list(StoredVideo.objects.order_by('youtube_id'))
+
+        problems = 0
+        by_digest = defaultdict(list)
+        with ProcessPoolExecutor(options['workers']) as executor:
+            results = executor.map(
+                _check,
+                [store.path(stored) for stored in stored_videos],
+                [stored.size for stored in stored_videos],
+                [stored.sha256 for stored in stored_videos],
+                [options['quick']] * len(stored_videos),
+            )
+
+            for stored, (problem, digest) in zip(stored_videos, results):
+                if problem is not None:
+                    problems += 1
+                    self.stderr.write('{} {}: {}'.format(
+                        problem.capitalize(),
+                        stored.youtube_id,
+                        store.path(stored),
+                    ))
+
+                    continue
+
+                if digest is None:
+                    continue
+
+                if stored.sha256 is None:
+                    # Stored before hashes were recorded.
+                    StoredVideo.objects.filter(pk=stored.pk).update(
+                        size=os.path.getsize(store.path(stored)),
+                        sha256=digest,
+                    )
+
+                by_digest[digest].append(stored.youtube_id)
+
+        for youtube_ids in by_digest.values():
+            if len(youtube_ids) > 1:
+                problems += 1
+                self.stderr.write('Duplicate: {}'.format(
+                    ', '.join(youtube_ids),
+                ))
+
+        links = Video.objects.filter(file_path__isnull=False)
+        for video in links.only('youtube_id', 'file_path').iterator():
+            path = store.library_path(video)
+            if not os.path.exists(path):
+                problems += 1
+                self.stderr.write('Missing link {}: {}'.format(
+                    video.youtube_id,
+                    path,
+                ))
+
+        self.stdout.write('Checked {} stored videos.'.format(
+            len(stored_videos),
+        ))
+
+        if problems:
+            raise CommandError('Found {} problems.'.format(problems))
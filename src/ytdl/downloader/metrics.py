@@ -0,0 +1,368 @@
+import atexit
+import contextlib
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+_SECONDS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 300, 1800,
+)
+_QUERIES = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+_MEGABYTE = 2 ** 20
+_BYTES = tuple(_MEGABYTE * size for size in (1, 10, 100, 1000, 10000))
+_BYTES_PER_SECOND = tuple(
+    _MEGABYTE * rate for rate in (0.1, 0.5, 1, 2, 5, 10, 50, 100)
+)
+
+# Name: (help, histogram buckets, or `None` for a counter).
+METRICS = {
+    'ytdl_youtube_dl_spawn_seconds': (
+        'Time taken to start youtube-dl.',
+        _SECONDS,
+    ),
+    'ytdl_youtube_dl_first_line_seconds': (
+        'Time from starting youtube-dl to its first line of JSON.',
+        _SECONDS,
+    ),
+    'ytdl_youtube_dl_parse_seconds': (
+        'Time spent parsing youtube-dl\'s JSON, per run.',
+        _SECONDS,
+    ),
+    'ytdl_youtube_dl_seconds': (
+        'Time youtube-dl ran for.',
+        _SECONDS,
+    ),
+    'ytdl_sync_seconds': (
+        'Time taken to sync a playlist\'s videos.',
+        _SECONDS,
+    ),
+    'ytdl_sync_queries': (
+        'Database queries made syncing a playlist\'s videos.',
+        _QUERIES,
+    ),
+    'ytdl_sync_query_seconds': (
+        'Time spent in the database syncing a playlist\'s videos.',
+        _SECONDS,
+    ),
+    'ytdl_download_seconds': (
+        'Time taken by each youtube-dl download run.',
+        _SECONDS,
+    ),
+    'ytdl_download_bytes': (
+        'Size of each downloaded video.',
+        _BYTES,
+    ),
+    'ytdl_download_bytes_per_second': (
+        'Throughput of each youtube-dl download run.',
+        _BYTES_PER_SECOND,
+    ),
+    'ytdl_postprocess_seconds': (
+        'Time taken to merge and move each downloaded video.',
+        _SECONDS,
+    ),
+    'ytdl_downloads_total': (
+        'Videos downloaded, or failed to be.',
+        None,
+    ),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# Where the metrics of processes that have exited are added up.
+_AGGREGATE = 'aggregate.json'
+
+
+class Registry(object):
+    # Every process keeps its own metrics, and writes them to a file of its
+    # own in `METRICS_DIRECTORY` now and again; the `/metrics` view adds
+    # them all up.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._filename = '{}-{}.json'.format(self._pid, uuid.uuid4().hex[:8])
+        self._values = {}
+        self._last_flush = time.monotonic()
+
+    def observe(self, name, value, **labels):
+        _help, buckets = METRICS[name]
+
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Forked; the parent's values are the parent's to report.
+                self._reset()
+
+            key = _key(name, labels)
+            if buckets is None:
+                self._values[key] = self._values.get(key, 0) + value
+            else:
+                # Per bucket counts, then the sum and count.
+                counts = self._values.setdefault(key, [0] * (len(buckets) + 3))
+                counts[_bucket(buckets, value)] += 1
+                counts[-2] += value
+                counts[-1] += 1
+
+            due = (
+                time.monotonic() - self._last_flush
+                >= settings.METRICS_FLUSH_INTERVAL
+            )
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(dict(labels, metric=name, value=value)))
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        directory = settings.METRICS_DIRECTORY
+        if directory is None:
+            return
+
+        with self._lock:
+            entries = _entries(self._values)
+            self._last_flush = time.monotonic()
+            filename = self._filename
+
+        # Most commands never observe anything.
+        if not entries:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        _write(os.path.join(directory, filename), entries)
+
+
+def _entries(values):
+    return [
+        [name, [list(label) for label in labels], value]
+        for (name, labels), value in values.items()
+    ]
+
+
+def _write(path, entries):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(entries, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _add(totals, entries):
+    for name, labels, value in entries:
+        if name not in METRICS:
+            continue
+
+        key = (name, tuple(tuple(label) for label in labels))
+        if isinstance(value, list):
+            total = totals.setdefault(key, [0] * len(value))
+            for i, count in enumerate(value):
+                total[i] += count
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _bucket(buckets, value):
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            return i
+
+    return len(buckets)
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def increment(name, amount=1, **labels):
+    registry.observe(name, amount, **labels)
+
+
+def flush():
+    registry.flush()
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+@contextlib.contextmanager
+def database_timer(prefix, **labels):
+    # Yields a context manager to time each block that uses the database
+    # with.  Observes the time spent in those blocks as `<prefix>_seconds`,
+    # and the number of queries they made and the time spent in them as
+    # `<prefix>_queries` and `<prefix>_query_seconds`; whatever happens in
+    # between, such as waiting on youtube-dl, isn't counted.
+    totals = [0, 0, 0]
+
+    def count(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            totals[1] += 1
+            totals[2] += time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def timed():
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count):
+                yield
+        finally:
+            totals[0] += time.perf_counter() - start
+
+    try:
+        yield timed
+    finally:
+        observe(prefix + '_seconds', totals[0], **labels)
+        observe(prefix + '_queries', totals[1], **labels)
+        observe(prefix + '_query_seconds', totals[2], **labels)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _compact(directory):
+    # Adds the files of processes that have exited into a single one, so
+    # that there are only ever about as many as there are processes still
+    # running.
+    with open(os.path.join(directory, _AGGREGATE + '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            exited = []
+            for filename in os.listdir(directory):
+                pid, _sep, _rest = filename.partition('-')
+                if (
+                    filename.endswith('.json')
+                    and pid.isdigit()
+                    and not _alive(int(pid))
+                ):
+                    exited.append(filename)
+
+            if not exited:
+                return
+
+            aggregate = os.path.join(directory, _AGGREGATE)
+            totals = {}
+            _add(totals, _read(aggregate))
+            for filename in exited:
+                _add(totals, _read(os.path.join(directory, filename)))
+
+            _write(aggregate, _entries(totals))
+            for filename in exited:
+                os.remove(os.path.join(directory, filename))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def collect():
+    # Every process' metrics, added together.
+    directory = settings.METRICS_DIRECTORY
+    if directory is None:
+        return {}
+
+    registry.flush()
+
+    os.makedirs(directory, exist_ok=True)
+    _compact(directory)
+
+    totals = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.json'):
+            _add(totals, _read(os.path.join(directory, filename)))
+
+    return totals
+
+
+def _labels(labels, **extra):
+    labels = list(labels) + sorted(extra.items())
+    if not labels:
+        return ''
+
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('"', '\\"'))
+        for name, value in labels
+    ))
+
+
+def render(totals):
+    lines = []
+    for name, (help_text, buckets) in sorted(METRICS.items()):
+        keys = sorted(key for key in totals if key[0] == name)
+        if not keys:
+            continue
+
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(
+            name,
+            'counter' if buckets is None else 'histogram',
+        ))
+
+        for key in keys:
+            _name, labels = key
+            value = totals[key]
+
+            if buckets is None:
+                lines.append('{}{} {}'.format(name, _labels(labels), value))
+
+                continue
+
+            cumulative = 0
+            for bound, count in zip(buckets + (math.inf,), value):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name,
+                    _labels(labels, le='+Inf' if bound == math.inf else bound),
+                    cumulative,
+                ))
+
+            for suffix, total in [('_sum', value[-2]), ('_count', value[-1])]:
+                lines.append('{}{}{} {}'.format(
+                    name,
+                    suffix,
+                    _labels(labels),
+                    total,
+                ))
+
+    return '\n'.join(lines) + '\n'
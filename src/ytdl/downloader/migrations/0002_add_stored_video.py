@@ -0,0 +1,22 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredVideo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('youtube_id', models.CharField(max_length=11, unique=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('stored', models.DateTimeField()),
+            ],
+        ),
+    ]
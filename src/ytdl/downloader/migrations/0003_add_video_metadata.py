@@ -0,0 +1,28 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0002_add_stored_video'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoMetadata',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('youtube_id', models.CharField(max_length=11, unique=True)),
+                ('duration', models.PositiveIntegerField(null=True)),
+                ('filesize', models.BigIntegerField(null=True)),
+                ('upload_date', models.DateField(null=True)),
+                ('formats', models.TextField(blank=True)),
+                ('fetched', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'video metadata',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0003_add_video_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedvideo',
+            name='size',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
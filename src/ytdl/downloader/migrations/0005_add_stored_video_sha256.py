@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0004_add_stored_video_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedvideo',
+            name='sha256',
+            field=models.CharField(db_index=True, max_length=64, null=True),
+        ),
+    ]
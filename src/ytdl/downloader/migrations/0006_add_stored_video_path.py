@@ -0,0 +1,34 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:20
+
+import os
+
+from django.db import migrations, models
+
+
+def record_flat_paths(apps, schema_editor):
+    StoredVideo = apps.get_model('downloader', 'StoredVideo')
+
+    # Everything so far was stored flat.
+    for stored in StoredVideo.objects.iterator():
+        StoredVideo.objects.filter(pk=stored.pk).update(path=os.path.join(
+            'objects',
+            stored.youtube_id,
+            stored.filename,
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0005_add_stored_video_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedvideo',
+            name='path',
+            field=models.CharField(default='', max_length=1024),
+            preserve_default=False,
+        ),
+        migrations.RunPython(record_flat_paths, migrations.RunPython.noop),
+    ]
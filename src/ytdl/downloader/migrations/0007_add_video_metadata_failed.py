@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0006_add_stored_video_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videometadata',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0007_add_video_metadata_failed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadjob',
+            name='progress_eta',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='downloadjob',
+            name='progress_percent',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='downloadjob',
+            name='progress_speed',
+            field=models.FloatField(null=True),
+        ),
+    ]
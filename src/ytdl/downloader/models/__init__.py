@@ -0,0 +1,10 @@
+from .download_job import DownloadJob
+from .stored_video import StoredVideo
+from .video_metadata import VideoMetadata
+
+
+__all__ = [
+    'DownloadJob',
+    'StoredVideo',
+    'VideoMetadata',
+]
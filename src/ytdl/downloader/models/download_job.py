@@ -0,0 +1,235 @@
+import os
+import socket
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.utils import timezone
+
+
+_ENQUEUE_BATCH_SIZE = 500
+
+
+def make_lease_owner():
+    return '{}:{}:{}'.format(
+        socket.gethostname(),
+        os.getpid(),
+        uuid.uuid4().hex[:8],
+    )
+
+
+class DownloadJobQuerySet(models.QuerySet):
+
+    def claimable(self):
+        now = timezone.now()
+
+        # A job whose lease ran out on its last attempt most likely killed
+        # its worker, and would go on doing so.
+        return self.filter(
+            models.Q(status=DownloadJob.PENDING)
+            | models.Q(
+                status=DownloadJob.RUNNING,
+                lease_expires__lt=now,
+                attempts__lt=settings.DOWNLOAD_MAX_ATTEMPTS,
+            )
+        )
+
+    def enqueue(self, videos):
+        from .stored_video import StoredVideo
+
+        # One job per youtube ID is enough, however many playlists it's in;
+        # the download gets linked into all of them.
+        queued_youtube_ids = self.filter(
+            status__in=[DownloadJob.PENDING, DownloadJob.RUNNING],
+        ).values('video__youtube_id')
+        candidates = (
+            videos
+            .filter(download_job__isnull=True)
+            .exclude(youtube_id__in=queued_youtube_ids)
+            .exclude(youtube_id__in=StoredVideo.objects.values('youtube_id'))
+            .order_by('pk')
+            .values_list('pk', 'youtube_id')
+        )
+
+        video_pks = []
+        youtube_ids = set()
+        for video_pk, youtube_id in candidates.iterator():
+            if youtube_id not in youtube_ids:
+                youtube_ids.add(youtube_id)
+                video_pks.append(video_pk)
+
+        created = 0
+        for i in range(0, len(video_pks), _ENQUEUE_BATCH_SIZE):
+            batch = video_pks[i:i + _ENQUEUE_BATCH_SIZE]
+            try:
+                with transaction.atomic():
+                    self.bulk_create([
+                        DownloadJob(video_id=video_pk) for video_pk in batch
+                    ])
+            except IntegrityError:
+                # Another worker enqueued some of these first.
+                created += self._enqueue_one_by_one(batch)
+            else:
+                created += len(batch)
+
+        return created
+
+    def _enqueue_one_by_one(self, video_pks):
+        created = 0
+        for video_pk in video_pks:
+            try:
+                with transaction.atomic():
+                    self.create(video_id=video_pk)
+            except IntegrityError:
+                continue
+
+            created += 1
+
+        return created
+
+    def claim(self, owner, limit):
+        now = timezone.now()
+        expires = now + settings.DOWNLOAD_LEASE
+
+        with transaction.atomic():
+            self.filter(
+                status=DownloadJob.RUNNING,
+                lease_expires__lt=now,
+                attempts__gte=settings.DOWNLOAD_MAX_ATTEMPTS,
+            ).update(
+                status=DownloadJob.FAILED,
+                lease_expires=None,
+                last_error='Lease expired on every attempt.',
+            )
+
+            candidates = self.claimable().order_by(
+                '-video__playlist__download_priority',
+                'video__added',
+                'pk',
+            )
+            if connection.features.has_select_for_update_skip_locked:
+                # Only the jobs; locking the joined videos and playlists
+                # would have other workers skip every job sharing them.
+                candidates = candidates.select_for_update(
+                    skip_locked=True,
+                    of=('self',),
+                )
+                pks = list(candidates.values_list('pk', flat=True)[:limit])
+            else:
+                # A single UPDATE is atomic on SQLite, which serialises
+                # writers; re-checking `claimable()` in it keeps a job
+                # another worker took in the meantime from being taken
+                # twice.
+                pks = candidates.values('pk')[:limit]
+
+            self.claimable().filter(pk__in=pks).update(
+                status=DownloadJob.RUNNING,
+                attempts=models.F('attempts') + 1,
+                lease_owner=owner,
+                lease_expires=expires,
+                progress_percent=None,
+                progress_speed=None,
+                progress_eta=None,
+            )
+
+        return list(
+            self
+            .filter(lease_owner=owner, lease_expires=expires)
+            .select_related('video__playlist')
+        )
+
+    def report_progress(self, owner, reported):
+        return self.filter(
+            status=DownloadJob.RUNNING,
+            lease_owner=owner,
+        ).update(
+            progress_percent=reported.percent,
+            progress_speed=reported.speed,
+            progress_eta=reported.eta,
+        )
+
+    def release(self, owner):
+        return self.filter(
+            status=DownloadJob.RUNNING,
+            lease_owner=owner,
+        ).update(
+            status=DownloadJob.PENDING,
+            attempts=models.F('attempts') - 1,
+            lease_expires=None,
+        )
+
+    def renew(self, owner):
+        return self.filter(
+            status=DownloadJob.RUNNING,
+            lease_owner=owner,
+        ).update(lease_expires=timezone.now() + settings.DOWNLOAD_LEASE)
+
+
+class DownloadJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    video = models.OneToOneField(
+        'playlists.Video',
+        on_delete=models.CASCADE,
+        related_name='download_job',
+    )
+
+    status = models.CharField(
+        max_length=7,
+        choices=STATUSES,
+        default=PENDING,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+
+    lease_owner = models.CharField(max_length=100, blank=True)
+    lease_expires = models.DateTimeField(null=True)
+
+    last_error = models.TextField(blank=True)
+
+    # The latest progress reported while running; a percentage, bytes per
+    # second and seconds.
+    progress_percent = models.FloatField(null=True)
+    progress_speed = models.FloatField(null=True)
+    progress_eta = models.PositiveIntegerField(null=True)
+
+    objects = DownloadJobQuerySet.as_manager()
+
+    def _owned(self, owner):
+        return DownloadJob.objects.filter(pk=self.pk, lease_owner=owner)
+
+    def complete(self, owner):
+        from playlists.models import Video
+
+        with transaction.atomic():
+            self._owned(owner).update(
+                status=DownloadJob.DONE,
+                lease_expires=None,
+            )
+            # Not if it's been removed from its playlist, or taken off the
+            # list to download, in the meantime; it'd never be downloaded
+            # should it come back.
+            Video.objects.filter(
+                pk=self.video_id,
+            ).pending_download().mark_downloaded()
+
+    def fail(self, owner, error, retry=True):
+        if not retry or self.attempts >= settings.DOWNLOAD_MAX_ATTEMPTS:
+            status = DownloadJob.FAILED
+        else:
+            status = DownloadJob.PENDING
+
+        self._owned(owner).update(
+            status=status,
+            lease_expires=None,
+            last_error=error,
+        )
@@ -0,0 +1,13 @@
+from django.db import models
+
+
+class StoredVideo(models.Model):
+    youtube_id = models.CharField(max_length=11, unique=True)
+    filename = models.CharField(max_length=255)
+    # Relative to the store's root.
+    path = models.CharField(max_length=1024)
+    # In bytes.
+    size = models.BigIntegerField(null=True)
+    sha256 = models.CharField(max_length=64, null=True, db_index=True)
+
+    stored = models.DateTimeField()
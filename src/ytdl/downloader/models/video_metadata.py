@@ -0,0 +1,149 @@
+import datetime
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from ..apps import DownloaderAppConfig
+from ..exceptions import RateLimitedError, YoutubeDLError
+
+
+_LOOKUP_BATCH_SIZE = 500
+
+
+def _filesize(info):
+    # youtube-dl only knows sizes per format; a merged download is the sum
+    # of the formats it's made from.
+    formats = info.get('requested_formats') or [info]
+
+    sizes = [
+        fmt.get('filesize') or fmt.get('filesize_approx')
+        for fmt in formats
+    ]
+    if not all(sizes):
+        return None
+
+    return int(sum(sizes))
+
+
+def _upload_date(info):
+    upload_date = info.get('upload_date')
+    if not upload_date:
+        return None
+
+    return datetime.datetime.strptime(upload_date, '%Y%m%d').date()
+
+
+class VideoMetadataQuerySet(models.QuerySet):
+
+    def fresh(self):
+        now = timezone.now()
+
+        return self.filter(
+            models.Q(
+                failed=False,
+                fetched__gte=now - settings.VIDEO_METADATA_TTL,
+            )
+            | models.Q(
+                failed=True,
+                fetched__gte=now - settings.VIDEO_METADATA_RETRY_AFTER,
+            )
+        )
+
+    def stale_youtube_ids(self, youtube_ids):
+        youtube_ids = sorted(set(youtube_ids))
+
+        fresh = set()
+        for i in range(0, len(youtube_ids), _LOOKUP_BATCH_SIZE):
+            fresh.update(self.fresh().filter(
+                youtube_id__in=youtube_ids[i:i + _LOOKUP_BATCH_SIZE],
+            ).values_list('youtube_id', flat=True))
+
+        return [
+            youtube_id
+            for youtube_id in youtube_ids
+            if youtube_id not in fresh
+        ]
+
+    def refresh(self, youtube_ids, batch_size=None):
+        if batch_size is None:
+            batch_size = settings.VIDEO_METADATA_BATCH_SIZE
+
+        stale = self.stale_youtube_ids(youtube_ids)
+
+        refreshed = 0
+        for i in range(0, len(stale), batch_size):
+            batch = stale[i:i + batch_size]
+            try:
+                infos = DownloaderAppConfig.get_video_info(batch)
+            except RateLimitedError:
+                # Not the videos' fault, and every batch after this one
+                # would be refused too.
+                break
+            except YoutubeDLError:
+                infos = []
+            fetched = timezone.now()
+
+            # Whatever youtube-dl couldn't look up is remembered as such,
+            # so that it isn't asked about again until it's due a retry.
+            metadata = {
+                youtube_id: VideoMetadata(
+                    youtube_id=youtube_id,
+                    failed=True,
+                    fetched=fetched,
+                )
+                for youtube_id in batch
+            }
+            for info in infos:
+                metadata[info['id']] = VideoMetadata.from_info(info, fetched)
+
+            with transaction.atomic():
+                self.filter(youtube_id__in=list(metadata)).delete()
+                self.bulk_create(metadata.values())
+
+            refreshed += sum(
+                not video_metadata.failed
+                for video_metadata in metadata.values()
+            )
+
+        return refreshed
+
+
+class VideoMetadata(models.Model):
+    youtube_id = models.CharField(max_length=11, unique=True)
+
+    # In seconds.
+    duration = models.PositiveIntegerField(null=True)
+    # In bytes, of the format youtube-dl would download.
+    filesize = models.BigIntegerField(null=True)
+    upload_date = models.DateField(null=True)
+    # Space separated youtube-dl format IDs.
+    formats = models.TextField(blank=True)
+
+    fetched = models.DateTimeField()
+    # youtube-dl couldn't look the video up when it was last fetched.
+    failed = models.BooleanField(default=False)
+
+    objects = VideoMetadataQuerySet.as_manager()
+
+    class Meta:
+        verbose_name_plural = 'video metadata'
+
+    @classmethod
+    def from_info(cls, info, fetched):
+        duration = info.get('duration')
+
+        return cls(
+            youtube_id=info['id'],
+            duration=None if duration is None else int(duration),
+            filesize=_filesize(info),
+            upload_date=_upload_date(info),
+            formats=' '.join(
+                fmt['format_id'] for fmt in info.get('formats') or []
+            ),
+            fetched=fetched,
+        )
+
+    @property
+    def format_ids(self):
+        return self.formats.split()
@@ -0,0 +1,299 @@
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import math
+import threading
+import time
+
+import attr
+
+from .apps import DownloaderAppConfig
+
+
+EXECUTORS = {
+    'process': ProcessPoolExecutor,
+    'thread': ThreadPoolExecutor,
+}
+
+
+@attr.s
+class Task(object):
+    key = attr.ib()
+    youtube_id = attr.ib()
+    payload = attr.ib(default=None)
+    # Lowest first.
+    priority = attr.ib(default=0)
+    # A `DownloadFormat`, or `None` for youtube-dl's default.  Batches are
+    # only ever made of one key's tasks, so should share it.
+    download_format = attr.ib(default=None)
+    # False where the download archive is known to wrongly list the video;
+    # the whole batch is then downloaded without it.
+    use_archive = attr.ib(default=True)
+
+
+def _options(**options):
+    return {
+        name: value
+        for name, value in options.items()
+        if value is not None
+    }
+
+
+def _download(
+    youtube_id,
+    directory,
+    rate_limit=None,
+    archive=None,
+    download_format=None,
+):
+    # Module level so that it can be pickled over to a process pool.
+    return DownloaderAppConfig.download_video(
+        youtube_id,
+        directory,
+        **_options(
+            rate_limit=rate_limit,
+            archive=archive,
+            download_format=download_format,
+        )
+    )
+
+
+def _download_batch(
+    youtube_ids,
+    directory,
+    rate_limit=None,
+    archive=None,
+    download_format=None,
+):
+    return DownloaderAppConfig.download_videos(
+        youtube_ids,
+        directory,
+        **_options(
+            rate_limit=rate_limit,
+            archive=archive,
+            download_format=download_format,
+        )
+    )
+
+
+@attr.s
+class DownloadPool(object):
+    directory = attr.ib()
+    max_workers = attr.ib(default=4)
+    max_workers_per_key = attr.ib(default=None)
+    executor = attr.ib(default='thread', validator=attr.validators.in_(
+        EXECUTORS,
+    ))
+    heartbeat_interval = attr.ib(default=60)
+    # Videos handed to a single youtube-dl process.  A batch only ever
+    # holds one key's tasks, and takes up one worker.
+    batch_size = attr.ib(default=1)
+    bandwidth = attr.ib(default=None)
+    throttle = attr.ib(default=None)
+    # youtube-dl's `--download-archive`, to skip whatever it lists.
+    archive = attr.ib(default=None)
+
+    _stopped = attr.ib(default=attr.Factory(threading.Event), init=False)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _allow(self, running):
+        if self._stopped.is_set():
+            return False
+
+        return self.throttle is None or self.throttle.allow(running)
+
+    def _record(self, exc=None):
+        if self.throttle is None:
+            return
+
+        if exc is None:
+            self.throttle.record_success()
+        else:
+            self.throttle.record_failure(exc)
+
+    def _next_batch(self, queues, per_key):
+        eligible = [
+            key for key in queues
+            if self.max_workers_per_key is None
+            or per_key[key] < self.max_workers_per_key
+        ]
+        if not eligible:
+            return None
+
+        # Ties go to whichever key has waited longest.
+        key = min(eligible, key=lambda key: queues[key][0].priority)
+        queue = queues[key]
+
+        batch = []
+        while queue and len(batch) < self.batch_size:
+            batch.append(queue.popleft())
+
+        if queue:
+            queues.move_to_end(key)
+        else:
+            del queues[key]
+
+        return batch
+
+    def _submit(self, executor, batch, rate_limit):
+        archive = self.archive
+        if not all(task.use_archive for task in batch):
+            archive = None
+
+        if self.batch_size == 1:
+            [task] = batch
+
+            return executor.submit(
+                _download,
+                task.youtube_id,
+                self.directory,
+                rate_limit,
+                archive,
+                task.download_format,
+            )
+
+        return executor.submit(
+            _download_batch,
+            [task.youtube_id for task in batch],
+            self.directory,
+            rate_limit,
+            archive,
+            batch[0].download_format,
+        )
+
+    def _finish(self, future, batch, on_success, on_failure):
+        try:
+            result = future.result()
+        except Exception as exc:
+            self._record(exc)
+            for task in batch:
+                on_failure(task, exc)
+
+            return
+
+        if self.batch_size == 1:
+            [task] = batch
+            self._record()
+            on_success(task, result)
+
+            return
+
+        filenames, errors = result
+        for task in batch:
+            if task.youtube_id in filenames:
+                self._record()
+                on_success(task, filenames[task.youtube_id])
+            else:
+                self._record(errors[task.youtube_id])
+                on_failure(task, errors[task.youtube_id])
+
+    @staticmethod
+    def _queue(queues, tasks):
+        for task in tasks:
+            queues.setdefault(task.key, deque()).append(task)
+
+    def _has_bandwidth(self):
+        # Nothing running holds any bandwidth, so this never stalls an idle
+        # pool.
+        return (
+            self.bandwidth is None
+            or self.bandwidth.has_room(self.max_workers)
+        )
+
+    def _rate_limit(self, running, queues):
+        if self.bandwidth is None:
+            return None
+
+        queued = sum(len(queue) for queue in queues.values())
+        expected = min(
+            self.max_workers,
+            len(running) + 1 + math.ceil(queued / self.batch_size),
+        )
+
+        return self.bandwidth.acquire(expected, self.max_workers)
+
+    def run(self, tasks, on_success, on_failure, refill=None, heartbeat=None):
+        queues = OrderedDict()
+        self._queue(queues, tasks)
+
+        running = {}
+        rate_limits = {}
+        per_key = Counter()
+        last_heartbeat = time.monotonic()
+
+        with EXECUTORS[self.executor](self.max_workers) as executor:
+            while True:
+                free = self.max_workers - len(running)
+                if refill is not None and free and not queues:
+                    if self._allow(running):
+                        self._queue(queues, refill(free * self.batch_size))
+
+                while (
+                    len(running) < self.max_workers
+                    and self._allow(running)
+                    and self._has_bandwidth()
+                ):
+                    batch = self._next_batch(queues, per_key)
+                    if batch is None:
+                        break
+
+                    rate_limit = self._rate_limit(running, queues)
+                    future = self._submit(executor, batch, rate_limit)
+                    running[future] = batch
+                    rate_limits[future] = rate_limit
+                    per_key[batch[0].key] += 1
+
+                paused = (
+                    self.throttle is not None
+                    and not self._stopped.is_set()
+                    and not self.throttle.allow(running)
+                )
+                timeout = self.heartbeat_interval
+                if paused and self.throttle.delay():
+                    timeout = min(timeout, self.throttle.delay())
+
+                if not running:
+                    if not paused or (refill is None and not queues):
+                        break
+
+                    # Backing off; wait it out unless told to stop.  Still
+                    # beats, so that the claimed jobs waiting to start keep
+                    # their leases.
+                    self._stopped.wait(timeout)
+                    done = set()
+                else:
+                    done, _not_done = wait(
+                        running,
+                        timeout=timeout,
+                        return_when=FIRST_COMPLETED,
+                    )
+
+                since_heartbeat = time.monotonic() - last_heartbeat
+                if since_heartbeat >= self.heartbeat_interval:
+                    if heartbeat is not None:
+                        heartbeat([
+                            task
+                            for batch in running.values()
+                            for task in batch
+                        ])
+
+                    last_heartbeat = time.monotonic()
+
+                for future in done:
+                    batch = running.pop(future)
+                    per_key[batch[0].key] -= 1
+
+                    rate_limit = rate_limits.pop(future)
+                    if self.bandwidth is not None:
+                        self.bandwidth.release(rate_limit)
+
+                    self._finish(future, batch, on_success, on_failure)
+
+        # Whatever is left was never started.
+        return [task for queue in queues.values() for task in queue]
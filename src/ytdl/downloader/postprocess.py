@@ -0,0 +1,229 @@
+import os
+import re
+import shutil
+import subprocess
+import time
+
+from . import metrics
+from .backends.base import finished_files, move_file
+from .exceptions import (
+    NoFilesCreatedError,
+    PostProcessingError,
+    TooManyFilesCreatedError,
+)
+from .formats import DownloadFormat
+
+
+# youtube-dl names each stream of a download it couldn't merge
+# `<name>.f<format ID>.<ext>`.
+_STREAM = re.compile(r'^(?P<name>.+)\.f[\w-]+\.(?P<ext>\w+)$')
+
+# What `--write-thumbnail` leaves alongside the streams, by MIME type.
+_THUMBNAILS = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+# Containers that can take each other's streams as they are, after
+# youtube-dl's own `compatible_formats`.
+_COMPATIBLE = [
+    ('mp4', {'mp4', 'm4a', 'm4v', 'mp3'}),
+    ('webm', {'webm'}),
+]
+
+# What streams are transcoded to, for a container that can't take them as
+# they are.  Matroska takes anything.
+_CODECS = {
+    'mp4': ['-c:v', 'libx264', '-c:a', 'aac'],
+    'webm': ['-c:v', 'libvpx-vp9', '-c:a', 'libopus'],
+}
+
+# Where audio goes once it has been extracted, by where it came from.
+_AUDIO_CONTAINERS = {
+    'mp4': 'm4a',
+    'm4a': 'm4a',
+    'webm': 'ogg',
+}
+
+# Containers that take a thumbnail as cover art, rather than as a Matroska
+# attachment.
+_COVER_ART = {'mp4', 'm4a'}
+_ATTACHMENTS = {'mkv', 'mka'}
+
+
+def _extension(name):
+    return os.path.splitext(name)[1][1:].lower()
+
+
+def _container(extensions, merge_output_format):
+    if merge_output_format is not None:
+        return merge_output_format
+
+    if len(extensions) == 1:
+        return extensions[0]
+
+    for container, compatible in _COMPATIBLE:
+        if set(extensions) <= compatible:
+            return container
+
+    return 'mkv'
+
+
+def _audio_container(extensions):
+    containers = {
+        _AUDIO_CONTAINERS.get(extension, 'mka') for extension in extensions
+    }
+
+    return containers.pop() if len(containers) == 1 else 'mka'
+
+
+def _transcode(extensions, container):
+    compatible = dict(_COMPATIBLE).get(container)
+
+    return compatible is not None and not set(extensions) <= compatible
+
+
+def _ffmpeg(staging, args, filename):
+    try:
+        subprocess.run(
+            args,
+            cwd=staging,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as exc:
+        try:
+            os.remove(os.path.join(staging, filename))
+        except FileNotFoundError:
+            pass
+
+        stderr = getattr(exc, 'stderr', None) or ''
+        raise PostProcessingError(stderr.strip() or str(exc))
+
+
+def _process(staging, streams, thumbnail, download_format):
+    # Merges, extracts, transcodes, fixes up and embeds into a single file,
+    # in one go.  Returns its filename, or `None` if the one stream there is
+    # is fine as it is.
+    extensions = [_extension(name) for name in streams]
+
+    if len(streams) == 1:
+        name = os.path.splitext(streams[0])[0]
+    else:
+        matches = [_STREAM.match(stream) for stream in streams]
+        if not all(matches):
+            raise TooManyFilesCreatedError(files=streams)
+
+        name = matches[0].group('name')
+
+    if download_format.extract_audio:
+        container = _audio_container(extensions)
+        transcode = False
+    else:
+        container = _container(
+            extensions,
+            download_format.merge_output_format,
+        )
+        transcode = _transcode(extensions, container)
+
+    if container not in _COVER_ART | _ATTACHMENTS:
+        thumbnail = None
+
+    # A lone DASH m4a is remuxed anyway, as youtube-dl's FixupM4a would.
+    if (
+        len(streams) == 1
+        and extensions != ['m4a']
+        and not download_format.extract_audio
+        and not transcode
+        and thumbnail is None
+    ):
+        return None
+
+    filename = '{}.{}'.format(name, container)
+    output = filename
+    if output in streams:
+        output = '{}.postprocessed.{}'.format(name, container)
+
+    args = ['ffmpeg', '-y', '-loglevel', 'error']
+    inputs = list(streams)
+    cover = thumbnail is not None and container in _COVER_ART
+    if cover:
+        # First, so that it's the first video stream whatever the others
+        # hold.
+        inputs.insert(0, thumbnail)
+    for input_name in inputs:
+        args += ['-i', input_name]
+
+    args += ['-c', 'copy']
+    if transcode:
+        args += _CODECS[container]
+    if cover:
+        args += ['-c:v:0', 'mjpeg', '-disposition:0', 'attached_pic']
+
+    for i, input_name in enumerate(inputs):
+        if download_format.extract_audio and input_name != thumbnail:
+            args += ['-map', '{}:a'.format(i)]
+        else:
+            args += ['-map', str(i)]
+
+    if thumbnail is not None and not cover:
+        args += [
+            '-attach', thumbnail,
+            '-metadata:s:t', 'mimetype=' + _THUMBNAILS[_extension(thumbnail)],
+        ]
+
+    args.append(output)
+
+    _ffmpeg(staging, args, output)
+
+    for input_name in inputs:
+        os.remove(os.path.join(staging, input_name))
+    if output != filename:
+        os.replace(
+            os.path.join(staging, output),
+            os.path.join(staging, filename),
+        )
+
+    return filename
+
+
+def postprocess(staging, directory, download_format=None):
+    # Merges the streams youtube-dl left in `staging`, extracting their
+    # audio, transcoding them or embedding their thumbnail as
+    # `download_format` asks, and moves the result into `directory`.
+    # Module level so that it can be pickled over to a process pool; CPU
+    # bound, so it has one of its own.
+    if download_format is None:
+        download_format = DownloadFormat()
+
+    started = time.perf_counter()
+
+    files = sorted(finished_files(staging))
+    thumbnails = [name for name in files if _extension(name) in _THUMBNAILS]
+    streams = [name for name in files if name not in thumbnails]
+    if not streams:
+        raise NoFilesCreatedError()
+
+    thumbnail = None
+    if download_format.embed_thumbnail and thumbnails:
+        thumbnail = thumbnails[0]
+
+    filename = _process(staging, streams, thumbnail, download_format)
+    if filename is None:
+        filename = streams[0]
+
+    move_file(os.path.join(staging, filename), directory)
+    shutil.rmtree(staging, ignore_errors=True)
+
+    metrics.observe(
+        'ytdl_postprocess_seconds',
+        time.perf_counter() - started,
+        streams=len(streams),
+    )
+    metrics.flush()
+
+    return filename
@@ -0,0 +1,210 @@
+import json
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+
+import attr
+
+
+# youtube-dl's progress lines, as printed with `--newline`; for example
+# `[download]  42.0% of 10.00MiB at  1.50MiB/s ETA 00:04`.
+_PROGRESS = re.compile(
+    r'^\[download\]\s+(?P<percent>[\d.]+)%'
+    r'(?:\s+of\s+~?\s*(?P<total>[\d.]+\s*\w+))?'
+    r'(?:\s+at\s+(?P<speed>[\d.]+\s*\w+)/s)?'
+    r'(?:\s+ETA\s+(?P<eta>[\d:]+))?'
+)
+# Which video a batch is working on, for example
+# `[youtube] dQw4w9WgXcQ: Downloading webpage`.
+_VIDEO = re.compile(r'^\[youtube\] (?P<youtube_id>[\w-]+): ')
+# youtube-dl's post-processors, which report no progress however long they
+# take; for example `[ffmpeg] Merging formats into "video.mp4"`.
+_POSTPROCESSING = re.compile(
+    r'^\[(ffmpeg|Merger|Fixup\w*|ExtractAudio|VideoConvertor'
+    r'|EmbedThumbnail)\] ',
+)
+
+_UNITS = {
+    'B': 1,
+    'KiB': 2 ** 10,
+    'MiB': 2 ** 20,
+    'GiB': 2 ** 30,
+    'TiB': 2 ** 40,
+}
+
+
+@attr.s(frozen=True)
+class Progress(object):
+    percent = attr.ib()
+    speed = attr.ib(default=None)
+    eta = attr.ib(default=None)
+    total = attr.ib(default=None)
+
+
+def _bytes(size):
+    match = re.match(r'^([\d.]+)\s*(\w+)$', size or '')
+    if match is None or match.group(2) not in _UNITS:
+        return None
+
+    return float(match.group(1)) * _UNITS[match.group(2)]
+
+
+def _seconds(eta):
+    if eta is None:
+        return None
+
+    seconds = 0
+    for part in eta.split(':'):
+        seconds = seconds * 60 + int(part)
+
+    return seconds
+
+
+def parse_line(line):
+    match = _PROGRESS.match(line.strip())
+    if match is None:
+        return None
+
+    return Progress(
+        percent=float(match.group('percent')),
+        speed=_bytes(match.group('speed')),
+        eta=_seconds(match.group('eta')),
+        total=_bytes(match.group('total')),
+    )
+
+
+def parse_video(line):
+    match = _VIDEO.match(line.strip())
+
+    return None if match is None else match.group('youtube_id')
+
+
+def is_postprocessing(line):
+    return _POSTPROCESSING.match(line.strip()) is not None
+
+
+@attr.s
+class StallDetector(object):
+    # A download is stalled once it has gone `timeout` seconds without
+    # reporting at least `speed` bytes per second, whether it's reporting
+    # slower speeds or nothing at all.  Never while paused for
+    # post-processing, which downloads nothing; the timeout starts over
+    # once there's progress again.
+
+    speed = attr.ib(default=attr.Factory(
+        lambda: settings.DOWNLOAD_STALL_SPEED,
+    ))
+    timeout = attr.ib(default=attr.Factory(
+        lambda: settings.DOWNLOAD_STALL_TIMEOUT,
+    ))
+    clock = attr.ib(default=time.monotonic)
+
+    _last_good = attr.ib(default=None, init=False)
+    _paused = attr.ib(default=False, init=False)
+
+    def __attrs_post_init__(self):
+        self._last_good = self.clock()
+
+    def pause(self):
+        self._paused = True
+
+    def update(self, progress):
+        if self._paused:
+            self._paused = False
+            self._last_good = self.clock()
+
+        if progress.speed is not None and progress.speed >= self.speed:
+            self._last_good = self.clock()
+
+    @property
+    def stalled(self):
+        if not self.timeout or self._paused:
+            return False
+
+        return self.clock() - self._last_good >= self.timeout
+
+
+class ProgressStore(object):
+    # Progress is reported many times a second; each running download's
+    # latest is written to a file of its own in `DOWNLOAD_PROGRESS_DIRECTORY`
+    # at most every `DOWNLOAD_PROGRESS_INTERVAL` seconds, rather than to the
+    # database, from whichever thread or process is downloading it.
+    # `download_pending` copies it over to the download's job from there,
+    # for every host to see.
+
+    def __init__(self, directory=None, interval=None, clock=time.monotonic):
+        self._directory = directory
+        self._interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._written = {}
+
+    @property
+    def directory(self):
+        if self._directory is not None:
+            return self._directory
+
+        return settings.DOWNLOAD_PROGRESS_DIRECTORY
+
+    @property
+    def interval(self):
+        if self._interval is not None:
+            return self._interval
+
+        return settings.DOWNLOAD_PROGRESS_INTERVAL
+
+    def _path(self, youtube_id):
+        return os.path.join(self.directory, youtube_id + '.json')
+
+    def update(self, youtube_id, progress, force=False):
+        if self.directory is None:
+            return False
+
+        now = self._clock()
+        with self._lock:
+            written = self._written.get(youtube_id)
+            if (
+                not force
+                and written is not None
+                and now - written < self.interval
+            ):
+                return False
+
+            self._written[youtube_id] = now
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(youtube_id)
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temp_path, 'w') as f:
+            json.dump(attr.asdict(progress), f)
+        os.replace(temp_path, path)
+
+        return True
+
+    def get(self, youtube_id):
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(youtube_id)) as f:
+                return Progress(**json.load(f))
+        except (OSError, TypeError, ValueError):
+            return None
+
+    def clear(self, youtube_id):
+        with self._lock:
+            self._written.pop(youtube_id, None)
+
+        if self.directory is None:
+            return
+
+        try:
+            os.remove(self._path(youtube_id))
+        except FileNotFoundError:
+            pass
+
+
+store = ProgressStore()
@@ -0,0 +1,204 @@
+import datetime
+import os
+import shutil
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+import attr
+
+from playlists.models import Video
+
+from .models import StoredVideo, VideoMetadata
+
+
+# Videos gone from their playlists are evicted before anything else.
+_WANTED = models.Case(
+    models.When(
+        models.Q(removed__isnull=False)
+        | models.Q(deleted=True)
+        | models.Q(privated=True),
+        then=0,
+    ),
+    default=1,
+    output_field=models.IntegerField(),
+)
+
+
+def _sum(queryset, field):
+    return queryset.aggregate(total=models.Sum(field))['total'] or 0
+
+
+@attr.s
+class Quota(object):
+    # Keeps the store within its byte quotas, and the volume it's on from
+    # filling up, by evicting least recently used videos before downloads
+    # start rather than letting them fail once they've run out of room.
+
+    store = attr.ib()
+    limit = attr.ib(default=attr.Factory(
+        lambda: settings.STORAGE_QUOTA,
+    ))
+    playlist_limit = attr.ib(default=attr.Factory(
+        lambda: settings.PLAYLIST_STORAGE_QUOTA,
+    ))
+    min_free = attr.ib(default=attr.Factory(
+        lambda: settings.STORAGE_MIN_FREE,
+    ))
+
+    # Estimated sizes of downloads that have started, by youtube ID, along
+    # with the playlist they're counted against.
+    _reserved = attr.ib(default=attr.Factory(dict), init=False)
+
+    def estimate(self, youtube_id):
+        filesize = VideoMetadata.objects.filter(
+            youtube_id=youtube_id,
+        ).values_list('filesize', flat=True).first()
+
+        return filesize or settings.DOWNLOAD_SIZE_ESTIMATE
+
+    def _reserved_size(self, playlist=None):
+        return sum(
+            size
+            for playlist_pk, size in self._reserved.values()
+            if playlist is None or playlist_pk == playlist.pk
+        )
+
+    def usage(self):
+        return _sum(StoredVideo.objects.all(), 'size') + self._reserved_size()
+
+    def playlist_usage(self, playlist):
+        return _sum(
+            Video.objects.filter(playlist=playlist, file_path__isnull=False),
+            'file_size',
+        ) + self._reserved_size(playlist)
+
+    def free(self):
+        return (
+            shutil.disk_usage(self.store.root).free
+            - self._reserved_size()
+            - self.min_free
+        )
+
+    def _evictable(self, videos):
+        return videos.filter(file_path__isnull=False).exclude(
+            youtube_id__in=list(self._reserved),
+        )
+
+    def _accessed_since(self, videos):
+        # Whatever has been watched since it was linked counts as used.
+        # Only looked at for videos about to be evicted, in the order of
+        # their stored access times, rather than for the whole library on
+        # every download.
+        accessed_since = False
+        for video in videos:
+            try:
+                accessed = os.stat(self.store.library_path(video)).st_atime
+            except OSError:
+                continue
+
+            accessed = datetime.datetime.fromtimestamp(accessed, timezone.utc)
+            if video.last_accessed is None or accessed > video.last_accessed:
+                Video.objects.filter(pk=video.pk).update(
+                    last_accessed=accessed,
+                )
+                accessed_since = True
+
+        return accessed_since
+
+    def evict_from_playlist(self, playlist, needed):
+        freed = 0
+
+        videos = self._evictable(Video.objects.filter(playlist=playlist))
+        for video in videos.annotate(wanted=_WANTED).order_by(
+            'wanted',
+            'last_accessed',
+            'pk',
+        ):
+            if freed >= needed:
+                break
+
+            if self._accessed_since([video]):
+                continue
+
+            self.store.unlink(video)
+            freed += video.file_size or 0
+
+            self._remove_unlinked(video.youtube_id)
+
+        return freed
+
+    def evict(self, needed):
+        freed = 0
+
+        # A video is only as evictable as its most wanted, most recently
+        # used link.
+        candidates = (
+            self._evictable(Video.objects.all())
+            .values('youtube_id')
+            .annotate(
+                wanted=models.Max(_WANTED),
+                last_accessed=models.Max('last_accessed'),
+            )
+            .order_by('wanted', 'last_accessed', 'youtube_id')
+        )
+        for candidate in candidates:
+            if freed >= needed:
+                break
+
+            videos = list(Video.objects.filter(
+                youtube_id=candidate['youtube_id'],
+                file_path__isnull=False,
+            ))
+            if self._accessed_since(videos):
+                continue
+
+            for video in videos:
+                self.store.unlink(video)
+
+            freed += self._remove_unlinked(candidate['youtube_id'])
+
+        return freed
+
+    def _remove_unlinked(self, youtube_id):
+        linked = Video.objects.filter(
+            youtube_id=youtube_id,
+            file_path__isnull=False,
+        )
+        if linked.exists():
+            return 0
+
+        stored = StoredVideo.objects.filter(youtube_id=youtube_id).first()
+        if stored is None:
+            return 0
+
+        self.store.remove(stored)
+
+        return stored.size or 0
+
+    def reserve(self, youtube_id, playlist):
+        size = self.estimate(youtube_id)
+
+        if self.playlist_limit is not None:
+            over = self.playlist_usage(playlist) + size - self.playlist_limit
+            if over > 0 and self.evict_from_playlist(playlist, over) < over:
+                return False
+
+        if self.limit is not None:
+            over = self.usage() + size - self.limit
+            if over > 0 and self.evict(over) < over:
+                return False
+
+        short = size - self.free()
+        if short > 0:
+            self.evict(short)
+            if size > self.free():
+                return False
+
+        self._reserved[youtube_id] = (playlist.pk, size)
+
+        return True
+
+    def release(self, youtube_id):
+        self._reserved.pop(youtube_id, None)
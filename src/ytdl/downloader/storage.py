@@ -0,0 +1,183 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+import attr
+
+from playlists.models import Video
+
+from .archive import DownloadArchive
+from .hashing import file_digest
+from .models import StoredVideo
+
+
+# Where each video's directory goes under `objects`.  Sharding keeps any
+# one directory small enough to list and back up, however many videos
+# there are.
+LAYOUTS = {
+    'flat': lambda youtube_id: youtube_id,
+    'sharded': lambda youtube_id: os.path.join(youtube_id[:2], youtube_id),
+}
+
+
+def _link(source, destination):
+    if os.path.lexists(destination):
+        return
+
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Across filesystems, or where hardlinks aren't allowed.
+        os.symlink(source, destination)
+
+
+@attr.s
+class Store(object):
+    # Every video is downloaded once into `root`, whichever playlists it's
+    # in, and each playlist's directory under `library` links to it.
+    # Videos are keyed by youtube ID alone, rather than by content or
+    # format, so one shared between playlists with different download
+    # profiles is stored once, in the format it was first downloaded in.
+
+    root = attr.ib()
+    library = attr.ib()
+    layout = attr.ib(
+        default=attr.Factory(lambda: settings.DOWNLOAD_STORE_LAYOUT),
+        validator=attr.validators.in_(LAYOUTS),
+    )
+
+    archive = attr.ib(init=False)
+
+    @archive.default
+    def _archive(self):
+        return DownloadArchive(os.path.join(self.root, 'archive.txt'))
+
+    @property
+    def incoming(self):
+        return os.path.join(self.root, 'incoming')
+
+    def relative_path(self, youtube_id, filename):
+        # Where a video goes in the current layout.
+        directory = LAYOUTS[self.layout](youtube_id)
+
+        return os.path.join('objects', directory, filename)
+
+    def path(self, stored):
+        # Wherever it was put, whatever the layout is now.
+        return os.path.join(self.root, stored.path)
+
+    def playlist_directory(self, playlist):
+        return os.path.join(self.library, playlist.youtube_id)
+
+    def library_path(self, video):
+        return os.path.join(self.library, video.file_path)
+
+    def add(self, youtube_id, filename):
+        relative_path = self.relative_path(youtube_id, filename)
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(os.path.join(self.incoming, filename), path)
+        size, sha256 = file_digest(path)
+
+        stored, _created = StoredVideo.objects.update_or_create(
+            youtube_id=youtube_id,
+            defaults={
+                'filename': filename,
+                'path': relative_path,
+                'size': size,
+                'sha256': sha256,
+                'stored': timezone.now(),
+            },
+        )
+
+        return stored
+
+    def link(self, stored, videos):
+        now = timezone.now()
+
+        for video in videos.select_related('playlist'):
+            directory = self.playlist_directory(video.playlist)
+            os.makedirs(directory, exist_ok=True)
+
+            path = os.path.join(directory, stored.filename)
+            _link(self.path(stored), path)
+
+            videos.filter(pk=video.pk).update(
+                file_path=os.path.relpath(path, self.library),
+                file_size=stored.size,
+                last_accessed=now,
+            )
+
+        self.archive.add(stored.youtube_id)
+
+        return videos.mark_downloaded()
+
+    def relocate(self, stored):
+        # Moves a video stored under an old layout to where the current one
+        # would put it.
+        relative_path = self.relative_path(stored.youtube_id, stored.filename)
+        if stored.path == relative_path:
+            return False
+
+        source = self.path(stored)
+        destination = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if os.path.exists(source):
+            os.rename(source, destination)
+        elif not os.path.exists(destination):
+            # Neither here nor there; leave it for `verify_storage`.
+            return False
+
+        # Only moved, so hardlinks are fine as they are.
+        links = Video.objects.filter(
+            youtube_id=stored.youtube_id,
+            file_path__isnull=False,
+        )
+        for video in links:
+            link = self.library_path(video)
+            if os.path.islink(link):
+                os.remove(link)
+                os.symlink(destination, link)
+
+        StoredVideo.objects.filter(pk=stored.pk).update(path=relative_path)
+        stored.path = relative_path
+
+        try:
+            os.rmdir(os.path.dirname(source))
+        except OSError:
+            pass
+
+        return True
+
+    def unlink(self, video):
+        if video.file_path is not None:
+            path = self.library_path(video)
+            if os.path.lexists(path):
+                os.remove(path)
+
+        Video.objects.filter(pk=video.pk).update(
+            file_path=None,
+            file_size=None,
+        )
+
+    def remove(self, stored):
+        shutil.rmtree(os.path.dirname(self.path(stored)), ignore_errors=True)
+        stored.delete()
+
+    def link_stored(self, videos):
+        # Whatever's already stored needs linking, not downloading.
+        linked = 0
+        stored_videos = StoredVideo.objects.filter(
+            youtube_id__in=videos.values('youtube_id'),
+        )
+        for stored in stored_videos.iterator():
+            with transaction.atomic():
+                linked += self.link(
+                    stored,
+                    videos.filter(youtube_id=stored.youtube_id),
+                )
+
+        return linked
@@ -0,0 +1,74 @@
+import random
+import time
+
+from django.conf import settings
+
+import attr
+
+from .exceptions import RateLimitedError
+
+
+@attr.s
+class Throttle(object):
+    # Backs off exponentially while youtube-dl reports being rate limited,
+    # and stops downloading altogether once it has been too many times in
+    # a row.  After the cooldown a single download is let through to see
+    # whether the limit has lifted.
+
+    base = attr.ib(default=attr.Factory(
+        lambda: settings.DOWNLOAD_BACKOFF_BASE,
+    ))
+    maximum = attr.ib(default=attr.Factory(
+        lambda: settings.DOWNLOAD_BACKOFF_MAX,
+    ))
+    threshold = attr.ib(default=attr.Factory(
+        lambda: settings.DOWNLOAD_CIRCUIT_BREAKER_THRESHOLD,
+    ))
+    cooldown = attr.ib(default=attr.Factory(
+        lambda: settings.DOWNLOAD_CIRCUIT_BREAKER_COOLDOWN,
+    ))
+    clock = attr.ib(default=time.monotonic)
+    random = attr.ib(default=random.random)
+
+    failures = attr.ib(default=0, init=False)
+    trips = attr.ib(default=0, init=False)
+    _resume_at = attr.ib(default=None, init=False)
+
+    @property
+    def open(self):
+        return self.failures >= self.threshold
+
+    def record_success(self):
+        self.failures = 0
+        self.trips = 0
+        self._resume_at = None
+
+    def record_failure(self, exc):
+        if not isinstance(exc, RateLimitedError):
+            return
+
+        self.failures += 1
+        if self.open:
+            # Each failed probe doubles the cooldown.
+            wait = self.cooldown * 2 ** self.trips
+            self.trips += 1
+        else:
+            wait = min(self.maximum, self.base * 2 ** (self.failures - 1))
+
+        # Equal jitter, so that several workers don't all retry in step,
+        # while none retries sooner than half the wait.
+        wait = wait / 2 + wait / 2 * self.random()
+        self._resume_at = self.clock() + wait
+
+    def delay(self):
+        if self._resume_at is None:
+            return 0
+
+        return max(0, self._resume_at - self.clock())
+
+    def allow(self, running):
+        if self.delay():
+            return False
+
+        # Half open: one probe at a time.
+        return not self.open or not running
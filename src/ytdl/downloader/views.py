@@ -0,0 +1,10 @@
+from django.http import HttpResponse
+
+from . import metrics as ytdl_metrics
+
+
+def metrics(request):
+    return HttpResponse(
+        ytdl_metrics.render(ytdl_metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
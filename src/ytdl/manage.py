@@ -14,4 +14,18 @@ if __name__ == '__main__':
             'you forget to activate a virtual environment?'
         ) from exc
 
-    execute_from_command_line(sys.argv)
+    # `YTDL_PROFILE=sync.prof ./manage.py sync_playlists` profiles a single
+    # run, for `python -m pstats sync.prof` or snakeviz.
+    profile = os.environ.get('YTDL_PROFILE')
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            execute_from_command_line(sys.argv)
+        finally:
+            profiler.disable()
+            profiler.dump_stats(profile)
+    else:
+        execute_from_command_line(sys.argv)
@@ -0,0 +1,115 @@
+import heapq
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from playlists.models import Playlist
+
+
+# How often to look for newly added playlists, in seconds.
+_REFRESH_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Keep syncing playlists as they come due, polling busy playlists'
+        ' more often than quiet ones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Sync whatever is due now, then exit.',
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stderr.write('Stopping after the current sync...')
+            self.stopping.set()
+
+        previous_handlers = {
+            signum: signal.signal(signum, stop)
+            for signum in [signal.SIGINT, signal.SIGTERM]
+        }
+        try:
+            self.run(options['once'])
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def refresh(self, queue, scheduled):
+        now = timezone.now()
+
+        new = Playlist.objects.exclude(pk__in=scheduled)
+        for pk, next_sync in new.values_list('pk', 'next_sync'):
+            heapq.heappush(queue, (next_sync or now, pk))
+            scheduled.add(pk)
+
+    def run(self, once):
+        queue = []
+        scheduled = set()
+        refreshed = float('-inf')
+
+        while not self.stopping.is_set():
+            if time.monotonic() - refreshed >= _REFRESH_INTERVAL:
+                self.refresh(queue, scheduled)
+                refreshed = time.monotonic()
+
+            wait = _REFRESH_INTERVAL
+            if queue:
+                due, pk = queue[0]
+                wait = (due - timezone.now()).total_seconds()
+
+            if wait > 0:
+                if once:
+                    return
+
+                self.stopping.wait(min(wait, _REFRESH_INTERVAL))
+
+                continue
+
+            heapq.heappop(queue)
+
+            playlist = Playlist.objects.filter(pk=pk).first()
+            if playlist is None:
+                scheduled.discard(pk)
+
+                continue
+
+            self.sync(playlist)
+            heapq.heappush(queue, (playlist.next_sync, pk))
+
+    def sync(self, playlist):
+        start = time.monotonic()
+        try:
+            result = playlist.sync()
+        except Exception as exc:
+            # Anything one playlist raises mustn't stop the others from
+            # syncing.  Treated like a sync that found nothing, so a broken
+            # playlist is retried less and less often.
+            playlist.schedule_next_sync(changed=False)
+
+            self.stderr.write('Failed {} after {:.1f}s: {!r}'.format(
+                playlist.youtube_id,
+                time.monotonic() - start,
+                exc,
+            ))
+
+            return
+
+        playlist.schedule_next_sync(changed=result.changed)
+
+        self.stdout.write(
+            'Synced {} in {:.1f}s: {}, next in {}'.format(
+                playlist.youtube_id,
+                time.monotonic() - start,
+                result,
+                playlist.sync_interval,
+            )
+        )
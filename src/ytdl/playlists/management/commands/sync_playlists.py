@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from playlists.models import Playlist
+
+
+class Command(BaseCommand):
+    help = 'Fetch every playlist concurrently, and update its videos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('youtube_ids', nargs='*')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.SYNC_CONCURRENCY,
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help=(
+                'Only look for new videos, unless a playlist is due a full'
+                ' sync.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        playlists = Playlist.objects.all()
+        if options['youtube_ids']:
+            playlists = playlists.filter(youtube_id__in=options['youtube_ids'])
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            failures = loop.run_until_complete(
+                self.sync_all(
+                    list(playlists),
+                    options['concurrency'],
+                    options['incremental'],
+                )
+            )
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+        if failures:
+            self.stderr.write('{} playlists failed to sync.'.format(failures))
+
+    async def sync_all(self, playlists, concurrency, incremental):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        results = await asyncio.gather(*(
+            self.sync(playlist, semaphore, incremental)
+            for playlist in playlists
+        ))
+
+        return results.count(False)
+
+    async def fetch(self, playlist):
+        downloader = apps.get_app_config('downloader')
+
+        return [
+            result async for result
+            in downloader.get_playlist_info_async(playlist.youtube_id)
+        ]
+
+    async def fetch_incremental(self, playlist):
+        downloader = apps.get_app_config('downloader')
+
+        fetch = playlist.start_incremental_sync()
+        window = fetch.next_window()
+        while window is not None:
+            start, end = window
+            fetch.feed([
+                result async for result in downloader.get_playlist_info_async(
+                    playlist.youtube_id,
+                    start=start,
+                    end=end,
+                )
+            ])
+            window = fetch.next_window()
+
+        return fetch
+
+    async def sync(self, playlist, semaphore, incremental):
+        start = time.monotonic()
+        try:
+            result = await self.fetch_and_reconcile(
+                playlist,
+                semaphore,
+                incremental,
+            )
+        except Exception as exc:
+            # Anything one playlist raises mustn't stop the others, still
+            # being fetched, from syncing.
+            self.stderr.write('Failed {} after {:.1f}s: {!r}'.format(
+                playlist.youtube_id,
+                time.monotonic() - start,
+                exc,
+            ))
+
+            return False
+
+        self.stdout.write('Synced {} in {:.1f}s: {}'.format(
+            playlist.youtube_id,
+            time.monotonic() - start,
+            result,
+        ))
+
+        return True
+
+    async def fetch_and_reconcile(self, playlist, semaphore, incremental):
+        incremental = incremental and not playlist.full_sync_due()
+
+        async with semaphore:
+            if incremental:
+                fetched = await self.fetch_incremental(playlist)
+            else:
+                fetched = await self.fetch(playlist)
+
+        # Applied on the event loop's thread, as Django's connections are
+        # per-thread.  Reconciliation is quick next to fetching.
+        if incremental:
+            return playlist.finish_incremental_sync(fetched)
+
+        return playlist.create_and_update_videos(fetched)
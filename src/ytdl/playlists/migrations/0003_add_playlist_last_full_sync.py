@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0002_add_video_deleted_and_privated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='last_full_sync',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+def remove_duplicate_videos(apps, schema_editor):
+    Video = apps.get_model('playlists', 'Video')
+
+    duplicates = (
+        Video.objects
+        .values('playlist', 'youtube_id')
+        .annotate(first=models.Min('pk'), count=models.Count('pk'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        Video.objects.filter(
+            playlist=duplicate['playlist'],
+            youtube_id=duplicate['youtube_id'],
+        ).exclude(pk=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0003_add_playlist_last_full_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_videos,
+            migrations.RunPython.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='video',
+            unique_together={('playlist', 'youtube_id')},
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['youtube_id'], name='video_youtube_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['downloaded', 'removed', 'do_not_download', 'deleted', 'privated', 'added'], name='video_pending_download_idx'),
+        ),
+    ]
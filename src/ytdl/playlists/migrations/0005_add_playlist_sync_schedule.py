@@ -0,0 +1,33 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0004_add_video_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='change_rate',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='last_sync',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='next_sync',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='sync_interval',
+            field=models.DurationField(null=True),
+        ),
+    ]
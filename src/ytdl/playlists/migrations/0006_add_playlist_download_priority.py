@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0005_add_playlist_sync_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='download_priority',
+            field=models.IntegerField(default=0),
+        ),
+    ]
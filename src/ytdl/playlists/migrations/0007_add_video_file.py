@@ -0,0 +1,28 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playlists', '0006_add_playlist_download_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='file_path',
+            field=models.CharField(max_length=1024, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='file_size',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='last_accessed',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0001_initial'),
+        ('playlists', '0007_add_video_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='download_profile',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='playlists', to='profiles.DownloadProfile'),
+        ),
+    ]
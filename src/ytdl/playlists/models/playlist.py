@@ -1,58 +1,389 @@
 from django.apps import apps
 from django.conf import settings
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils import timezone
 
+import attr
+
+from downloader import metrics
+
 from .video import Video
 
 
+# Items per statement, at most; fewer where they'd take more parameters than
+# the database allows, as SQLite's are capped.
+_BATCH_SIZE = 500
+
+# How much a sync finding changes shortens the polling interval, and how
+# much one finding nothing lengthens it.
+_SPEED_UP = 0.5
+_BACK_OFF = 2
+
+# Weight given to the latest sync in `Playlist.change_rate`.
+_CHANGE_RATE_WEIGHT = 0.2
+
+_DELETED_TITLE = '[Deleted video]'
+_PRIVATE_TITLE = '[Private video]'
+
+
+def _batch_size(params_per_item, params=0):
+    # How many items fit in a statement that takes `params` besides theirs.
+    max_query_params = connection.features.max_query_params
+    if max_query_params is None:
+        return _BATCH_SIZE
+
+    return min(_BATCH_SIZE, (max_query_params - params) // params_per_item)
+
+
+def _batches(items, size=_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+@attr.s
+class SyncResult(object):
+    created = attr.ib(default=0)
+    removed = attr.ib(default=0)
+    renamed = attr.ib(default=0)
+    deleted = attr.ib(default=0)
+    privated = attr.ib(default=0)
+    # Back in the playlist after having been removed from it.
+    restored = attr.ib(default=0)
+
+    @property
+    def changed(self):
+        return any(attr.astuple(self))
+
+
+# Plans the `--playlist-start`/`--playlist-end` windows of an incremental
+# sync.  Pages are read from the front until one holds nothing new, to
+# catch newest-first playlists, and from just before the last stored video
+# until the playlist runs out, to catch videos appended to the end.
+@attr.s
+class IncrementalFetch(object):
+    known = attr.ib()
+    stored = attr.ib()
+    page_size = attr.ib()
+
+    entries = attr.ib(default=attr.Factory(list), init=False)
+
+    _head = attr.ib(default=1, init=False)
+    _tail = attr.ib(init=False)
+    _reading_head = attr.ib(default=False, init=False)
+
+    @_tail.default
+    def _tail_default(self):
+        return max(1, self.stored - self.page_size + 1)
+
+    # Where the tail's windows start; the head stops short of it, as from
+    # there on the tail reads everything anyway.
+    _tail_start = attr.ib(init=False)
+
+    @_tail_start.default
+    def _tail_start_default(self):
+        return self._tail
+
+    def _window(self, start):
+        return start, start + self.page_size - 1
+
+    def next_window(self):
+        self._reading_head = (
+            self._head is not None
+            and self._head < self._tail_start
+        )
+        if self._reading_head:
+            # A short last window, and so the last, where it meets the
+            # tail's.
+            start, end = self._window(self._head)
+
+            return start, min(end, self._tail_start - 1)
+
+        if self._tail is not None:
+            return self._window(self._tail)
+
+        return None
+
+    def _is_known(self, result):
+        # Whether `Playlist._reconcile` would leave the video as it is.
+        video = self.known.get(result['id'])
+        if video is None or video.removed is not None:
+            return False
+
+        # Private and deleted videos keep the title they had before.
+        if result['title'] == _PRIVATE_TITLE:
+            return video.privated
+        if result['title'] == _DELETED_TITLE:
+            return video.deleted
+
+        return (
+            result['title'] == video.title
+            and not video.privated
+            and not video.deleted
+        )
+
+    def feed(self, page):
+        self.entries.extend(page)
+
+        full = len(page) == self.page_size
+
+        if not self._reading_head:
+            self._tail = self._tail + self.page_size if full else None
+        elif full and not all(self._is_known(result) for result in page):
+            self._head += self.page_size
+        else:
+            self._head = None
+
+
 class Playlist(models.Model):
     added_by = models.ManyToManyField(settings.AUTH_USER_MODEL)
 
     youtube_id = models.CharField(max_length=34, unique=True)
 
-    def create_and_update_videos(self):
-        downloader = apps.get_app_config('downloader')
+    # Higher priority playlists' videos are downloaded first.
+    download_priority = models.IntegerField(default=0)
+    # Falls back to that of whoever added the playlist, then to
+    # youtube-dl's defaults.
+    download_profile = models.ForeignKey(
+        'profiles.DownloadProfile',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='playlists',
+    )
 
-        now = timezone.now()
-        results = {
-            result['id']: result
-            for result in downloader.get_playlist_info(self.youtube_id)
+    last_full_sync = models.DateTimeField(null=True)
+
+    last_sync = models.DateTimeField(null=True)
+    next_sync = models.DateTimeField(null=True)
+    sync_interval = models.DurationField(null=True)
+    # Moving average of how often syncing finds changes.
+    change_rate = models.FloatField(default=0)
+
+    def _known_videos(self):
+        return {
+            video.youtube_id: video
+            for video in self.videos.values_list(
+                'pk',
+                'youtube_id',
+                'title',
+                'removed',
+                'deleted',
+                'privated',
+                named=True,
+            )
         }
 
-        for video in self.videos.all():
-            result = results.pop(video.youtube_id, None)
-            if result is None:
-                video.removed = now
+    def get_download_profile(self):
+        if self.download_profile_id is not None:
+            return self.download_profile
 
-                video.save()
+        DownloadProfile = apps.get_model('profiles', 'DownloadProfile')
 
+        return DownloadProfile.objects.filter(
+            pk__in=self.added_by.filter(
+                profile__download_profile__isnull=False,
+            ).values('profile__download_profile'),
+        ).order_by('pk').first()
+
+    def full_sync_due(self):
+        if self.last_full_sync is None:
+            return True
+
+        since = timezone.now() - self.last_full_sync
+
+        return since >= settings.FULL_SYNC_INTERVAL
+
+    def sync(self):
+        if self.full_sync_due():
+            return self.create_and_update_videos()
+
+        return self.update_new_videos()
+
+    def schedule_next_sync(self, changed):
+        now = timezone.now()
+
+        interval = self.sync_interval or settings.SYNC_DEFAULT_INTERVAL
+        interval *= _SPEED_UP if changed else _BACK_OFF
+        interval = min(
+            max(interval, settings.SYNC_MIN_INTERVAL),
+            settings.SYNC_MAX_INTERVAL,
+        )
+
+        self.last_sync = now
+        self.next_sync = now + interval
+        self.sync_interval = interval
+        self.change_rate += _CHANGE_RATE_WEIGHT * (
+            float(changed) - self.change_rate
+        )
+
+        self.save(update_fields=[
+            'last_sync',
+            'next_sync',
+            'sync_interval',
+            'change_rate',
+        ])
+
+    def create_and_update_videos(self, playlist_info=None):
+        if playlist_info is None:
+            downloader = apps.get_app_config('downloader')
+            playlist_info = downloader.get_playlist_info(self.youtube_id)
+
+        # Still streaming from youtube-dl, so only the database is timed.
+        with metrics.database_timer('ytdl_sync', kind='full') as timed:
+            with timed():
+                known = self._known_videos()
+
+            return self._reconcile(
+                playlist_info,
+                known,
+                remove_missing=True,
+                timed=timed,
+            )
+
+    def start_incremental_sync(self):
+        return IncrementalFetch(
+            known=self._known_videos(),
+            stored=self.videos.filter(removed__isnull=True).count(),
+            page_size=settings.SYNC_PAGE_SIZE,
+        )
+
+    def finish_incremental_sync(self, fetch):
+        # Only a full sync can tell what's gone from the playlist.
+        with metrics.database_timer('ytdl_sync', kind='incremental') as timed:
+            return self._reconcile(
+                fetch.entries,
+                dict(fetch.known),
+                remove_missing=False,
+                timed=timed,
+            )
+
+    def update_new_videos(self):
+        downloader = apps.get_app_config('downloader')
+
+        fetch = self.start_incremental_sync()
+        window = fetch.next_window()
+        while window is not None:
+            start, end = window
+            fetch.feed(list(downloader.get_playlist_info(
+                self.youtube_id,
+                start=start,
+                end=end,
+            )))
+            window = fetch.next_window()
+
+        return self.finish_incremental_sync(fetch)
+
+    def _reconcile(self, playlist_info, known, remove_missing, timed):
+        now = timezone.now()
+        seen = set()
+        new = {}
+        deleted = []
+        privated = []
+        renamed = {}
+        restored = []
+
+        for result in playlist_info:
+            youtube_id, title = result['id'], result['title']
+            if youtube_id in seen:
                 continue
 
-            if result['title'] == video.title:
+            seen.add(youtube_id)
+
+            if youtube_id not in known:
+                new[youtube_id] = title
+
                 continue
 
-            video.deleted = False
-            video.privated = False
-
-            if result['title'] == '[Private video]':
-                video.privated = True
-            elif result['title'] == '[Deleted video]':
-                video.deleted = True
-            else:
-                video.title = result['title']
-
-            video.save()
-
-        # All that's left in `results` will be new stuff.
-        Video.objects.bulk_create([
-            Video(
-                playlist=self,
-                youtube_id=result['id'],
-                title=result['title'],
-                added=now,
-                deleted=result['title'] == '[Deleted video]',
-                privated=result['title'] == '[Private video]',
+            video = known.pop(youtube_id)
+            if video.removed is not None:
+                restored.append(video.pk)
+
+            # Private and deleted videos keep the title they had before.
+            if title == _PRIVATE_TITLE:
+                if not video.privated:
+                    privated.append(video.pk)
+            elif title == _DELETED_TITLE:
+                if not video.deleted:
+                    deleted.append(video.pk)
+            elif (
+                title != video.title
+                or video.privated
+                or video.deleted
+            ):
+                renamed[video.pk] = title
+
+        # All that's left in `known` has gone from the playlist, if it
+        # hadn't already.
+        removed = []
+        if remove_missing:
+            removed = [
+                video.pk
+                for video in known.values()
+                if video.removed is None
+            ]
+
+        with timed(), transaction.atomic():
+            for pks in _batches(removed):
+                Video.objects.filter(pk__in=pks).update(removed=now)
+
+            for pks in _batches(restored):
+                Video.objects.filter(pk__in=pks).update(removed=None)
+
+            for pks in _batches(privated):
+                Video.objects.filter(pk__in=pks).update(
+                    deleted=False,
+                    privated=True,
+                )
+
+            for pks in _batches(deleted):
+                Video.objects.filter(pk__in=pks).update(
+                    deleted=True,
+                    privated=False,
+                )
+
+            # Each rename's primary key goes in both the `CASE` and the
+            # `IN`, along with its title, and the flags are cleared too.
+            for pks in _batches(renamed, _batch_size(3, params=2)):
+                Video.objects.filter(pk__in=pks).update(
+                    title=models.Case(
+                        *(
+                            models.When(pk=pk, then=models.Value(renamed[pk]))
+                            for pk in pks
+                        ),
+                        output_field=models.CharField(),
+                    ),
+                    deleted=False,
+                    privated=False,
+                )
+
+            Video.objects.bulk_create(
+                [
+                    Video(
+                        playlist=self,
+                        youtube_id=youtube_id,
+                        title=title,
+                        added=now,
+                        deleted=title == _DELETED_TITLE,
+                        privated=title == _PRIVATE_TITLE,
+                    )
+                    for youtube_id, title in new.items()
+                ],
+                # Django 2.2 doesn't cap a batch size it's given.
+                batch_size=_batch_size(len(Video._meta.concrete_fields)),
             )
-            for result in results.values()
-        ])
+
+            if remove_missing:
+                self.last_full_sync = now
+                Playlist.objects.filter(pk=self.pk).update(
+                    last_full_sync=now,
+                )
+
+        return SyncResult(
+            created=len(new),
+            removed=len(removed),
+            renamed=len(renamed),
+            deleted=len(deleted),
+            privated=len(privated),
+            restored=len(restored),
+        )
@@ -1,4 +1,20 @@
 from django.db import models
+from django.utils import timezone
+
+
+class VideoQuerySet(models.QuerySet):
+
+    def pending_download(self):
+        return self.filter(
+            downloaded__isnull=True,
+            do_not_download=False,
+            removed__isnull=True,
+            deleted=False,
+            privated=False,
+        )
+
+    def mark_downloaded(self):
+        return self.update(downloaded=timezone.now())
 
 
 class Video(models.Model):
@@ -19,3 +35,33 @@ class Video(models.Model):
 
     downloaded = models.DateTimeField(null=True)
     do_not_download = models.BooleanField(default=False)
+
+    # Where the downloaded file is linked into its playlist's directory,
+    # relative to the library.  Cleared, but `downloaded` left alone, when
+    # it's evicted to make room.
+    file_path = models.CharField(max_length=1024, null=True)
+    file_size = models.BigIntegerField(null=True)
+    last_accessed = models.DateTimeField(null=True)
+
+    objects = VideoQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('playlist', 'youtube_id')
+        indexes = [
+            models.Index(
+                fields=['youtube_id'],
+                name='video_youtube_id_idx',
+            ),
+            # Covers `VideoQuerySet.pending_download()`.
+            models.Index(
+                fields=[
+                    'downloaded',
+                    'removed',
+                    'do_not_download',
+                    'deleted',
+                    'privated',
+                    'added',
+                ],
+                name='video_pending_download_idx',
+            ),
+        ]
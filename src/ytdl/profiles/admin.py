@@ -0,0 +1,22 @@
+from django.contrib import admin
+
+from .models import DownloadProfile, Profile
+
+
+@admin.register(DownloadProfile)
+class DownloadProfileAdmin(admin.ModelAdmin):
+    list_display = [
+        'name',
+        'format',
+        'max_height',
+        'audio_only',
+        'container',
+        'embed_thumbnail',
+    ]
+    search_fields = ['name']
+
+
+@admin.register(Profile)
+class ProfileAdmin(admin.ModelAdmin):
+    list_display = ['user', 'download_profile']
+    list_select_related = ['user', 'download_profile']
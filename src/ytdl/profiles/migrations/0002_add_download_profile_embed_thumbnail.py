@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadprofile',
+            name='embed_thumbnail',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,8 @@
+from .download_profile import DownloadProfile
+from .profile import Profile
+
+
+__all__ = [
+    'DownloadProfile',
+    'Profile',
+]
@@ -0,0 +1,83 @@
+from django.db import models
+
+from downloader.formats import DownloadFormat
+
+
+# The audio YouTube serves alongside video in each container.
+_AUDIO_EXTENSIONS = {
+    'mp4': 'm4a',
+    'webm': 'webm',
+}
+
+
+class DownloadProfile(models.Model):
+    MP4 = 'mp4'
+    WEBM = 'webm'
+    MKV = 'mkv'
+
+    CONTAINERS = (
+        (MP4, 'MP4'),
+        (WEBM, 'WebM'),
+        (MKV, 'Matroska'),
+    )
+
+    name = models.CharField(max_length=100, unique=True)
+
+    # A youtube-dl `--format` selector, used as is instead of building one
+    # from `max_height`, `audio_only` and `container`.
+    format = models.CharField(max_length=200, blank=True)
+
+    max_height = models.PositiveIntegerField(null=True, blank=True)
+    audio_only = models.BooleanField(default=False)
+    # Preferred, rather than insisted on, where YouTube doesn't offer it.
+    container = models.CharField(max_length=4, choices=CONTAINERS, blank=True)
+    # Only when downloads are post-processed in their own pool.
+    embed_thumbnail = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.name
+
+    def _selector(self):
+        if self.format:
+            return self.format
+
+        height = ''
+        if self.max_height is not None:
+            height = '[height<={}]'.format(self.max_height)
+
+        audio_extension = _AUDIO_EXTENSIONS.get(self.container)
+
+        if self.audio_only:
+            choices = ['bestaudio', 'best' + height]
+            if audio_extension is not None:
+                choices.insert(0, 'bestaudio[ext={}]'.format(audio_extension))
+
+            return '/'.join(choices)
+
+        if not height and not self.container:
+            return None
+
+        choices = ['bestvideo{}+bestaudio'.format(height), 'best' + height]
+        if audio_extension is not None:
+            choices[:0] = [
+                'bestvideo{}[ext={}]+bestaudio[ext={}]'.format(
+                    height,
+                    self.container,
+                    audio_extension,
+                ),
+                'best{}[ext={}]'.format(height, self.container),
+            ]
+
+        return '/'.join(choices)
+
+    def download_format(self):
+        return DownloadFormat(
+            selector=self._selector(),
+            merge_output_format=(
+                self.container
+                if self.container and not self.audio_only
+                else None
+            ),
+            extract_audio=self.audio_only,
+            embed_thumbnail=self.embed_thumbnail,
+        )
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db import models
+
+
+class Profile(models.Model):
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='profile',
+    )
+
+    # Used for the playlists this user added that have no download profile
+    # of their own.
+    download_profile = models.ForeignKey(
+        'profiles.DownloadProfile',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+    )
+
+    def __str__(self):
+        return str(self.user)
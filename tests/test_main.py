@@ -1,21 +1,69 @@
+import asyncio
+from collections import Counter
+import concurrent.futures
 import datetime
+import hashlib
+import io
+import json
 import os
 import subprocess
+import sys
+import threading
+import time
 
 from django.apps import apps
-from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 import attr
 from freezegun import freeze_time
 import pytest
 import pytz
 
+from downloader import metrics, progress
+from downloader.apps import DownloaderAppConfig
+from downloader.archive import DownloadArchive
+from downloader.backends.base import (
+    classify_error,
+    clean_staging,
+    staging_directory,
+)
+from downloader.backends.process import SubprocessBackend
+from downloader.bandwidth import BandwidthScheduler, current_rate_limit
+from downloader.checks import (
+    check_ffmpeg_is_installed,
+    check_youtube_dl_is_installed,
+)
 from downloader.exceptions import (
+    AlreadyDownloadedError,
+    DownloadNotStartedError,
+    DownloadStalledError,
+    ExtractorBrokenError,
+    GeoBlockedError,
     NoFilesCreatedError,
+    PostProcessingError,
+    RateLimitedError,
     TooManyFilesCreatedError,
+    VideoUnavailableError,
     YoutubeDLError,
 )
+from downloader.formats import DownloadFormat
+from downloader.hashing import file_digest
+from downloader.models import DownloadJob, StoredVideo, VideoMetadata
+from downloader.management.commands.download_pending import (
+    Command as DownloadPendingCommand,
+)
+from downloader.pool import DownloadPool, Task
+from downloader.postprocess import postprocess
+from downloader.quota import Quota
+from downloader.storage import Store
+from downloader.throttle import Throttle
 from playlists.models import Playlist, Video
+from playlists.models.playlist import IncrementalFetch, SyncResult
+from profiles.models import DownloadProfile, Profile
 
 
 def test_server_starts(client):
@@ -26,6 +74,55 @@ def test_checks_pass():
     call_command('check')
 
 
+def test_youtube_dl_version_is_cached_until_the_executable_changes(
+    tmp_path,
+    mocker,
+):
+    executable = tmp_path / 'youtube-dl'
+    executable.write_text('#!/bin/sh\necho 2018.12.03\n')
+    executable.chmod(0o755)
+
+    mocker.patch('shutil.which', return_value=str(executable))
+    check_output = mocker.spy(subprocess, 'check_output')
+
+    cache = str(tmp_path / 'cache.json')
+    with override_settings(YOUTUBE_DL_VERSION_CACHE=cache):
+        assert SubprocessBackend().version() == '2018.12.03'
+        assert SubprocessBackend().version() == '2018.12.03'
+        assert check_output.call_count == 1
+
+        executable.write_text('#!/bin/sh\necho 2018.12.09\n')
+        os.utime(str(executable), (0, 0))
+
+        assert SubprocessBackend().version() == '2018.12.09'
+        assert check_output.call_count == 2
+
+
+def test_checks_fail_when_youtube_dl_is_missing(mocker):
+    mocker.patch('shutil.which', return_value=None)
+    mocker.patch(
+        'downloader.checks.get_backend',
+        return_value=SubprocessBackend(),
+    )
+
+    [error] = check_youtube_dl_is_installed(None)
+
+    assert error.id == 'downloader.E_YOUTUBE_DL_NOT_INSTALLED'
+
+
+def test_checks_fail_when_ffmpeg_is_missing_for_postprocessing(mocker):
+    mocker.patch('shutil.which', return_value=None)
+
+    with override_settings(DOWNLOAD_POSTPROCESS_WORKERS=0):
+        assert check_ffmpeg_is_installed(None) == []
+
+    with override_settings(DOWNLOAD_POSTPROCESS_WORKERS=2):
+        [error] = check_ffmpeg_is_installed(None)
+
+    assert error.id == 'downloader.E_FFMPEG_NOT_INSTALLED'
+
+
+@pytest.mark.usefixtures('youtube_dl_stand_in')
 def test_get_playlist_info_raises_for_garbage_playlist():
     downloader = apps.get_app_config('downloader')
 
@@ -37,6 +134,22 @@ _TEST_PLAYLIST_ID = 'PL59FEE129ADFF2B12'
 _TEST_VIDEO_ID = '007VM8NZxkI'
 
 
+_FAKE_YOUTUBE_DL = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'benchmarks',
+    'fake_youtube_dl.py',
+)
+
+
+@pytest.fixture
+def youtube_dl_stand_in(tmp_path_factory, monkeypatch):
+    # Keeps tests that run youtube-dl off the network.
+    bin_dir = tmp_path_factory.mktemp('bin')
+    os.symlink(_FAKE_YOUTUBE_DL, str(bin_dir / 'youtube-dl'))
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+
+
+@pytest.mark.usefixtures('youtube_dl_stand_in')
 def test_get_playlist_info_returns_iterable():
     downloader = apps.get_app_config('downloader')
 
@@ -45,6 +158,7 @@ def test_get_playlist_info_returns_iterable():
     iter(results)
 
 
+@pytest.mark.usefixtures('youtube_dl_stand_in')
 def test_get_playlist_info_returns_id_and_title_for_all_results():
     downloader = apps.get_app_config('downloader')
 
@@ -55,6 +169,146 @@ def test_get_playlist_info_returns_id_and_title_for_all_results():
         assert 'title' in result
 
 
+def _fake_youtube_dl(mocker, script):
+    real_popen = subprocess.Popen
+    processes = []
+
+    def popen(args, **kwargs):
+        process = real_popen([sys.executable, '-c', script], **kwargs)
+        processes.append(process)
+
+        return process
+
+    mocker.patch.object(subprocess, 'Popen', popen)
+
+    return processes
+
+
+def _fake_download(mocker, run):
+    # `run(args, cwd)` does youtube-dl's work for it, and returns its exit
+    # status and error output, if not `(0, '')`.
+    real_popen = subprocess.Popen
+
+    def popen(args, cwd, **kwargs):
+        returncode, stderr = run(args, cwd) or (0, '')
+
+        return real_popen(
+            [
+                sys.executable,
+                '-c',
+                'import sys; sys.stderr.write({!r}); sys.exit({})'.format(
+                    stderr,
+                    returncode,
+                ),
+            ],
+            cwd=cwd,
+            **kwargs
+        )
+
+    mocker.patch.object(subprocess, 'Popen', popen)
+
+
+def test_get_playlist_info_streams_entries(mocker):
+    downloader = apps.get_app_config('downloader')
+
+    entries = [{'id': 'testID' + str(i), 'title': 'Test'} for i in range(3)]
+    _fake_youtube_dl(mocker, (
+        'import json\n'
+        'for entry in {!r}:\n'
+        '    print(json.dumps(entry))\n'
+    ).format(entries))
+
+    assert list(downloader.get_playlist_info(_TEST_PLAYLIST_ID)) == entries
+
+
+def test_get_playlist_info_raises_when_youtube_dl_fails_midway(mocker):
+    downloader = apps.get_app_config('downloader')
+
+    _fake_youtube_dl(mocker, (
+        'import sys\n'
+        'print({!r})\n'
+        'sys.exit(1)\n'
+    ).format(json.dumps({'id': 'testID', 'title': 'Test Title'})))
+
+    results = downloader.get_playlist_info(_TEST_PLAYLIST_ID)
+
+    assert next(results) == {'id': 'testID', 'title': 'Test Title'}
+    with pytest.raises(YoutubeDLError):
+        next(results)
+
+
+def test_get_playlist_info_kills_youtube_dl_when_abandoned(mocker):
+    downloader = apps.get_app_config('downloader')
+
+    processes = _fake_youtube_dl(mocker, (
+        'import time\n'
+        'print({!r}, flush=True)\n'
+        'time.sleep(60)\n'
+    ).format(json.dumps({'id': 'testID', 'title': 'Test Title'})))
+
+    results = downloader.get_playlist_info(_TEST_PLAYLIST_ID)
+    next(results)
+    results.close()
+
+    assert processes[0].poll() is not None
+
+
+def _collect_async(agen):
+    async def collect():
+        return [result async for result in agen]
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(collect())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_get_playlist_info_async_streams_entries(mocker):
+    downloader = apps.get_app_config('downloader')
+
+    entries = [{'id': 'testID' + str(i), 'title': 'Test'} for i in range(3)]
+    script = (
+        'import json\n'
+        'for entry in {!r}:\n'
+        '    print(json.dumps(entry))\n'
+    ).format(entries)
+
+    real_exec = asyncio.create_subprocess_exec
+    mocker.patch.object(
+        asyncio,
+        'create_subprocess_exec',
+        lambda *args, **kwargs: real_exec(
+            sys.executable, '-c', script, **kwargs
+        ),
+    )
+
+    results = downloader.get_playlist_info_async(_TEST_PLAYLIST_ID)
+
+    assert _collect_async(results) == entries
+
+
+def test_get_playlist_info_async_raises_when_youtube_dl_fails(mocker):
+    downloader = apps.get_app_config('downloader')
+
+    real_exec = asyncio.create_subprocess_exec
+    mocker.patch.object(
+        asyncio,
+        'create_subprocess_exec',
+        lambda *args, **kwargs: real_exec(
+            sys.executable, '-c', 'import sys; sys.exit(1)', **kwargs
+        ),
+    )
+
+    results = downloader.get_playlist_info_async(_TEST_PLAYLIST_ID)
+
+    with pytest.raises(YoutubeDLError):
+        _collect_async(results)
+
+
+@pytest.mark.usefixtures('youtube_dl_stand_in')
 def test_download_video_raises_for_garbage_video(tmp_path):
     downloader = apps.get_app_config('downloader')
 
@@ -62,6 +316,7 @@ def test_download_video_raises_for_garbage_video(tmp_path):
         downloader.download_video('asdf', tmp_path)
 
 
+@pytest.mark.usefixtures('youtube_dl_stand_in')
 def test_download_video_creates_a_file(tmp_path):
     downloader = apps.get_app_config('downloader')
 
@@ -77,23 +332,350 @@ def test_download_video_raises_when_youtube_dl_misbehaves(tmp_path, mocker):
     downloader = apps.get_app_config('downloader')
 
     def run_factory(files_to_create):
-        def run(*args, cwd, **kwargs):
+        def run(args, cwd):
             for i in range(files_to_create):
                 open(os.path.join(cwd, str(i)), 'w').close()
 
         return run
 
-    mocker.patch.object(subprocess, 'run', run_factory(0))
+    _fake_download(mocker, run_factory(0))
 
     with pytest.raises(NoFilesCreatedError):
         downloader.download_video(_TEST_VIDEO_ID, tmp_path)
 
-    mocker.patch.object(subprocess, 'run', run_factory(2))
+    _fake_download(mocker, run_factory(2))
 
     with pytest.raises(TooManyFilesCreatedError):
         downloader.download_video(_TEST_VIDEO_ID, tmp_path)
 
 
+def _listdir(path):
+    # Without the staging directory.
+    return [name for name in os.listdir(str(path)) if name != '.staging']
+
+
+def test_download_video_keeps_partial_files_for_retries(tmp_path, mocker):
+    downloader = apps.get_app_config('downloader')
+
+    def run(args, cwd):
+        partial = os.path.join(cwd, 'Test Title.mp4.part')
+        if os.path.exists(partial):
+            os.rename(partial, os.path.join(cwd, 'Test Title.mp4'))
+        else:
+            open(partial, 'w').close()
+
+    _fake_download(mocker, run)
+
+    with pytest.raises(NoFilesCreatedError):
+        downloader.download_video(_TEST_VIDEO_ID, str(tmp_path))
+
+    assert _listdir(tmp_path) == []
+
+    filename = downloader.download_video(_TEST_VIDEO_ID, str(tmp_path))
+
+    assert filename == 'Test Title.mp4'
+    assert _listdir(tmp_path) == ['Test Title.mp4']
+    assert os.listdir(str(tmp_path / '.staging')) == []
+
+
+def test_clean_staging_keeps_recent_pending_downloads(tmp_path):
+    for youtube_id in ['pending', 'stale', 'finished']:
+        os.makedirs(str(tmp_path / '.staging' / youtube_id))
+
+    os.utime(str(tmp_path / '.staging' / 'stale'), (0, 0))
+
+    removed = clean_staging(str(tmp_path), keep={'pending', 'stale'})
+
+    assert sorted(removed) == ['finished', 'stale']
+    assert os.listdir(str(tmp_path / '.staging')) == ['pending']
+
+
+def test_download_videos_attributes_files_and_errors(tmp_path, mocker):
+    downloader = apps.get_app_config('downloader')
+
+    def run(args, cwd):
+        for youtube_id, count in [('ok', 1), ('toomany', 2), ('broken', 1)]:
+            os.mkdir(os.path.join(cwd, youtube_id))
+            for i in range(count):
+                filename = '{}-{}.mp4'.format(i, youtube_id)
+                open(os.path.join(cwd, youtube_id, filename), 'w').close()
+
+        return 1, (
+            'ERROR: [youtube] broken: Postprocessing failed\n'
+            'ERROR: [youtube] unavailable: Video unavailable\n'
+        )
+
+    _fake_download(mocker, run)
+
+    filenames, errors = downloader.download_videos(
+        ['ok', 'toomany', 'broken', 'unavailable', 'missing'],
+        str(tmp_path),
+    )
+
+    assert filenames == {'ok': '0-ok.mp4'}
+    assert _listdir(tmp_path) == ['0-ok.mp4']
+    assert isinstance(errors['toomany'], TooManyFilesCreatedError)
+    assert 'Postprocessing failed' in str(errors['broken'])
+    assert 'Video unavailable' in str(errors['unavailable'])
+    assert isinstance(errors['missing'], NoFilesCreatedError)
+
+
+def test_progress_lines_are_parsed():
+    assert progress.parse_line(
+        '[download]  42.0% of 10.00MiB at  1.50MiB/s ETA 01:04',
+    ) == progress.Progress(
+        percent=42.0,
+        speed=1.5 * 2 ** 20,
+        eta=64,
+        total=10 * 2 ** 20,
+    )
+    assert progress.parse_line(
+        '[download]   0.0% of ~2.00GiB at Unknown speed ETA Unknown ETA',
+    ) == progress.Progress(percent=0.0, total=2 * 2 ** 30)
+    assert progress.parse_line('[download] Destination: 42.0%.mp4') is None
+    assert progress.parse_video('[youtube] testID: Downloading webpage') == (
+        'testID'
+    )
+
+
+def test_progress_store_throttles_writes(tmp_path):
+    now = [0]
+    store = progress.ProgressStore(
+        directory=str(tmp_path),
+        interval=2,
+        clock=lambda: now[0],
+    )
+
+    assert store.update('testID', progress.Progress(percent=1.0))
+    assert not store.update('testID', progress.Progress(percent=2.0))
+    assert store.get('testID') == progress.Progress(percent=1.0)
+
+    now[0] = 2
+    assert store.update('testID', progress.Progress(percent=3.0))
+    assert store.get('testID') == progress.Progress(percent=3.0)
+
+    store.clear('testID')
+    assert store.get('testID') is None
+
+
+@pytest.mark.usefixtures('youtube_dl_stand_in')
+def test_subprocess_backend_reports_progress(tmp_path, mocker, monkeypatch):
+    monkeypatch.setenv('FAKE_YOUTUBE_DL_FILE_SIZE', str(256 * 1024))
+    update = mocker.spy(progress.store, 'update')
+
+    with override_settings(DOWNLOAD_PROGRESS_DIRECTORY=str(tmp_path / 'p')):
+        SubprocessBackend().download_video(_TEST_VIDEO_ID, str(tmp_path))
+
+        assert progress.store.get(_TEST_VIDEO_ID) is None
+
+    reported = [call[0] for call in update.call_args_list]
+    assert {youtube_id for youtube_id, _progress in reported} == {
+        _TEST_VIDEO_ID,
+    }
+    assert reported[-1][1].percent == 100.0
+
+
+@override_settings(DOWNLOAD_STALL_SPEED=1024, DOWNLOAD_STALL_TIMEOUT=1)
+def test_subprocess_backend_kills_stalled_downloads(tmp_path, mocker):
+    processes = _fake_youtube_dl(mocker, (
+        'import time\n'
+        'print("[download]   1.0% of 1.00MiB at 10.00B/s ETA 99:00",'
+        ' flush=True)\n'
+        'time.sleep(60)\n'
+    ))
+
+    started = time.monotonic()
+    with pytest.raises(DownloadStalledError):
+        SubprocessBackend().download_video(_TEST_VIDEO_ID, str(tmp_path))
+
+    assert time.monotonic() - started < 30
+    assert processes[0].returncode is not None
+
+
+@override_settings(DOWNLOAD_STALL_SPEED=1024, DOWNLOAD_STALL_TIMEOUT=1)
+def test_subprocess_backend_fails_batches_after_a_stall_as_not_started(
+    tmp_path,
+    mocker,
+):
+    _fake_youtube_dl(mocker, (
+        'import time\n'
+        'print("[youtube] testID0: Downloading webpage", flush=True)\n'
+        'print("[youtube] testID1: Downloading webpage", flush=True)\n'
+        'print("[download]   1.0% of 1.00MiB at 10.00B/s ETA 99:00",'
+        ' flush=True)\n'
+        'time.sleep(60)\n'
+    ))
+
+    filenames, errors = SubprocessBackend().download_videos(
+        ['testID0', 'testID1', 'testID2', 'testID3'],
+        str(tmp_path),
+    )
+
+    assert filenames == {}
+    assert {
+        youtube_id: type(error) for youtube_id, error in errors.items()
+    } == {
+        'testID0': NoFilesCreatedError,
+        'testID1': DownloadStalledError,
+        'testID2': DownloadNotStartedError,
+        'testID3': DownloadNotStartedError,
+    }
+
+
+def test_stall_detector_waits_out_post_processing():
+    now = [0]
+    stall = progress.StallDetector(
+        speed=1024,
+        timeout=10,
+        clock=lambda: now[0],
+    )
+
+    now[0] = 5
+    stall.pause()
+    now[0] = 60
+    assert not stall.stalled
+
+    # Back to downloading; the timeout starts over.
+    stall.update(progress.Progress(percent=0.0, speed=10))
+    now[0] = 69
+    assert not stall.stalled
+    now[0] = 70
+    assert stall.stalled
+
+
+@override_settings(DOWNLOAD_STALL_SPEED=1024, DOWNLOAD_STALL_TIMEOUT=1)
+def test_subprocess_backend_lets_slow_merges_finish(tmp_path, mocker):
+    _fake_youtube_dl(mocker, (
+        'import time\n'
+        'print("[download] 100.0% of 1.00MiB at 1.00MiB/s ETA 00:00",'
+        ' flush=True)\n'
+        'print(\'[ffmpeg] Merging formats into "video.mp4"\', flush=True)\n'
+        'time.sleep(2)\n'
+        'open("video.mp4", "w").close()\n'
+    ))
+
+    assert SubprocessBackend().download_video(
+        _TEST_VIDEO_ID,
+        str(tmp_path),
+    ) == 'video.mp4'
+
+
+_IN_PROCESS_BACKEND = 'downloader.backends.inprocess.InProcessBackend'
+
+
+@override_settings(DOWNLOADER_BACKEND=_IN_PROCESS_BACKEND)
+def test_in_process_backend_streams_playlist_info(mocker):
+    youtube_dl = pytest.importorskip('youtube_dl')
+    downloader = apps.get_app_config('downloader')
+
+    entries = [{'id': 'testID' + str(i), 'title': 'Test'} for i in range(5)]
+    mocker.patch.object(
+        youtube_dl.YoutubeDL,
+        'extract_info',
+        lambda self, url, **kwargs: {'entries': iter(entries)},
+    )
+
+    results = downloader.get_playlist_info(_TEST_PLAYLIST_ID, start=2, end=4)
+
+    assert list(results) == entries[1:4]
+
+
+@override_settings(DOWNLOADER_BACKEND=_IN_PROCESS_BACKEND)
+def test_in_process_backend_raises_youtube_dl_errors(mocker):
+    youtube_dl = pytest.importorskip('youtube_dl')
+    downloader = apps.get_app_config('downloader')
+
+    def extract_info(self, url, **kwargs):
+        raise youtube_dl.utils.DownloadError('ERROR: garbage')
+
+    mocker.patch.object(youtube_dl.YoutubeDL, 'extract_info', extract_info)
+
+    with pytest.raises(YoutubeDLError):
+        downloader.get_playlist_info('asdf')
+
+
+@override_settings(DOWNLOADER_THREADS=1)
+def test_in_process_backend_resets_params_between_calls(mocker):
+    youtube_dl = pytest.importorskip('youtube_dl')
+    from downloader.backends.inprocess import InProcessBackend
+
+    def extract_info(self, url, **kwargs):
+        if self.params.get('ignoreerrors'):
+            self.params['logger'].error('ERROR: garbage')
+
+            return None
+
+        raise youtube_dl.utils.DownloadError('ERROR: garbage')
+
+    mocker.patch.object(youtube_dl.YoutubeDL, 'extract_info', extract_info)
+
+    backend = InProcessBackend()
+    with pytest.raises(YoutubeDLError):
+        backend.get_video_info(['asdf'])
+
+    with pytest.raises(YoutubeDLError):
+        backend.get_playlist_info('asdf')
+
+
+@override_settings(DOWNLOADER_THREADS=1)
+def test_in_process_backend_resets_postprocessors_between_calls(
+    tmp_path,
+    mocker,
+):
+    youtube_dl = pytest.importorskip('youtube_dl')
+    from downloader.backends.inprocess import InProcessBackend
+
+    postprocessors = []
+
+    def download(self, youtube_ids):
+        postprocessors.append([type(pp).__name__ for pp in self._pps])
+        path = self.params['outtmpl'] % {
+            'id': youtube_ids[0],
+            'title': 'Test Title',
+            'ext': 'm4a',
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+
+    mocker.patch.object(youtube_dl.YoutubeDL, 'download', download)
+
+    backend = InProcessBackend()
+    for download_format in [DownloadFormat(extract_audio=True), None]:
+        backend.download_video(
+            _TEST_VIDEO_ID,
+            str(tmp_path),
+            download_format=download_format,
+        )
+
+    assert postprocessors == [['FFmpegExtractAudioPP'], []]
+
+
+@override_settings(DOWNLOADER_BACKEND=_IN_PROCESS_BACKEND)
+def test_in_process_backend_downloads_videos(tmp_path, mocker):
+    youtube_dl = pytest.importorskip('youtube_dl')
+    downloader = apps.get_app_config('downloader')
+
+    def download(self, youtube_ids):
+        for youtube_id in youtube_ids:
+            path = self.params['outtmpl'] % {
+                'id': youtube_id,
+                'title': 'Test Title',
+                'ext': 'mp4',
+            }
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+
+    mocker.patch.object(youtube_dl.YoutubeDL, 'download', download)
+
+    filename = downloader.download_video(_TEST_VIDEO_ID, str(tmp_path))
+    filenames, errors = downloader.download_videos(['a', 'b'], str(tmp_path))
+
+    assert filename == 'Test Title-{}.mp4'.format(_TEST_VIDEO_ID)
+    assert filenames == {'a': 'Test Title-a.mp4', 'b': 'Test Title-b.mp4'}
+    assert errors == {}
+    assert len(_listdir(tmp_path)) == 3
+
+
 @attr.s
 class Params(object):
     preexisting = attr.ib()
@@ -373,3 +955,2114 @@ def test_create_and_update_videos(params, mocker):
             assert getattr(video, attr_name) == value
 
     assert playlist.videos.count() == len(params.expected)
+
+
+@pytest.mark.django_db
+def test_resyncing_an_unchanged_playlist_changes_nothing():
+    playlist = Playlist.objects.create(youtube_id='playlistID')
+    for youtube_id in ['gone', 'private', 'deleted', 'back']:
+        Video.objects.create(
+            playlist=playlist,
+            youtube_id=youtube_id,
+            title='Test Title',
+            added=yesterday,
+            removed=yesterday if youtube_id == 'back' else None,
+        )
+
+    playlist_info = [
+        {'id': 'private', 'title': '[Private video]'},
+        {'id': 'deleted', 'title': '[Deleted video]'},
+        {'id': 'back', 'title': 'Test Title'},
+    ]
+
+    first = playlist.create_and_update_videos(playlist_info)
+    assert first == SyncResult(removed=1, deleted=1, privated=1, restored=1)
+    assert playlist.videos.get(youtube_id='back').removed is None
+
+    removed = playlist.videos.get(youtube_id='gone').removed
+    assert not playlist.create_and_update_videos(playlist_info).changed
+    assert playlist.videos.get(youtube_id='gone').removed == removed
+
+
+def _sync_query_count(size, mocker):
+    playlist = Playlist.objects.create(youtube_id='playlistID' + str(size))
+
+    Video.objects.bulk_create([
+        Video(
+            playlist=playlist,
+            youtube_id='testID' + str(i),
+            title='Test Title',
+            added=yesterday,
+        )
+        for i in range(size)
+    ])
+
+    # A fifth each of removed, renamed, privated, deleted, and unchanged,
+    # plus as many new again.
+    titles = [
+        None,
+        'Test Title',
+        'Renamed',
+        '[Private video]',
+        '[Deleted video]',
+    ]
+    playlist_info = [
+        {'id': 'testID' + str(i), 'title': titles[i % 5]}
+        for i in range(size)
+        if i % 5
+    ] + [
+        {'id': 'newID' + str(i), 'title': 'New Title'}
+        for i in range(size)
+    ]
+
+    downloader = apps.get_app_config('downloader')
+
+    mocker.patch.object(downloader, 'get_playlist_info')
+    downloader.get_playlist_info.return_value = iter(playlist_info)
+
+    with CaptureQueriesContext(connection) as context:
+        playlist.create_and_update_videos()
+
+    assert playlist.videos.filter(removed__isnull=False).count() == size // 5
+    assert playlist.videos.filter(title='Renamed').count() == size // 5
+    assert playlist.videos.count() == size * 2
+
+    return len(context)
+
+
+@pytest.mark.django_db
+def test_create_and_update_videos_query_count_is_flat(mocker):
+    # Within a batch; past it, as many again per batch.
+    assert _sync_query_count(10, mocker) == _sync_query_count(60, mocker)
+
+
+@pytest.mark.django_db
+def test_create_and_update_videos_batches_within_the_parameter_limit(mocker):
+    params = []
+
+    def count(execute, sql, query_params, many, context):
+        params.append(len(query_params or ()))
+
+        return execute(sql, query_params, many, context)
+
+    # Several batches of renames, among the rest.
+    with connection.execute_wrapper(count):
+        queries = _sync_query_count(2000, mocker)
+
+    assert max(params) <= connection.features.max_query_params
+    assert queries < _sync_query_count(10, mocker) + 2000 // 50
+
+
+def test_download_pool_respects_concurrency_limits(tmp_path, mocker):
+    lock = threading.Lock()
+    running = Counter()
+    peaks = Counter()
+
+    def download_video(youtube_id, directory):
+        key = youtube_id.split('-')[0]
+        with lock:
+            running[key] += 1
+            running['total'] += 1
+            peaks[key] = max(peaks[key], running[key])
+            peaks['total'] = max(peaks['total'], running['total'])
+
+        time.sleep(0.01)
+
+        with lock:
+            running[key] -= 1
+            running['total'] -= 1
+
+        return youtube_id
+
+    mocker.patch.object(DownloaderAppConfig, 'download_video', download_video)
+
+    tasks = [
+        Task(key=key, youtube_id='{}-{}'.format(key, i))
+        for key in ['a', 'b', 'c']
+        for i in range(6)
+    ]
+    succeeded = []
+
+    pool = DownloadPool(
+        directory=str(tmp_path),
+        max_workers=4,
+        max_workers_per_key=2,
+    )
+    unstarted = pool.run(
+        tasks,
+        on_success=lambda task, filename: succeeded.append(filename),
+        on_failure=lambda task, exc: None,
+    )
+
+    assert unstarted == []
+    assert sorted(succeeded) == sorted(task.youtube_id for task in tasks)
+    assert peaks['total'] <= 4
+    assert all(peaks[key] <= 2 for key in ['a', 'b', 'c'])
+
+
+def test_download_pool_stops_starting_downloads_when_stopped(tmp_path, mocker):
+    pool = DownloadPool(directory=str(tmp_path), max_workers=1)
+
+    def download_video(youtube_id, directory):
+        pool.stop()
+
+        return youtube_id
+
+    mocker.patch.object(DownloaderAppConfig, 'download_video', download_video)
+
+    tasks = [Task(key=None, youtube_id=str(i)) for i in range(3)]
+    unstarted = pool.run(tasks, lambda *args: None, lambda *args: None)
+
+    assert unstarted == tasks[1:]
+
+
+@pytest.mark.django_db
+@override_settings(DOWNLOAD_POSTPROCESS_WORKERS=2)
+def test_download_pending_downloads_only_pending_videos(tmp_path, mocker):
+    playlist = Playlist.objects.create(youtube_id='playlistID')
+
+    def create(youtube_id, **kwargs):
+        return Video.objects.create(
+            playlist=playlist,
+            youtube_id=youtube_id,
+            title='Test Title',
+            added=yesterday,
+            **kwargs
+        )
+
+    pending = create('pending')
+    create('downloaded', downloaded=yesterday)
+    create('dontdownload', do_not_download=True)
+    create('removed', removed=yesterday)
+    create('deleted', deleted=True)
+    create('privated', privated=True)
+
+    download_video = mocker.patch.object(
+        DownloaderAppConfig,
+        'download_video',
+        side_effect=_fake_download_video,
+    )
+
+    _download_pending(tmp_path)
+
+    download_video.assert_called_once_with(
+        'pending',
+        str(tmp_path / 'store' / 'incoming'),
+        archive=str(tmp_path / 'store' / 'archive.txt'),
+        download_format=DownloadFormat(postprocess=False),
+    )
+    pending.refresh_from_db()
+    assert pending.downloaded is not None
+    assert not Video.objects.pending_download().exists()
+    assert (tmp_path / 'store' / 'archive.txt').read_text() == (
+        'youtube pending\n'
+    )
+
+
+def _fake_download_video(
+    youtube_id,
+    directory,
+    archive=None,
+    download_format=None,
+):
+    if download_format is not None and not download_format.postprocess:
+        # Left to be post-processed.
+        directory = os.path.join(staging_directory(directory), youtube_id)
+        os.makedirs(directory, exist_ok=True)
+
+    filename = 'Test Title-{}.mp4'.format(youtube_id)
+    open(os.path.join(directory, filename), 'w').close()
+
+    if download_format is not None and not download_format.postprocess:
+        return directory
+
+    return filename
+
+
+def _download_pending(tmp_path):
+    call_command(
+        'download_pending',
+        directory=str(tmp_path / 'library'),
+        store_directory=str(tmp_path / 'store'),
+    )
+
+
+@pytest.mark.django_db
+@override_settings(DOWNLOAD_POSTPROCESS_WORKERS=2)
+def test_download_pending_uses_playlists_download_profiles(tmp_path, mocker):
+    audio = DownloadProfile.objects.create(name='Audio', audio_only=True)
+    user = User.objects.create(username='test')
+    Profile.objects.create(user=user, download_profile=audio)
+
+    own = Playlist.objects.create(
+        youtube_id='playlistID1',
+        download_profile=DownloadProfile.objects.create(
+            name='720p',
+            max_height=720,
+        ),
+    )
+    users = Playlist.objects.create(youtube_id='playlistID2')
+    users.added_by.add(user)
+    default = Playlist.objects.create(youtube_id='playlistID3')
+
+    for i, playlist in enumerate([own, users, default]):
+        Video.objects.create(
+            playlist=playlist,
+            youtube_id='testID' + str(i),
+            title='Test Title',
+            added=yesterday,
+        )
+
+    download_video = mocker.patch.object(
+        DownloaderAppConfig,
+        'download_video',
+        side_effect=_fake_download_video,
+    )
+
+    _download_pending(tmp_path)
+
+    download_formats = {
+        call[0][0]: call[1].get('download_format')
+        for call in download_video.call_args_list
+    }
+    assert download_formats == {
+        'testID0': DownloadFormat(
+            selector='bestvideo[height<=720]+bestaudio/best[height<=720]',
+            postprocess=False,
+        ),
+        'testID1': DownloadFormat(
+            selector='bestaudio/best',
+            postprocess=False,
+            extract_audio=True,
+        ),
+        'testID2': DownloadFormat(postprocess=False),
+    }
+
+
+@pytest.mark.django_db
+def test_download_pending_only_links_videos_still_wanted(tmp_path, mocker):
+    for playlist_id, kwargs in [
+        ('playlistID1', {}),
+        ('playlistID2', {'do_not_download': True}),
+        ('playlistID3', {'removed': yesterday}),
+    ]:
+        Video.objects.create(
+            playlist=Playlist.objects.create(youtube_id=playlist_id),
+            youtube_id='sharedID',
+            title='Test Title',
+            added=yesterday,
+            **kwargs
+        )
+
+    mocker.patch.object(
+        DownloaderAppConfig,
+        'download_video',
+        side_effect=_fake_download_video,
+    )
+
+    _download_pending(tmp_path)
+
+    linked = Video.objects.filter(downloaded__isnull=False)
+    assert [video.playlist.youtube_id for video in linked] == ['playlistID1']
+    assert os.listdir(str(tmp_path / 'library')) == ['playlistID1']
+
+
+@pytest.mark.django_db
+def test_download_pending_downloads_shared_videos_once(tmp_path, mocker):
+    for playlist_id in ['playlistID1', 'playlistID2']:
+        Video.objects.create(
+            playlist=Playlist.objects.create(youtube_id=playlist_id),
+            youtube_id='sharedID',
+            title='Test Title',
+            added=yesterday,
+        )
+
+    download_video = mocker.patch.object(
+        DownloaderAppConfig,
+        'download_video',
+        side_effect=_fake_download_video,
+    )
+
+    _download_pending(tmp_path)
+
+    assert download_video.call_count == 1
+    assert not Video.objects.pending_download().exists()
+    for playlist_id in ['playlistID1', 'playlistID2']:
+        path = tmp_path / 'library' / playlist_id / 'Test Title-sharedID.mp4'
+        assert path.exists()
+
+    # Joining another playlist later needs no download at all.
+    Video.objects.create(
+        playlist=Playlist.objects.create(youtube_id='playlistID3'),
+        youtube_id='sharedID',
+        title='Test Title',
+        added=now,
+    )
+
+    _download_pending(tmp_path)
+
+    assert download_video.call_count == 1
+    assert (
+        tmp_path / 'library' / 'playlistID3' / 'Test Title-sharedID.mp4'
+    ).exists()
+
+
+@pytest.mark.django_db
+def test_sync_playlists_fetches_concurrently(mocker):
+    for i in range(4):
+        Playlist.objects.create(youtube_id='playlistID' + str(i))
+
+    running = Counter()
+
+    async def get_playlist_info_async(youtube_id):
+        running['now'] += 1
+        running['peak'] = max(running['peak'], running['now'])
+        await asyncio.sleep(0.01)
+        running['now'] -= 1
+
+        if youtube_id == 'playlistID3':
+            raise YoutubeDLError()
+
+        yield {'id': youtube_id + '-video', 'title': 'Test Title'}
+
+    downloader = apps.get_app_config('downloader')
+    mocker.patch.object(
+        downloader,
+        'get_playlist_info_async',
+        get_playlist_info_async,
+    )
+
+    call_command('sync_playlists', concurrency=2)
+
+    assert running['peak'] == 2
+    assert sorted(Video.objects.values_list('youtube_id', flat=True)) == [
+        'playlistID0-video',
+        'playlistID1-video',
+        'playlistID2-video',
+    ]
+
+
+@pytest.mark.django_db
+def test_sync_playlists_syncs_the_others_when_one_raises_anything(mocker):
+    for i in range(3):
+        Playlist.objects.create(youtube_id='playlistID' + str(i))
+
+    async def get_playlist_info_async(youtube_id):
+        await asyncio.sleep(0.01)
+        if youtube_id == 'playlistID0':
+            raise ValueError('Bad JSON')
+
+        yield {'id': youtube_id + '-video', 'title': 'Test Title'}
+
+    downloader = apps.get_app_config('downloader')
+    mocker.patch.object(
+        downloader,
+        'get_playlist_info_async',
+        get_playlist_info_async,
+    )
+
+    create_and_update_videos = Playlist.create_and_update_videos
+
+    def reconcile(self, playlist_info):
+        if self.youtube_id == 'playlistID1':
+            raise RuntimeError('Database broke')
+
+        return create_and_update_videos(self, playlist_info)
+
+    mocker.patch.object(Playlist, 'create_and_update_videos', reconcile)
+
+    stderr = io.StringIO()
+    call_command('sync_playlists', stderr=stderr)
+
+    assert list(Video.objects.values_list('youtube_id', flat=True)) == [
+        'playlistID2-video',
+    ]
+    assert '2 playlists failed to sync.' in stderr.getvalue()
+
+
+def _incremental_sync(mocker, stored, playlist_info, page_size, deleted=()):
+    playlist = Playlist.objects.create(
+        youtube_id='playlistID',
+        last_full_sync=now,
+    )
+
+    Video.objects.bulk_create([
+        Video(
+            playlist=playlist,
+            youtube_id=youtube_id,
+            title='Test Title',
+            added=yesterday,
+            deleted=youtube_id in deleted,
+        )
+        for youtube_id in stored
+    ])
+
+    windows = []
+
+    def get_playlist_info(youtube_id, start=None, end=None):
+        windows.append((start, end))
+
+        return iter(playlist_info[start - 1:end])
+
+    downloader = apps.get_app_config('downloader')
+    mocker.patch.object(downloader, 'get_playlist_info', get_playlist_info)
+
+    with override_settings(SYNC_PAGE_SIZE=page_size):
+        result = playlist.update_new_videos()
+
+    return playlist, result, windows
+
+
+@freeze_time('2018-12-02 00:00:00.0')
+@pytest.mark.django_db
+def test_update_new_videos_finds_videos_appended_to_the_end(mocker):
+    stored = ['testID' + str(i) for i in range(25)]
+    playlist_info = [
+        {'id': youtube_id, 'title': 'Test Title'}
+        for youtube_id in stored + ['new1', 'new2']
+    ]
+
+    playlist, result, windows = _incremental_sync(
+        mocker,
+        stored,
+        playlist_info,
+        page_size=10,
+    )
+
+    assert windows == [(1, 10), (16, 25), (26, 35)]
+    assert result.created == 2
+    assert playlist.videos.filter(added=now).count() == 2
+
+
+@freeze_time('2018-12-02 00:00:00.0')
+@pytest.mark.django_db
+def test_update_new_videos_finds_videos_added_to_the_front(mocker):
+    stored = ['testID' + str(i) for i in range(25)]
+    playlist_info = [
+        {'id': youtube_id, 'title': 'Test Title'}
+        # `testID0` has left the playlist.
+        for youtube_id in ['new1', 'new2'] + stored[1:]
+    ]
+
+    playlist, result, windows = _incremental_sync(
+        mocker,
+        stored,
+        playlist_info,
+        page_size=10,
+    )
+
+    assert windows == [(1, 10), (11, 15), (16, 25), (26, 35)]
+    assert result.created == 2
+    assert result.removed == 0
+    assert not playlist.videos.filter(removed__isnull=False).exists()
+
+
+@freeze_time('2018-12-02 00:00:00.0')
+@pytest.mark.django_db
+def test_update_new_videos_knows_videos_already_deleted(mocker):
+    stored = ['testID' + str(i) for i in range(25)]
+    deleted = stored[3::5]
+    playlist_info = [
+        {
+            'id': youtube_id,
+            'title': (
+                '[Deleted video]' if youtube_id in deleted else 'Test Title'
+            ),
+        }
+        for youtube_id in stored
+    ]
+
+    playlist, result, windows = _incremental_sync(
+        mocker,
+        stored,
+        playlist_info,
+        page_size=10,
+        deleted=deleted,
+    )
+
+    assert windows == [(1, 10), (16, 25), (26, 35)]
+    assert not result.changed
+
+
+@pytest.mark.parametrize('stored, total, expected', [
+    (50, 50, [(1, 100)]),
+    (200, 250, [(1, 100), (101, 200), (201, 300)]),
+])
+def test_incremental_fetch_reads_each_window_once(stored, total, expected):
+    fetch = IncrementalFetch(known={}, stored=stored, page_size=100)
+
+    windows = []
+    window = fetch.next_window()
+    while window is not None:
+        windows.append(window)
+        start, end = window
+        fetch.feed([
+            {'id': 'testID' + str(i), 'title': 'Test Title'}
+            for i in range(start, min(end, total) + 1)
+        ])
+        window = fetch.next_window()
+
+    assert windows == expected
+
+
+@freeze_time('2018-12-02 00:00:00.0')
+@pytest.mark.django_db
+def test_sync_falls_back_to_a_full_sync_when_due(mocker):
+    playlist = Playlist.objects.create(
+        youtube_id='playlistID',
+        last_full_sync=yesterday - datetime.timedelta(days=1),
+    )
+    Video.objects.create(
+        playlist=playlist,
+        youtube_id='testID',
+        title='Test Title',
+        added=yesterday,
+    )
+
+    downloader = apps.get_app_config('downloader')
+    mocker.patch.object(downloader, 'get_playlist_info')
+    downloader.get_playlist_info.return_value = iter([])
+
+    result = playlist.sync()
+
+    downloader.get_playlist_info.assert_called_once_with('playlistID')
+    assert result.removed == 1
+    playlist.refresh_from_db()
+    assert playlist.last_full_sync == now
+
+
+def _create_videos(count):
+    playlist = Playlist.objects.create(youtube_id='playlistID')
+
+    return [
+        Video.objects.create(
+            playlist=playlist,
+            youtube_id='testID' + str(i),
+            title='Test Title',
+            added=yesterday,
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.mark.django_db
+def test_admin_shows_running_downloads_progress(admin_client, tmp_path):
+    video, = _create_videos(1)
+    DownloadJob.objects.enqueue(Video.objects.all())
+
+    command = DownloadPendingCommand()
+    command.owner = 'test'
+    command.reported = {}
+    command.postprocessing = {}
+    job, = DownloadJob.objects.claim(command.owner, 1)
+    task = Task(key=None, youtube_id=video.youtube_id, payload=job)
+
+    with override_settings(DOWNLOAD_PROGRESS_DIRECTORY=str(tmp_path)):
+        # As reported by a download on the same host as `download_pending`.
+        progress.store.update(
+            video.youtube_id,
+            progress.Progress(percent=42.0, speed=2048, eta=65),
+            force=True,
+        )
+        command.renew([task])
+
+    # Wherever the admin is served from.
+    response = admin_client.get('/admin/downloader/downloadjob/')
+
+    content = response.content.decode()
+    assert '42.0%' in content
+    assert '2.0 KiB/s' in content
+    assert '1:05' in content
+
+
+@pytest.mark.django_db
+def test_download_jobs_are_enqueued_once():
+    _create_videos(3)
+
+    assert DownloadJob.objects.enqueue(Video.objects.pending_download()) == 3
+    assert DownloadJob.objects.enqueue(Video.objects.pending_download()) == 0
+    assert DownloadJob.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_download_jobs_are_claimed_by_one_worker_only():
+    _create_videos(3)
+    DownloadJob.objects.enqueue(Video.objects.pending_download())
+
+    first = DownloadJob.objects.claim('first', limit=2)
+    second = DownloadJob.objects.claim('second', limit=2)
+
+    assert len(first) == 2
+    assert len(second) == 1
+    assert not {job.pk for job in first} & {job.pk for job in second}
+    assert DownloadJob.objects.claim('third', limit=2) == []
+
+
+@pytest.mark.django_db
+def test_expired_download_job_leases_are_reclaimed():
+    _create_videos(1)
+    DownloadJob.objects.enqueue(Video.objects.pending_download())
+
+    with freeze_time(yesterday):
+        [job] = DownloadJob.objects.claim('crashed', limit=1)
+
+    [job] = DownloadJob.objects.claim('second', limit=1)
+
+    assert job.lease_owner == 'second'
+    assert job.attempts == 2
+
+
+@pytest.mark.django_db
+def test_download_jobs_whose_leases_keep_expiring_give_up():
+    _create_videos(1)
+    DownloadJob.objects.enqueue(Video.objects.pending_download())
+
+    with override_settings(DOWNLOAD_MAX_ATTEMPTS=2):
+        # Killing its worker every time.
+        for day in [3, 2]:
+            with freeze_time(now - datetime.timedelta(days=day)):
+                [job] = DownloadJob.objects.claim('crashed', limit=1)
+
+        assert DownloadJob.objects.claim('owner', limit=1) == []
+
+    job.refresh_from_db()
+    assert job.status == DownloadJob.FAILED
+    assert job.attempts == 2
+
+
+@pytest.mark.django_db
+def test_download_jobs_give_up_after_max_attempts():
+    _create_videos(1)
+    DownloadJob.objects.enqueue(Video.objects.pending_download())
+
+    with override_settings(DOWNLOAD_MAX_ATTEMPTS=2):
+        for i in range(2):
+            [job] = DownloadJob.objects.claim('owner', limit=1)
+            job.fail('owner', 'error')
+
+    job.refresh_from_db()
+    assert job.status == DownloadJob.FAILED
+    assert job.last_error == 'error'
+    assert DownloadJob.objects.claim('owner', limit=1) == []
+
+
+@pytest.mark.django_db
+def test_completing_a_download_job_marks_the_video_downloaded():
+    [video] = _create_videos(1)
+    DownloadJob.objects.enqueue(Video.objects.pending_download())
+
+    [job] = DownloadJob.objects.claim('owner', limit=1)
+    job.complete('owner')
+
+    video.refresh_from_db()
+    assert video.downloaded is not None
+    assert DownloadJob.objects.get().status == DownloadJob.DONE
+
+
+@pytest.mark.django_db
+def test_completing_a_download_job_leaves_videos_no_longer_wanted():
+    [video] = _create_videos(1)
+    DownloadJob.objects.enqueue(Video.objects.pending_download())
+
+    [job] = DownloadJob.objects.claim('owner', limit=1)
+    Video.objects.update(do_not_download=True)
+    job.complete('owner')
+
+    video.refresh_from_db()
+    assert video.downloaded is None
+    assert DownloadJob.objects.get().status == DownloadJob.DONE
+
+
+def test_download_pool_batches_videos_of_one_key(tmp_path, mocker):
+    batches = []
+
+    def download_videos(youtube_ids, directory):
+        batches.append(youtube_ids)
+
+        return (
+            {youtube_id: youtube_id for youtube_id in youtube_ids[1:]},
+            {youtube_ids[0]: YoutubeDLError()},
+        )
+
+    mocker.patch.object(
+        DownloaderAppConfig,
+        'download_videos',
+        download_videos,
+    )
+
+    tasks = [
+        Task(key=key, youtube_id='{}-{}'.format(key, i))
+        for key in ['a', 'b']
+        for i in range(3)
+    ]
+    succeeded = []
+    failed = []
+
+    pool = DownloadPool(directory=str(tmp_path), max_workers=1, batch_size=2)
+    pool.run(
+        tasks,
+        on_success=lambda task, filename: succeeded.append(filename),
+        on_failure=lambda task, exc: failed.append(task.youtube_id),
+    )
+
+    assert batches == [['a-0', 'a-1'], ['b-0', 'b-1'], ['a-2'], ['b-2']]
+    assert sorted(failed) == ['a-0', 'a-2', 'b-0', 'b-2']
+    assert sorted(succeeded) == ['a-1', 'b-1']
+
+
+@freeze_time('2018-12-02 00:00:00.0')
+@pytest.mark.django_db
+def test_playlist_sync_interval_adapts_to_changes():
+    playlist = Playlist.objects.create(youtube_id='playlistID')
+
+    with override_settings(
+        SYNC_DEFAULT_INTERVAL=datetime.timedelta(hours=1),
+        SYNC_MIN_INTERVAL=datetime.timedelta(minutes=20),
+        SYNC_MAX_INTERVAL=datetime.timedelta(hours=3),
+    ):
+        intervals = []
+        for changed in [True, True, False, False, False, False]:
+            playlist.schedule_next_sync(changed)
+            intervals.append(playlist.sync_interval)
+
+    assert intervals == [
+        datetime.timedelta(minutes=30),
+        datetime.timedelta(minutes=20),
+        datetime.timedelta(minutes=40),
+        datetime.timedelta(minutes=80),
+        datetime.timedelta(minutes=160),
+        datetime.timedelta(hours=3),
+    ]
+
+    playlist.refresh_from_db()
+    assert playlist.last_sync == now
+    assert playlist.next_sync == now + datetime.timedelta(hours=3)
+    assert 0 < playlist.change_rate < 1
+
+
+@freeze_time('2018-12-02 00:00:00.0')
+@pytest.mark.django_db
+def test_schedule_syncs_syncs_only_due_playlists(mocker):
+    Playlist.objects.create(youtube_id='never')
+    Playlist.objects.create(youtube_id='due', next_sync=yesterday)
+    Playlist.objects.create(
+        youtube_id='later',
+        next_sync=now + datetime.timedelta(hours=1),
+    )
+
+    synced = []
+
+    def get_playlist_info(youtube_id, start=None, end=None):
+        synced.append(youtube_id)
+
+        return iter([{'id': youtube_id + '-video', 'title': 'Test Title'}])
+
+    downloader = apps.get_app_config('downloader')
+    mocker.patch.object(downloader, 'get_playlist_info', get_playlist_info)
+
+    call_command('schedule_syncs', once=True)
+
+    assert sorted(synced) == ['due', 'never']
+    for playlist in Playlist.objects.filter(youtube_id__in=synced):
+        assert playlist.last_sync == now
+        assert playlist.next_sync > now
+
+
+@freeze_time('2018-12-02 00:00:00.0')
+@pytest.mark.django_db
+def test_schedule_syncs_carries_on_past_a_broken_playlist(mocker):
+    Playlist.objects.create(youtube_id='broken', next_sync=yesterday)
+    Playlist.objects.create(youtube_id='fine', next_sync=yesterday)
+
+    synced = []
+
+    def get_playlist_info(youtube_id, start=None, end=None):
+        if youtube_id == 'broken':
+            raise ValueError('unexpected')
+
+        synced.append(youtube_id)
+
+        return iter([{'id': youtube_id + '-video', 'title': 'Test Title'}])
+
+    downloader = apps.get_app_config('downloader')
+    mocker.patch.object(downloader, 'get_playlist_info', get_playlist_info)
+
+    call_command('schedule_syncs', once=True)
+
+    assert synced == ['fine']
+    broken = Playlist.objects.get(youtube_id='broken')
+    assert broken.next_sync > now
+
+
+def test_bandwidth_is_shared_between_downloads():
+    bandwidth = BandwidthScheduler(rate_limit=lambda: 1000)
+
+    # Alone, a download gets everything.
+    alone = bandwidth.acquire(expected=1, slots=4)
+    assert alone == 1000
+    bandwidth.release(alone)
+
+    # With a backlog, an even split.
+    rates = [bandwidth.acquire(expected=4, slots=4) for _ in range(4)]
+    assert rates == [250] * 4
+
+    # What's freed goes to whoever starts next.
+    bandwidth.release(rates.pop())
+    assert bandwidth.acquire(expected=2, slots=4) == 250
+
+
+def test_bandwidth_is_never_handed_out_past_the_budget():
+    bandwidth = BandwidthScheduler(rate_limit=lambda: 1000)
+
+    rates = [bandwidth.acquire(expected=1, slots=4)]
+    assert rates == [1000]
+    assert not bandwidth.has_room(slots=4)
+    assert bandwidth.acquire(expected=2, slots=4) == 0
+
+    bandwidth.release(rates.pop())
+    rates = [bandwidth.acquire(expected=2, slots=4) for _ in range(2)]
+    assert rates == [500, 500]
+
+    # Even the floor is capped at what's left.
+    bandwidth.release(rates.pop())
+    rates += [bandwidth.acquire(expected=1, slots=4) for _ in range(2)]
+    assert rates == [500, 500, 0]
+    assert sum(rates) <= 1000
+
+
+def test_bandwidth_is_unlimited_without_a_rate_limit():
+    bandwidth = BandwidthScheduler(rate_limit=lambda: None)
+
+    assert bandwidth.acquire(expected=1, slots=4) is None
+
+
+@override_settings(
+    DOWNLOAD_RATE_LIMIT=None,
+    DOWNLOAD_RATE_LIMIT_SCHEDULE=[
+        (datetime.time(9), datetime.time(17), 1000),
+        (datetime.time(22), datetime.time(2), 2000),
+    ],
+)
+def test_current_rate_limit_follows_the_schedule():
+    for time_of_day, expected in [
+        ('08:59', None),
+        ('09:00', 1000),
+        ('16:59', 1000),
+        ('17:00', None),
+        ('23:00', 2000),
+        ('01:00', 2000),
+    ]:
+        with freeze_time('2018-12-03 {}:00'.format(time_of_day)):
+            assert current_rate_limit() == expected
+
+
+def test_download_pool_passes_rate_limits(tmp_path, mocker):
+    rate_limits = []
+
+    def download_video(youtube_id, directory, rate_limit=None):
+        rate_limits.append(rate_limit)
+
+        return youtube_id
+
+    mocker.patch.object(DownloaderAppConfig, 'download_video', download_video)
+
+    pool = DownloadPool(
+        directory=str(tmp_path),
+        max_workers=2,
+        bandwidth=BandwidthScheduler(rate_limit=lambda: 1000),
+    )
+    pool.run(
+        [Task(key=i, youtube_id=str(i)) for i in range(3)],
+        lambda *args: None,
+        lambda *args: None,
+    )
+
+    assert rate_limits[:2] == [500, 500]
+    assert sum(rate_limits[:2]) <= 1000
+
+
+def test_download_pool_waits_for_bandwidth_to_free_up(tmp_path, mocker):
+    lock = threading.Lock()
+    running = []
+    overlapping = []
+
+    def download_video(youtube_id, directory, rate_limit=None):
+        with lock:
+            running.append(rate_limit)
+            overlapping.append(sum(running))
+
+        time.sleep(0.05)
+
+        with lock:
+            running.remove(rate_limit)
+
+        return youtube_id
+
+    mocker.patch.object(DownloaderAppConfig, 'download_video', download_video)
+
+    # The first download starts alone and takes everything, so the one
+    # that turns up while it runs has to wait for it.
+    refills = [[Task(key=1, youtube_id='1')]]
+    pool = DownloadPool(
+        directory=str(tmp_path),
+        max_workers=2,
+        bandwidth=BandwidthScheduler(rate_limit=lambda: 1000),
+        heartbeat_interval=0.01,
+    )
+    pool.run(
+        [Task(key=0, youtube_id='0')],
+        lambda *args: None,
+        lambda *args: None,
+        refill=lambda limit: refills.pop() if refills else [],
+    )
+
+    assert overlapping == [1000, 1000]
+
+
+def test_download_pool_starts_highest_priority_first(tmp_path, mocker):
+    started = []
+
+    def download_video(youtube_id, directory):
+        started.append(youtube_id)
+
+        return youtube_id
+
+    mocker.patch.object(DownloaderAppConfig, 'download_video', download_video)
+
+    tasks = [
+        Task(key='low', youtube_id='low-old', priority=(0, 1)),
+        Task(key='low', youtube_id='low-new', priority=(0, 3)),
+        Task(key='high', youtube_id='high-new', priority=(-1, 4)),
+        Task(key='mid', youtube_id='mid-old', priority=(0, 2)),
+    ]
+
+    pool = DownloadPool(directory=str(tmp_path), max_workers=1)
+    pool.run(tasks, lambda *args: None, lambda *args: None)
+
+    assert started == ['high-new', 'low-old', 'mid-old', 'low-new']
+
+
+def test_subprocess_backend_limits_download_rate(tmp_path, mocker):
+    downloader = apps.get_app_config('downloader')
+
+    calls = []
+
+    def run(args, cwd):
+        calls.append(args)
+        open(os.path.join(cwd, 'Test Title.mp4'), 'w').close()
+
+    _fake_download(mocker, run)
+
+    downloader.download_video(_TEST_VIDEO_ID, str(tmp_path), rate_limit=500)
+
+    assert calls == [
+        [
+            'youtube-dl', '--newline', '--limit-rate', '500',
+            '--', _TEST_VIDEO_ID,
+        ],
+    ]
+
+
+def test_subprocess_backend_skips_archived_downloads(tmp_path, mocker):
+    backend = SubprocessBackend()
+
+    calls = []
+
+    def run(args, cwd):
+        calls.append(args)
+
+    _fake_download(mocker, run)
+
+    archive = str(tmp_path / 'archive.txt')
+    backend.download_videos(['testID'], str(tmp_path), archive=archive)
+
+    assert calls[0][-4:] == ['--download-archive', archive, '--', 'testID']
+
+
+def test_download_archive_is_only_appended_to(tmp_path):
+    path = tmp_path / 'archive.txt'
+    archive = DownloadArchive(str(path))
+
+    archive.extend(['testID1', 'testID0'])
+    # As youtube-dl would.
+    with path.open('a') as f:
+        f.write('youtube testID2\n')
+    archive.add('testID2')
+    archive.add('testID3')
+
+    assert path.read_text() == (
+        'youtube testID0\n'
+        'youtube testID1\n'
+        'youtube testID2\n'
+        'youtube testID3\n'
+    )
+    assert 'testID3' in archive
+    assert 'testID4' not in archive
+
+
+def test_backend_reports_archived_downloads_as_already_downloaded(
+    tmp_path,
+    mocker,
+):
+    backend = SubprocessBackend()
+    _fake_download(mocker, lambda args, cwd: None)
+
+    archive = tmp_path / 'archive.txt'
+    archive.write_text('youtube testID0\n')
+
+    with pytest.raises(AlreadyDownloadedError):
+        backend.download_video('testID0', str(tmp_path), archive=str(archive))
+
+    with pytest.raises(NoFilesCreatedError):
+        backend.download_video('testID1', str(tmp_path), archive=str(archive))
+
+    filenames, errors = backend.download_videos(
+        ['testID0', 'testID1'],
+        str(tmp_path),
+        archive=str(archive),
+    )
+    assert filenames == {}
+    assert type(errors['testID0']) is AlreadyDownloadedError
+    assert type(errors['testID1']) is NoFilesCreatedError
+
+
+@pytest.mark.django_db
+def test_download_pending_skips_stale_archive_entries(tmp_path, mocker):
+    _create_videos(2)
+    archive = DownloadArchive(str(tmp_path / 'store' / 'archive.txt'))
+    # Listed, but never stored.
+    archive.add('testID1')
+
+    archives = []
+
+    def download_video(youtube_id, directory, archive=None, **kwargs):
+        archives.append((youtube_id, archive))
+        if archive is not None:
+            # Downloaded, but lost before it could be stored.
+            DownloadArchive(archive).add(youtube_id)
+
+            raise AlreadyDownloadedError()
+
+        return _fake_download_video(youtube_id, directory, **kwargs)
+
+    mocker.patch.object(DownloaderAppConfig, 'download_video', download_video)
+
+    _download_pending(tmp_path)
+
+    assert archives == [
+        ('testID0', archive.path),
+        ('testID1', None),
+        ('testID0', None),
+    ]
+    assert not Video.objects.pending_download().exists()
+    assert list(DownloadJob.objects.values_list('attempts', flat=True)) == [
+        1,
+        1,
+    ]
+
+
+@pytest.mark.django_db
+def test_download_pending_links_videos_stored_since_claimed(tmp_path):
+    video, = _create_videos(1)
+    DownloadJob.objects.enqueue(Video.objects.all())
+
+    command = DownloadPendingCommand()
+    command.store = Store(
+        root=str(tmp_path / 'store'),
+        library=str(tmp_path / 'library'),
+    )
+    command.quota = Quota(command.store)
+    command.owner = 'test'
+    job, = DownloadJob.objects.claim(command.owner, 1)
+
+    os.makedirs(command.store.incoming)
+    open(os.path.join(command.store.incoming, 'video.mp4'), 'w').close()
+    command.store.add('testID0', 'video.mp4')
+
+    command.on_failure(
+        Task(key=None, youtube_id='testID0', payload=job),
+        AlreadyDownloadedError(),
+    )
+
+    video.refresh_from_db()
+    assert video.downloaded is not None
+    assert video.file_path == os.path.join('playlistID', 'video.mp4')
+    job.refresh_from_db()
+    assert job.status == DownloadJob.DONE
+
+
+@pytest.mark.django_db
+def test_download_pending_releases_videos_never_started(tmp_path):
+    _create_videos(1)
+    DownloadJob.objects.enqueue(Video.objects.all())
+
+    command = DownloadPendingCommand()
+    command.store = Store(
+        root=str(tmp_path / 'store'),
+        library=str(tmp_path / 'library'),
+    )
+    command.quota = Quota(command.store)
+    command.owner = 'test'
+    job, = DownloadJob.objects.claim(command.owner, 1)
+
+    command.on_failure(
+        Task(key=None, youtube_id='testID0', payload=job),
+        DownloadNotStartedError(),
+    )
+
+    job.refresh_from_db()
+    assert job.status == DownloadJob.PENDING
+    assert job.attempts == 0
+
+
+@pytest.mark.parametrize('message,error_class', [
+    ('ERROR: Unable to download webpage: HTTP Error 429: Too Many Requests',
+     RateLimitedError),
+    ('ERROR: The uploader has not made this video available in your'
+     ' country.', GeoBlockedError),
+    ('ERROR: Private video', VideoUnavailableError),
+    ('ERROR: Unable to extract video data; please report this issue',
+     ExtractorBrokenError),
+    ('ERROR: Something else entirely', YoutubeDLError),
+])
+def test_classify_error(message, error_class):
+    assert type(classify_error(message)) is error_class
+
+
+def test_get_playlist_info_raises_typed_errors(mocker):
+    downloader = apps.get_app_config('downloader')
+
+    _fake_youtube_dl(mocker, (
+        'import sys\n'
+        'sys.stderr.write("ERROR: HTTP Error 429: Too Many Requests\\n")\n'
+        'sys.exit(1)\n'
+    ))
+
+    with pytest.raises(RateLimitedError):
+        downloader.get_playlist_info(_TEST_PLAYLIST_ID)
+
+
+def test_throttle_backs_off_then_opens_the_circuit():
+    now = [0]
+    throttle = Throttle(
+        base=10,
+        maximum=25,
+        threshold=3,
+        cooldown=100,
+        clock=lambda: now[0],
+        random=lambda: 1,
+    )
+
+    throttle.record_failure(YoutubeDLError('not rate limited'))
+    assert throttle.allow(running=0)
+
+    delays = []
+    for i in range(4):
+        throttle.record_failure(RateLimitedError())
+        delays.append(throttle.delay())
+        assert not throttle.allow(running=0)
+
+    assert delays == [10, 20, 100, 200]
+
+    now[0] += 200
+    # Half open: a single probe.
+    assert throttle.allow(running=0)
+    assert not throttle.allow(running=1)
+
+    throttle.record_success()
+    assert throttle.allow(running=1)
+
+
+def test_download_pool_pauses_when_rate_limited(tmp_path, mocker):
+    started = []
+
+    def download_video(youtube_id, directory):
+        started.append(time.monotonic())
+        if len(started) == 1:
+            raise RateLimitedError()
+
+        return youtube_id
+
+    mocker.patch.object(DownloaderAppConfig, 'download_video', download_video)
+
+    failed = []
+    pool = DownloadPool(
+        directory=str(tmp_path),
+        max_workers=2,
+        throttle=Throttle(
+            base=0.2,
+            maximum=1,
+            threshold=5,
+            cooldown=1,
+            random=lambda: 1,
+        ),
+    )
+    tasks = [Task(key=None, youtube_id=str(i)) for i in range(2)]
+    refills = [tasks[1:]]
+    pool.run(
+        tasks[:1],
+        lambda *args: None,
+        lambda task, exc: failed.append(task),
+        refill=lambda limit: refills.pop() if refills else [],
+    )
+
+    assert failed == tasks[:1]
+    assert started[1] - started[0] >= 0.2
+
+
+def test_download_pool_keeps_beating_while_paused(tmp_path):
+    now = [0]
+    throttle = Throttle(
+        base=100,
+        maximum=100,
+        threshold=5,
+        cooldown=100,
+        clock=lambda: now[0],
+    )
+    throttle.record_failure(RateLimitedError())
+
+    pool = DownloadPool(
+        directory=str(tmp_path),
+        throttle=throttle,
+        heartbeat_interval=0.01,
+    )
+
+    beats = []
+
+    def heartbeat(tasks):
+        beats.append(tasks)
+        if len(beats) == 2:
+            pool.stop()
+
+    tasks = [Task(key=None, youtube_id='0')]
+    unstarted = pool.run(
+        tasks,
+        lambda *args: None,
+        lambda *args: None,
+        heartbeat=heartbeat,
+    )
+
+    assert beats == [[], []]
+    assert unstarted == tasks
+
+
+@pytest.mark.django_db
+@override_settings(DOWNLOAD_BACKOFF_BASE=0)
+def test_download_pending_retries_only_rate_limited_videos(tmp_path, mocker):
+    _create_videos(2)
+
+    rate_limited = []
+
+    def download_video(youtube_id, directory, **kwargs):
+        if youtube_id == 'testID0':
+            raise VideoUnavailableError()
+
+        if not rate_limited:
+            rate_limited.append(youtube_id)
+            raise RateLimitedError()
+
+        return _fake_download_video(youtube_id, directory, **kwargs)
+
+    mocker.patch.object(DownloaderAppConfig, 'download_video', download_video)
+
+    _download_pending(tmp_path)
+
+    unavailable, limited = DownloadJob.objects.order_by('video__youtube_id')
+    assert unavailable.status == DownloadJob.FAILED
+    assert unavailable.attempts == 1
+    assert limited.status == DownloadJob.DONE
+    assert limited.attempts == 1
+
+
+def test_subprocess_backend_fetches_video_info_in_one_call(mocker):
+    downloader = apps.get_app_config('downloader')
+
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append(args)
+
+        return subprocess.CompletedProcess(
+            args,
+            1,
+            stdout=json.dumps({'id': 'testID0'}) + '\n',
+            stderr='ERROR: [youtube] testID1: Private video\n',
+        )
+
+    mocker.patch.object(subprocess, 'run', run)
+
+    results = downloader.get_video_info(['testID0', 'testID1'])
+
+    assert results == [{'id': 'testID0'}]
+    assert calls == [[
+        'youtube-dl', '-j', '--ignore-errors', '--', 'testID0', 'testID1',
+    ]]
+
+
+@pytest.mark.django_db
+def test_video_metadata_is_fetched_in_batches_until_stale(mocker):
+    calls = []
+
+    def get_video_info(youtube_ids):
+        calls.append(list(youtube_ids))
+
+        return [
+            {
+                'id': youtube_id,
+                'duration': 61.0,
+                'upload_date': '20180102',
+                'formats': [{'format_id': '137'}, {'format_id': '140'}],
+                'requested_formats': [
+                    {'filesize': 1000},
+                    {'filesize_approx': 200},
+                ],
+            }
+            for youtube_id in youtube_ids
+        ]
+
+    mocker.patch.object(DownloaderAppConfig, 'get_video_info', get_video_info)
+
+    youtube_ids = ['testID' + str(i) for i in range(5)]
+    with override_settings(VIDEO_METADATA_TTL=datetime.timedelta(days=1)):
+        with freeze_time('2018-01-01'):
+            assert VideoMetadata.objects.refresh(youtube_ids, 2) == 5
+            assert VideoMetadata.objects.refresh(youtube_ids, 2) == 0
+
+        assert calls == [
+            ['testID0', 'testID1'],
+            ['testID2', 'testID3'],
+            ['testID4'],
+        ]
+
+        with freeze_time('2018-01-03'):
+            assert VideoMetadata.objects.refresh(youtube_ids[:1]) == 1
+
+    assert VideoMetadata.objects.count() == 5
+
+    metadata = VideoMetadata.objects.get(youtube_id='testID0')
+    assert metadata.duration == 61
+    assert metadata.filesize == 1200
+    assert metadata.upload_date == datetime.date(2018, 1, 2)
+    assert metadata.format_ids == ['137', '140']
+
+
+@pytest.mark.django_db
+@override_settings(
+    VIDEO_METADATA_TTL=datetime.timedelta(days=7),
+    VIDEO_METADATA_RETRY_AFTER=datetime.timedelta(days=1),
+)
+def test_video_metadata_remembers_failed_lookups(mocker):
+    calls = []
+
+    def get_video_info(youtube_ids):
+        calls.append(list(youtube_ids))
+        if youtube_ids == ['testID0']:
+            raise VideoUnavailableError()
+
+        return [
+            {'id': youtube_id}
+            for youtube_id in youtube_ids
+            if youtube_id != 'testID2'
+        ]
+
+    mocker.patch.object(DownloaderAppConfig, 'get_video_info', get_video_info)
+
+    youtube_ids = ['testID' + str(i) for i in range(3)]
+    with freeze_time('2018-01-01'):
+        # A batch that fails outright doesn't stop the ones after it.
+        assert VideoMetadata.objects.refresh(youtube_ids, 1) == 1
+        assert VideoMetadata.objects.refresh(youtube_ids, 1) == 0
+
+    with freeze_time('2018-01-03'):
+        assert VideoMetadata.objects.refresh(youtube_ids, 1) == 0
+
+    assert calls == [
+        ['testID0'],
+        ['testID1'],
+        ['testID2'],
+        ['testID0'],
+        ['testID2'],
+    ]
+    assert set(VideoMetadata.objects.filter(failed=True).values_list(
+        'youtube_id',
+        flat=True,
+    )) == {'testID0', 'testID2'}
+
+
+@pytest.mark.django_db
+def test_video_metadata_stops_when_rate_limited(mocker):
+    calls = []
+
+    def get_video_info(youtube_ids):
+        calls.append(list(youtube_ids))
+
+        raise RateLimitedError()
+
+    mocker.patch.object(DownloaderAppConfig, 'get_video_info', get_video_info)
+
+    assert VideoMetadata.objects.refresh(['testID0', 'testID1'], 1) == 0
+    assert calls == [['testID0']]
+    assert not VideoMetadata.objects.exists()
+
+
+def _store_video(store, playlist, youtube_id, size, accessed, **kwargs):
+    video = Video.objects.create(
+        playlist=playlist,
+        youtube_id=youtube_id,
+        title='Test Title',
+        added=yesterday,
+        **kwargs
+    )
+
+    os.makedirs(store.incoming, exist_ok=True)
+    filename = youtube_id + '.mp4'
+    with open(os.path.join(store.incoming, filename), 'wb') as f:
+        f.write(b'\0' * size)
+
+    stored = store.add(youtube_id, filename)
+    store.link(stored, Video.objects.filter(youtube_id=youtube_id))
+
+    timestamp = accessed.timestamp()
+    os.utime(store.path(stored), (timestamp, timestamp))
+    Video.objects.filter(youtube_id=youtube_id).update(last_accessed=accessed)
+
+    return video
+
+
+@pytest.mark.django_db
+def test_quota_evicts_gone_then_least_recently_used_videos(tmp_path):
+    store = Store(
+        root=str(tmp_path / 'store'),
+        library=str(tmp_path / 'library'),
+    )
+    playlist = Playlist.objects.create(youtube_id='playlistID')
+
+    day = datetime.timedelta(days=1)
+    old = _store_video(store, playlist, 'old', 100, now - 3 * day)
+    gone = _store_video(store, playlist, 'gone', 100, now, removed=now)
+    recent = _store_video(store, playlist, 'recent', 100, now)
+    _store_video(store, playlist, 'newest', 100, now + day)
+
+    VideoMetadata.objects.create(youtube_id='new', filesize=150, fetched=now)
+    quota = Quota(store, limit=400, playlist_limit=None, min_free=0)
+
+    assert quota.reserve('new', playlist)
+
+    for video in [gone, old]:
+        path = os.path.join(store.library, 'playlistID', video.youtube_id)
+        video.refresh_from_db()
+        assert video.file_path is None
+        assert video.downloaded is not None
+        assert not os.path.exists(path + '.mp4')
+
+    recent.refresh_from_db()
+    assert os.path.exists(store.library_path(recent))
+    assert sorted(
+        StoredVideo.objects.values_list('youtube_id', flat=True),
+    ) == ['newest', 'recent']
+    assert quota.usage() == 350
+
+
+@pytest.mark.django_db
+def test_quota_only_checks_access_times_of_videos_it_would_evict(
+    tmp_path,
+    mocker,
+):
+    store = Store(
+        root=str(tmp_path / 'store'),
+        library=str(tmp_path / 'library'),
+    )
+    playlist = Playlist.objects.create(youtube_id='playlistID')
+
+    day = datetime.timedelta(days=1)
+    watched = _store_video(store, playlist, 'watched', 100, now - 3 * day)
+    old = _store_video(store, playlist, 'old', 100, now - 2 * day)
+    _store_video(store, playlist, 'recent', 100, now - day)
+    _store_video(store, playlist, 'newest', 100, now)
+
+    # Watched since its access time was last stored.
+    watched.refresh_from_db()
+    timestamp = (now + day).timestamp()
+    os.utime(store.library_path(watched), (timestamp, timestamp))
+
+    VideoMetadata.objects.create(youtube_id='new', filesize=100, fetched=now)
+    accessed_since = mocker.spy(Quota, '_accessed_since')
+    quota = Quota(store, limit=400, playlist_limit=None, min_free=0)
+    assert quota.reserve('new', playlist)
+
+    checked = [
+        video.youtube_id
+        for call in accessed_since.call_args_list
+        for video in call[0][1]
+    ]
+    assert checked == ['watched', 'old']
+
+    watched.refresh_from_db()
+    assert watched.file_path is not None
+    assert watched.last_accessed == now + day
+    old.refresh_from_db()
+    assert old.file_path is None
+
+
+@pytest.mark.django_db
+def test_quota_keeps_videos_linked_into_other_playlists(tmp_path):
+    store = Store(
+        root=str(tmp_path / 'store'),
+        library=str(tmp_path / 'library'),
+    )
+    full, other = [
+        Playlist.objects.create(youtube_id=youtube_id)
+        for youtube_id in ['full', 'other']
+    ]
+
+    shared = _store_video(store, full, 'shared', 100, now)
+    Video.objects.create(
+        playlist=other,
+        youtube_id='shared',
+        title='Test Title',
+        added=yesterday,
+    )
+    store.link(
+        StoredVideo.objects.get(youtube_id='shared'),
+        Video.objects.filter(youtube_id='shared'),
+    )
+
+    quota = Quota(store, limit=None, playlist_limit=150, min_free=0)
+
+    VideoMetadata.objects.create(youtube_id='new', filesize=100, fetched=now)
+    assert quota.reserve('new', full)
+
+    shared.refresh_from_db()
+    assert shared.file_path is None
+    assert Video.objects.get(playlist=other).file_path is not None
+    assert StoredVideo.objects.filter(youtube_id='shared').exists()
+
+    # Nothing left in the playlist to make room with.
+    assert not quota.reserve('newer', full)
+
+
+@pytest.mark.django_db
+@override_settings(STORAGE_QUOTA=0)
+def test_download_pending_stops_when_out_of_space(tmp_path, mocker):
+    _create_videos(2)
+
+    download_video = mocker.patch.object(
+        DownloaderAppConfig,
+        'download_video',
+        side_effect=_fake_download_video,
+    )
+
+    _download_pending(tmp_path)
+
+    download_video.assert_not_called()
+    assert all(
+        job.status == DownloadJob.PENDING and job.attempts == 0
+        for job in DownloadJob.objects.all()
+    )
+
+
+def test_file_digest_streams_the_file(tmp_path):
+    content = os.urandom(3 * 2 ** 20 + 5)
+    (tmp_path / 'video.mp4').write_bytes(content)
+
+    assert file_digest(str(tmp_path / 'video.mp4')) == (
+        len(content),
+        hashlib.sha256(content).hexdigest(),
+    )
+
+
+@pytest.mark.django_db
+def test_verify_storage_reports_damaged_and_duplicate_files(tmp_path):
+    store = Store(
+        root=str(tmp_path / 'store'),
+        library=str(tmp_path / 'library'),
+    )
+    playlist = Playlist.objects.create(youtube_id='playlistID')
+
+    for youtube_id, size in [('a', 100), ('b', 100), ('c', 50), ('d', 60)]:
+        _store_video(store, playlist, youtube_id, size, now)
+
+    def path(youtube_id):
+        return store.path(StoredVideo.objects.get(youtube_id=youtube_id))
+
+    os.truncate(path('c'), 10)
+    os.remove(path('d'))
+
+    stderr = io.StringIO()
+    with pytest.raises(CommandError):
+        call_command(
+            'verify_storage',
+            directory=store.library,
+            store_directory=store.root,
+            workers=2,
+            stderr=stderr,
+        )
+
+    assert stderr.getvalue().splitlines() == [
+        'Truncated c: ' + path('c'),
+        'Missing d: ' + path('d'),
+        'Duplicate: a, b',
+    ]
+
+
+@pytest.mark.django_db
+def test_relocate_store_moves_flat_videos_into_shards(tmp_path):
+    flat = Store(
+        root=str(tmp_path / 'store'),
+        library=str(tmp_path / 'library'),
+        layout='flat',
+    )
+    playlist = Playlist.objects.create(youtube_id='playlistID')
+    video = _store_video(flat, playlist, 'testID', 10, now)
+
+    stored = StoredVideo.objects.get()
+    assert stored.path == os.path.join('objects', 'testID', 'testID.mp4')
+
+    # As if hardlinks weren't possible.
+    video.refresh_from_db()
+    link = flat.library_path(video)
+    os.remove(link)
+    os.symlink(flat.path(stored), link)
+
+    call_command(
+        'relocate_store',
+        directory=flat.library,
+        store_directory=flat.root,
+        layout='sharded',
+    )
+
+    stored.refresh_from_db()
+    assert stored.path == os.path.join('objects', 'te', 'testID', 'testID.mp4')
+    assert os.path.exists(flat.path(stored))
+    assert not os.path.exists(os.path.join(flat.root, 'objects', 'testID'))
+    assert os.path.realpath(link) == flat.path(stored)
+
+
+def test_metrics_are_added_up_across_processes(tmp_path, client, mocker):
+    mocker.patch.object(metrics, 'registry', metrics.Registry())
+
+    with override_settings(METRICS_DIRECTORY=str(tmp_path)):
+        other = metrics.Registry()
+        other.observe('ytdl_download_bytes', 2 * 2 ** 20)
+        other.observe('ytdl_downloads_total', 1, outcome='success')
+        other.flush()
+
+        metrics.observe('ytdl_download_bytes', 200 * 2 ** 20)
+        metrics.increment('ytdl_downloads_total', outcome='success')
+
+        response = client.get('/metrics')
+
+    assert response.status_code == 200
+    lines = response.content.decode().splitlines()
+    assert 'ytdl_downloads_total{outcome="success"} 2' in lines
+    assert 'ytdl_download_bytes_bucket{le="1048576"} 0' in lines
+    assert 'ytdl_download_bytes_bucket{le="10485760"} 1' in lines
+    assert 'ytdl_download_bytes_bucket{le="+Inf"} 2' in lines
+    assert 'ytdl_download_bytes_count 2' in lines
+
+
+def test_metrics_of_exited_processes_are_added_up_once(tmp_path, mocker):
+    mocker.patch.object(metrics, 'registry', metrics.Registry())
+
+    with override_settings(METRICS_DIRECTORY=str(tmp_path)):
+        # Nothing observed, nothing written.
+        metrics.flush()
+        assert os.listdir(str(tmp_path)) == []
+
+        for i in range(3):
+            exited = metrics.Registry()
+            exited.observe('ytdl_downloads_total', 1, outcome='success')
+            # Well past any real process ID.
+            exited._filename = '{}-exited.json'.format(2 ** 30 + i)
+            exited.flush()
+
+        metrics.increment('ytdl_downloads_total', outcome='success')
+
+        for _ in range(2):
+            totals = metrics.collect()
+            assert totals == {
+                ('ytdl_downloads_total', (('outcome', 'success'),)): 4,
+            }
+
+    assert sorted(
+        filename
+        for filename in os.listdir(str(tmp_path))
+        if filename.endswith('.json')
+    ) == sorted(['aggregate.json', metrics.registry._filename])
+
+
+@pytest.mark.django_db
+def test_sync_records_its_query_count(tmp_path, mocker):
+    mocker.patch.object(metrics, 'registry', metrics.Registry())
+
+    with override_settings(METRICS_DIRECTORY=str(tmp_path)):
+        queries = _sync_query_count(10, mocker)
+        totals = metrics.collect()
+
+    count = totals[('ytdl_sync_queries', (('kind', 'full'),))]
+    assert count[-2:] == [queries, 1]
+
+
+@pytest.mark.django_db
+def test_sync_times_only_the_database(tmp_path, mocker):
+    mocker.patch.object(metrics, 'registry', metrics.Registry())
+    playlist = Playlist.objects.create(youtube_id='playlistID')
+
+    consumed = []
+
+    def get_playlist_info(youtube_id):
+        for i in range(3):
+            # youtube-dl taking its time.
+            time.sleep(0.1)
+            consumed.append(i)
+
+            yield {'id': 'testID' + str(i), 'title': 'Test Title'}
+
+    downloader = apps.get_app_config('downloader')
+    mocker.patch.object(downloader, 'get_playlist_info', get_playlist_info)
+    known_videos = Playlist._known_videos
+
+    def _known_videos(self):
+        # Still streaming once the database has been read.
+        assert consumed == []
+
+        return known_videos(self)
+
+    mocker.patch.object(Playlist, '_known_videos', _known_videos)
+
+    with override_settings(METRICS_DIRECTORY=str(tmp_path)):
+        playlist.create_and_update_videos()
+        totals = metrics.collect()
+
+    seconds = totals[('ytdl_sync_seconds', (('kind', 'full'),))]
+    assert seconds[-1] == 1
+    assert seconds[-2] < 0.3
+    assert playlist.videos.count() == 3
+
+
+def test_download_profiles_build_format_selectors():
+    assert DownloadProfile(
+        audio_only=True,
+        container=DownloadProfile.MP4,
+    ).download_format() == DownloadFormat(
+        selector='bestaudio[ext=m4a]/bestaudio/best',
+        extract_audio=True,
+    )
+    assert DownloadProfile(
+        max_height=720,
+        container=DownloadProfile.MP4,
+    ).download_format() == DownloadFormat(
+        selector=(
+            'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]'
+            '/best[height<=720][ext=mp4]'
+            '/bestvideo[height<=720]+bestaudio'
+            '/best[height<=720]'
+        ),
+        merge_output_format='mp4',
+    )
+    assert DownloadProfile(
+        format='worst',
+        container=DownloadProfile.MKV,
+    ).download_format() == DownloadFormat(
+        selector='worst',
+        merge_output_format='mkv',
+    )
+    assert DownloadProfile().download_format() == DownloadFormat()
+
+
+def test_subprocess_backend_passes_download_format(tmp_path, mocker):
+    calls = []
+
+    def run(args, cwd):
+        calls.append(args)
+        open(os.path.join(cwd, 'Test Title.m4a'), 'w').close()
+
+    _fake_download(mocker, run)
+
+    SubprocessBackend().download_video(
+        _TEST_VIDEO_ID,
+        str(tmp_path),
+        download_format=DownloadFormat(
+            selector='bestaudio',
+            merge_output_format='mp4',
+        ),
+    )
+
+    assert calls == [[
+        'youtube-dl',
+        '--newline',
+        '--format', 'bestaudio',
+        '--merge-output-format', 'mp4',
+        '--', _TEST_VIDEO_ID,
+    ]]
+
+
+def test_subprocess_backend_downloads_videos_whose_ids_look_like_options(
+    tmp_path,
+    mocker,
+):
+    calls = []
+
+    def run(args, cwd):
+        calls.append(args)
+        open(os.path.join(cwd, 'Test Title.mp4'), 'w').close()
+
+    _fake_download(mocker, run)
+
+    SubprocessBackend().download_video('-aBcDeFgHiJ', str(tmp_path))
+
+    assert calls[0][-2:] == ['--', '-aBcDeFgHiJ']
+
+
+def test_subprocess_backend_leaves_streams_for_postprocessing(
+    tmp_path,
+    mocker,
+):
+    calls = []
+
+    def run(args, cwd):
+        calls.append(args)
+        for name in ['Test Title.f137.mp4', 'Test Title.f140.m4a']:
+            open(os.path.join(cwd, name), 'w').close()
+
+    _fake_download(mocker, run)
+
+    staging = SubprocessBackend().download_video(
+        _TEST_VIDEO_ID,
+        str(tmp_path),
+        download_format=DownloadFormat(postprocess=False),
+    )
+
+    assert calls[0][2:-2] == [
+        '--format', 'bestvideo+bestaudio/best',
+        '--ffmpeg-location', os.devnull,
+    ]
+    assert sorted(os.listdir(staging)) == [
+        'Test Title.f137.mp4',
+        'Test Title.f140.m4a',
+    ]
+    assert _listdir(tmp_path) == []
+
+
+def test_postprocess_merges_streams(tmp_path, mocker):
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    for name in ['Test Title.f137.mp4', 'Test Title.f140.m4a']:
+        (staging / name).write_text('')
+
+    calls = []
+
+    def run(args, cwd, **kwargs):
+        calls.append(args)
+        open(os.path.join(cwd, args[-1]), 'w').close()
+
+    mocker.patch.object(subprocess, 'run', run)
+
+    filename = postprocess(str(staging), str(tmp_path))
+
+    assert filename == 'Test Title.mp4'
+    assert calls == [[
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-i', 'Test Title.f137.mp4',
+        '-i', 'Test Title.f140.m4a',
+        '-c', 'copy', '-map', '0', '-map', '1',
+        'Test Title.mp4',
+    ]]
+    assert _listdir(tmp_path) == ['Test Title.mp4']
+
+
+def test_postprocess_keeps_streams_when_merging_fails(tmp_path, mocker):
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    for name in ['Test Title.f137.webm', 'Test Title.f140.m4a']:
+        (staging / name).write_text('')
+
+    def run(args, cwd, **kwargs):
+        assert args[-1] == 'Test Title.mkv'
+        open(os.path.join(cwd, args[-1]), 'w').close()
+        raise subprocess.CalledProcessError(1, args, stderr='Broken\n')
+
+    mocker.patch.object(subprocess, 'run', run)
+
+    with pytest.raises(PostProcessingError, match='Broken'):
+        postprocess(str(staging), str(tmp_path))
+
+    assert sorted(os.listdir(str(staging))) == [
+        'Test Title.f137.webm',
+        'Test Title.f140.m4a',
+    ]
+
+
+def _postprocess(tmp_path, mocker, names, download_format):
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    for name in names:
+        (staging / name).write_text('')
+
+    calls = []
+
+    def run(args, cwd, **kwargs):
+        calls.append(args)
+        open(os.path.join(cwd, args[-1]), 'w').close()
+
+    mocker.patch.object(subprocess, 'run', run)
+
+    return postprocess(str(staging), str(tmp_path), download_format), calls
+
+
+def test_postprocess_extracts_audio_with_cover_art(tmp_path, mocker):
+    filename, calls = _postprocess(
+        tmp_path,
+        mocker,
+        ['Test Title.f137.mp4', 'Test Title.f140.m4a', 'Test Title.jpg'],
+        DownloadFormat(extract_audio=True, embed_thumbnail=True),
+    )
+
+    assert filename == 'Test Title.m4a'
+    assert calls == [[
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-i', 'Test Title.jpg',
+        '-i', 'Test Title.f137.mp4',
+        '-i', 'Test Title.f140.m4a',
+        '-c', 'copy', '-c:v:0', 'mjpeg', '-disposition:0', 'attached_pic',
+        '-map', '0', '-map', '1:a', '-map', '2:a',
+        'Test Title.m4a',
+    ]]
+    assert _listdir(tmp_path) == ['Test Title.m4a']
+
+
+def test_postprocess_transcodes_into_incompatible_containers(
+    tmp_path,
+    mocker,
+):
+    filename, calls = _postprocess(
+        tmp_path,
+        mocker,
+        ['Test Title.f248.webm', 'Test Title.f140.m4a'],
+        DownloadFormat(merge_output_format='mp4'),
+    )
+
+    assert filename == 'Test Title.mp4'
+    assert calls == [[
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-i', 'Test Title.f140.m4a',
+        '-i', 'Test Title.f248.webm',
+        '-c', 'copy', '-c:v', 'libx264', '-c:a', 'aac',
+        '-map', '0', '-map', '1',
+        'Test Title.mp4',
+    ]]
+
+
+def test_postprocess_fixes_up_dash_m4a(tmp_path, mocker):
+    filename, calls = _postprocess(
+        tmp_path,
+        mocker,
+        ['Test Title.m4a'],
+        DownloadFormat(),
+    )
+
+    assert filename == 'Test Title.m4a'
+    assert calls[0][-1] == 'Test Title.postprocessed.m4a'
+    assert _listdir(tmp_path) == ['Test Title.m4a']
+
+
+def test_postprocess_attaches_thumbnails_to_matroska(tmp_path, mocker):
+    filename, calls = _postprocess(
+        tmp_path,
+        mocker,
+        ['Test Title.webm', 'Test Title.webp'],
+        DownloadFormat(merge_output_format='mkv', embed_thumbnail=True),
+    )
+
+    assert filename == 'Test Title.mkv'
+    assert calls == [[
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-i', 'Test Title.webm',
+        '-c', 'copy', '-map', '0',
+        '-attach', 'Test Title.webp', '-metadata:s:t', 'mimetype=image/webp',
+        'Test Title.mkv',
+    ]]
+
+
+def test_postprocess_leaves_lone_streams_and_drops_thumbnails(
+    tmp_path,
+    mocker,
+):
+    filename, calls = _postprocess(
+        tmp_path,
+        mocker,
+        ['Test Title.webm', 'Test Title.jpg'],
+        DownloadFormat(embed_thumbnail=True),
+    )
+
+    assert filename == 'Test Title.webm'
+    assert calls == []
+    assert _listdir(tmp_path) == ['Test Title.webm']
+
+
+def test_postprocess_fails_without_ffmpeg(tmp_path, mocker):
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    for name in ['Test Title.f137.mp4', 'Test Title.f140.m4a']:
+        (staging / name).write_text('')
+
+    mocker.patch.object(subprocess, 'run', side_effect=FileNotFoundError(
+        'ffmpeg',
+    ))
+
+    with pytest.raises(PostProcessingError, match='ffmpeg'):
+        postprocess(str(staging), str(tmp_path))
+
+
+@pytest.mark.django_db
+@override_settings(DOWNLOAD_POSTPROCESS_WORKERS=2)
+def test_download_pending_marks_videos_downloaded_after_postprocessing(
+    tmp_path,
+    mocker,
+):
+    _create_videos(2)
+
+    def download_video(youtube_id, directory, **kwargs):
+        staging = _fake_download_video(youtube_id, directory, **kwargs)
+        if youtube_id == 'testID1':
+            # Not streams that could be merged.
+            open(os.path.join(staging, 'Unexpected.mp4'), 'w').close()
+
+        return staging
+
+    mocker.patch.object(DownloaderAppConfig, 'download_video', download_video)
+
+    _download_pending(tmp_path)
+
+    merged, broken = Video.objects.order_by('youtube_id')
+    assert merged.downloaded is not None
+    assert broken.downloaded is None
+    assert 'TooManyFilesCreatedError' in broken.download_job.last_error
+
+
+@pytest.mark.django_db
+def test_download_pending_renews_leases_while_draining_postprocessing(
+    mocker,
+):
+    video, = _create_videos(1)
+    DownloadJob.objects.enqueue(Video.objects.all())
+
+    command = DownloadPendingCommand()
+    command.owner = 'test'
+    command.pool = DownloadPool(directory=None, heartbeat_interval=0.05)
+    job, = DownloadJob.objects.claim(command.owner, 1)
+    task = Task(key=None, youtube_id=video.youtube_id, payload=job)
+
+    # Still being post-processed once the downloads are all done.
+    future = concurrent.futures.Future()
+    command.postprocessing = {future: task}
+    threading.Timer(0.5, future.set_result, ['Test Title.mp4']).start()
+
+    renew = mocker.spy(DownloadJob.objects, 'renew')
+    on_success = mocker.patch.object(command, 'on_success')
+
+    command.finish_postprocessing(wait=True)
+
+    on_success.assert_called_once_with(task, 'Test Title.mp4')
+    assert renew.call_count >= 5
+    assert command.postprocessing == {}